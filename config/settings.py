@@ -18,7 +18,9 @@ env = environ.Env(
     DJANGO_ALLOWED_HOSTS=(list, []),
     DJANGO_STATIC_ROOT=(str, str(APPS_DIR('staticfiles'))),
     DJANGO_MEDIA_ROOT=(str, str(APPS_DIR('media'))),
+    DJANGO_CHAT_ARCHIVE_ROOT=(str, str(ROOT_DIR('archive'))),
     DJANGO_DATABASE_URL=(str, 'postgis:///django_aiohttp_websockets'),
+    DJANGO_DATABASE_REPLICA_URLS=(list, []),
     DJANGO_EMAIL_URL=(environ.Env.email_url_config, 'consolemail://'),
     DJANGO_DEFAULT_FROM_EMAIL=(str, 'admin@example.com'),
     DJANGO_EMAIL_BACKEND=(str, 'django.core.mail.backends.smtp.EmailBackend'),
@@ -56,6 +58,15 @@ DATABASES = {
     'default': env.db('DJANGO_DATABASE_URL')
 }
 
+# Read-only websocket actions are served by these replicas, see websockets.core.routers
+DATABASE_REPLICAS = []
+for index, url in enumerate(env.list('DJANGO_DATABASE_REPLICA_URLS'), start=1):
+    alias = 'replica_%s' % index
+    DATABASES[alias] = dict(env.db_url_config(url), TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['django_aiohttp_websockets.websockets.core.routers.ReplicaRouter']
+
 DJANGO_APPS = (
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -140,6 +151,9 @@ STATIC_ROOT = env('DJANGO_STATIC_ROOT')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = env('DJANGO_MEDIA_ROOT')
 
+# Detached chat message partitions are exported here as gzipped COPY files
+CHAT_ARCHIVE_ROOT = env('DJANGO_CHAT_ARCHIVE_ROOT')
+
 STATICFILES_DIRS = (
     str(APPS_DIR.path('static')),
 )
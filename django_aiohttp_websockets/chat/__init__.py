@@ -0,0 +1 @@
+default_app_config = 'django_aiohttp_websockets.chat.apps.ChatConfig'
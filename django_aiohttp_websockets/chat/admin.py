@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from django_aiohttp_websockets.chat.models import ChatMessage, ChatRoom
+from django_aiohttp_websockets.chat.models import ChatMessage, ChatRoom, ChatRoomUserState
 
 
 @admin.register(ChatRoom)
@@ -11,3 +11,8 @@ class ChatRoomAdmin(admin.ModelAdmin):
 @admin.register(ChatMessage)
 class ChatMessageAdmin(admin.ModelAdmin):
     pass
+
+
+@admin.register(ChatRoomUserState)
+class ChatRoomUserStateAdmin(admin.ModelAdmin):
+    pass
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class ChatConfig(AppConfig):
     name = 'django_aiohttp_websockets.chat'
+
+    def ready(self):
+        from django_aiohttp_websockets.chat import signals  # noqa
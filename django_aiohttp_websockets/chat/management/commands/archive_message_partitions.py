@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.utils import timezone
+
+from django_aiohttp_websockets.chat import partitioning
+
+
+class Command(BaseCommand):
+    help = 'Moves monthly chat message partitions older than given number of months to compressed archive files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, required=True, help='Age of archived partitions in months')
+        parser.add_argument('--directory', type=str, default=settings.CHAT_ARCHIVE_ROOT)
+        parser.add_argument('--dry-run', action='store_true', default=False)
+
+    def handle(self, *args, **options):
+        if not partitioning.is_partitioned():
+            raise CommandError('Chat messages table is not partitioned')
+        if options['older_than'] < 1:
+            raise CommandError('Current month can not be archived')
+
+        # Partition is cold when its whole range is before the cutoff
+        cutoff = partitioning.add_months(partitioning.month_start(timezone.now()), -options['older_than'])
+        partitions = [(partitioning.add_months(start, 1), name) for start, name in partitioning.list_partitions()]
+        # Messages from before partitioning are archived in one piece once the month they end with is cold
+        legacy = partitioning.legacy_partition()
+        if legacy is not None:
+            partitions.insert(0, legacy)
+
+        for end, name in partitions:
+            if end > cutoff:
+                break
+
+            if options['dry_run']:
+                self.stdout.write('Would archive partition %s' % name)
+                continue
+
+            path = partitioning.archive_partition(name, options['directory'])
+            self.stdout.write('Archived partition %s to %s' % (name, path))
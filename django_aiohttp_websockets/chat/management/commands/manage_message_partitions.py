@@ -0,0 +1,19 @@
+from django.core.management import BaseCommand, CommandError
+from django.utils import timezone
+
+from django_aiohttp_websockets.chat import partitioning
+
+
+class Command(BaseCommand):
+    help = 'Creates upcoming monthly partitions of the chat messages table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=partitioning.PARTITIONS_AHEAD)
+
+    def handle(self, *args, **options):
+        if not partitioning.is_partitioned():
+            raise CommandError('Chat messages table is not partitioned')
+
+        until = partitioning.add_months(partitioning.month_start(timezone.now()), options['months_ahead'])
+        for name in partitioning.create_partitions(until):
+            self.stdout.write('Created partition %s' % name)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_room_summary(apps, schema_editor):
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+    ChatRoomUserState = apps.get_model('chat', 'ChatRoomUserState')
+
+    for room in ChatRoom.objects.all().iterator():
+        user_pks = list(room.users.values_list('pk', flat=True))
+        last_message = ChatMessage.objects.filter(room=room).order_by('-date_created').first()
+
+        room.member_count = len(user_pks)
+        if last_message:
+            room.last_message_id = last_message.pk
+            room.last_message_text = last_message.text[:255]
+            room.last_message_date = last_message.date_created
+        room.save()
+
+        # Existing history counts as read
+        ChatRoomUserState.objects.bulk_create([
+            ChatRoomUserState(room=room, user_id=user_pk, last_read_message_id=room.last_message_id)
+            for user_pk in user_pks
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chat', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_date',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Last message date'),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_id',
+            field=models.IntegerField(blank=True, null=True, verbose_name='Last message ID'),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_text',
+            field=models.CharField(blank=True, max_length=255, verbose_name='Last message'),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='member_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Members count'),
+        ),
+        migrations.CreateModel(
+            name='ChatRoomUserState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_message_id', models.IntegerField(blank=True, null=True, verbose_name='Last read message ID')),
+                ('unread_count', models.PositiveIntegerField(default=0, verbose_name='Unread messages')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_states', to='chat.ChatRoom', verbose_name='Chat room ID')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_room_states', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='chatroomuserstate',
+            unique_together=set([('room', 'user')]),
+        ),
+        migrations.RunPython(fill_room_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def partition_messages(apps, schema_editor):
+    from django_aiohttp_websockets.chat import partitioning
+
+    # Other databases keep the plain table, history queries work the same on both. Postgres builds the
+    # (room, date_created) index concurrently as a part of partitioning.
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.alter_index_together(
+            apps.get_model('chat', 'ChatMessage'), set(), {('room', 'date_created')})
+    elif not partitioning.is_partitioned(schema_editor.connection):
+        partitioning.partition_table(schema_editor.connection)
+
+
+def unpartition_messages(apps, schema_editor):
+    from django_aiohttp_websockets.chat import partitioning
+
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.alter_index_together(
+            apps.get_model('chat', 'ChatMessage'), {('room', 'date_created')}, set())
+    elif partitioning.is_partitioned(schema_editor.connection):
+        partitioning.unpartition_table(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+    # Concurrent index builds can not run in a transaction, partition_table commits its own steps
+    atomic = False
+
+    dependencies = [
+        ('chat', '0002_room_summary'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AlterIndexTogether(
+                name='chatmessage',
+                index_together=set([('room', 'date_created')]),
+            ),
+        ]),
+        migrations.RunPython(partition_messages, unpartition_messages),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from django_aiohttp_websockets.chat import search
+
+    for statement in search.forward_sql(schema_editor.connection.vendor):
+        schema_editor.execute(statement)
+    if schema_editor.connection.vendor == 'postgresql':
+        search.backfill_search_vector(schema_editor.connection)
+        search.create_search_index(schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    from django_aiohttp_websockets.chat import search
+
+    for statement in search.backward_sql(schema_editor.connection.vendor):
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+    # Backfill commits in batches and the GIN index is built concurrently, neither can run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('chat', '0003_partition_messages'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
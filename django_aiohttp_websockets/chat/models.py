@@ -1,24 +1,100 @@
+import datetime
 import uuid
 
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
 
+LAST_MESSAGE_TEXT_LENGTH = 255
+HISTORY_SIZE = 20
+HISTORY_WINDOW = datetime.timedelta(days=31)
+UNREAD_COUNT_LIMIT = 100  # unread messages counted from history, clients show more as the limit
+
+
 class ChatRoom(models.Model):
     id = models.UUIDField(verbose_name=_('Room ID'), primary_key=True, default=uuid.uuid4, editable=False)
     date_created = models.DateTimeField(verbose_name=_('Created'), auto_now_add=True)
     users = models.ManyToManyField(settings.AUTH_USER_MODEL, verbose_name=_('User'))
+    # Denormalized summary, maintained by the message worker and chat.signals
+    member_count = models.PositiveIntegerField(verbose_name=_('Members count'), default=0)
+    last_message_id = models.IntegerField(verbose_name=_('Last message ID'), null=True, blank=True)
+    last_message_text = models.CharField(
+        verbose_name=_('Last message'), max_length=LAST_MESSAGE_TEXT_LENGTH, blank=True)
+    last_message_date = models.DateTimeField(verbose_name=_('Last message date'), null=True, blank=True, db_index=True)
 
     def __str__(self):
         return 'Room {}'.format(self.id)
 
 
+class ChatMessageQuerySet(models.QuerySet):
+
+    def history(self, room_id, limit=HISTORY_SIZE):
+        # Latest messages of the room, oldest first. The recent window is tried first, so on a partitioned table
+        # only the newest partitions are scanned for active rooms.
+        messages = self.filter(room_id=room_id).select_related('user', 'room').order_by('-date_created')
+        recent = list(messages.filter(date_created__gte=timezone.now() - HISTORY_WINDOW)[:limit])
+        if len(recent) < limit:
+            recent = list(messages[:limit])
+        return list(reversed(recent))
+
+
 class ChatMessage(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, verbose_name=_('User'))
     room = models.ForeignKey('chat.ChatRoom', verbose_name=_('Chat room ID'), related_name='messages')
     date_created = models.DateTimeField(verbose_name=_('Created'), auto_now_add=True)
     text = models.TextField(verbose_name=_('Message'))
 
+    objects = ChatMessageQuerySet.as_manager()
+
+    class Meta:
+        index_together = ('room', 'date_created')
+
     def __str__(self):
         return 'Message from {}'.format(self.user)
+
+
+class ChatRoomUserStateQuerySet(models.QuerySet):
+
+    def with_unread_counts(self, large_room_members, limit=UNREAD_COUNT_LIMIT):
+        # Counters of large rooms are not maintained per member, their unread_count is replaced by the messages
+        # after the last read one, at most limit. Counted in the same query for all rooms, the date bound keeps the
+        # count on the (room, date_created) index and, on a partitioned table, in the newest partitions.
+        unread_count = (
+            'CASE WHEN {rooms}.{member_count} >= %s THEN ('
+            'SELECT COUNT(*) FROM ('
+            'SELECT 1 FROM {messages} unread WHERE unread.{room} = {states}.{room} '
+            'AND ({states}.{last_read} IS NULL OR (unread.{pk} > {states}.{last_read} AND unread.{date_created} >= '
+            'COALESCE((SELECT {date_created} FROM {messages} WHERE {pk} = {states}.{last_read}), '
+            'unread.{date_created}))) '
+            'LIMIT %s) counted'
+            ') ELSE {states}.{unread} END'
+        ).format(
+            rooms=ChatRoom._meta.db_table,
+            member_count=ChatRoom._meta.get_field('member_count').column,
+            messages=ChatMessage._meta.db_table,
+            room=ChatMessage._meta.get_field('room').column,
+            pk=ChatMessage._meta.pk.column,
+            date_created=ChatMessage._meta.get_field('date_created').column,
+            states=self.model._meta.db_table,
+            last_read=self.model._meta.get_field('last_read_message_id').column,
+            unread=self.model._meta.get_field('unread_count').column,
+        )
+        return self.select_related('room').extra(
+            select={'current_unread_count': unread_count}, select_params=(large_room_members, limit))
+
+
+class ChatRoomUserState(models.Model):
+    room = models.ForeignKey('chat.ChatRoom', verbose_name=_('Chat room ID'), related_name='user_states')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, verbose_name=_('User'), related_name='chat_room_states')
+    last_read_message_id = models.IntegerField(verbose_name=_('Last read message ID'), null=True, blank=True)
+    unread_count = models.PositiveIntegerField(verbose_name=_('Unread messages'), default=0)
+
+    objects = ChatRoomUserStateQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('room', 'user')
+
+    def __str__(self):
+        return 'State of {} for {}'.format(self.room, self.user)
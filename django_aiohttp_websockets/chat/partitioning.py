@@ -0,0 +1,203 @@
+import datetime
+import gzip
+import os
+import re
+
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from django_aiohttp_websockets.chat.models import ChatMessage, ChatRoom
+
+
+# Messages are range partitioned by month of date_created (PostgreSQL 11+). Rows created before the table was
+# partitioned live in the legacy partition, rows outside of the created partitions in the default one.
+PARTITION_NAME_FORMAT = '{table}_p%Y_%m'
+LEGACY_PARTITION_SUFFIX = '_legacy'
+DEFAULT_PARTITION_SUFFIX = '_default'
+PARTITIONS_AHEAD = 3  # months created in advance by manage_message_partitions
+
+
+def month_start(value):
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(value, months):
+    month = value.month - 1 + months
+    return value.replace(year=value.year + month // 12, month=month % 12 + 1)
+
+
+def partition_name(start):
+    return start.strftime(PARTITION_NAME_FORMAT.format(table=ChatMessage._meta.db_table))
+
+
+def _partition_start(name):
+    match = re.match(r'^%s_p(\d{4})_(\d{2})$' % re.escape(ChatMessage._meta.db_table), name)
+    if match is None:
+        return None
+    return datetime.datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=datetime.timezone.utc)
+
+
+def is_partitioned(using=connection):
+    if using.vendor != 'postgresql':
+        return False
+
+    with using.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass', [ChatMessage._meta.db_table])
+        return cursor.fetchone() is not None
+
+
+def _columns():
+    return {
+        'table': ChatMessage._meta.db_table,
+        'pk': ChatMessage._meta.pk.column,
+        'user': ChatMessage._meta.get_field('user').column,
+        'room': ChatMessage._meta.get_field('room').column,
+        'date_created': ChatMessage._meta.get_field('date_created').column,
+        'users_table': ChatMessage._meta.get_field('user').related_model._meta.db_table,
+        'users_pk': ChatMessage._meta.get_field('user').related_model._meta.pk.column,
+        'rooms_table': ChatRoom._meta.db_table,
+        'rooms_pk': ChatRoom._meta.pk.column,
+    }
+
+
+def partition_table(using=connection):
+    # Turns the plain messages table into a partitioned one. The existing table is attached as is, so no rows are
+    # copied and history stays readable through the parent table. Needs autocommit (non-atomic migration): the slow
+    # steps only take locks that let writes through and the attach itself does not scan the table.
+    names = _columns()
+    names['legacy'] = names['table'] + LEGACY_PARTITION_SUFFIX
+    names['default'] = names['table'] + DEFAULT_PARTITION_SUFFIX
+    first_month = add_months(month_start(timezone.now()), 1)
+    names['first_month'] = first_month
+
+    with using.cursor() as cursor:
+        cursor.execute("SELECT pg_get_serial_sequence('{table}', '{pk}')".format(**names))
+        names['sequence'] = cursor.fetchone()[0]
+        prepare = [
+            # Indexes matching the ones of the partitioned table, attach reuses them instead of building new ones
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS {legacy}_room_date ON {table} ({room}, {date_created})',
+            'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {legacy}_pk_date ON {table} ({pk}, {date_created})',
+            # Attach only adopts a constraint backed index for the primary key of the partitioned table
+            'ALTER TABLE {table} ADD CONSTRAINT {legacy}_pk_date UNIQUE USING INDEX {legacy}_pk_date',
+            # Proves the partition bound, so attach skips its full scan. Validation does not block writes.
+            "ALTER TABLE {table} ADD CONSTRAINT {legacy}_bound CHECK ({date_created} < '{first_month}') NOT VALID",
+            'ALTER TABLE {table} VALIDATE CONSTRAINT {legacy}_bound',
+        ]
+        for statement in prepare:
+            cursor.execute(statement.format(**names))
+
+        swap = [
+            'ALTER TABLE {table} RENAME TO {legacy}',
+            'CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS) PARTITION BY RANGE ({date_created})',
+            'ALTER SEQUENCE {sequence} OWNED BY {table}.{pk}',
+            # Partition key has to be a part of the primary key
+            'ALTER TABLE {table} ADD PRIMARY KEY ({pk}, {date_created})',
+            'CREATE INDEX {table}_room_date ON {table} ({room}, {date_created})',
+            'CREATE INDEX {table}_user ON {table} ({user})',
+            'ALTER TABLE {table} ADD FOREIGN KEY ({user}) REFERENCES {users_table} ({users_pk}) '
+            'DEFERRABLE INITIALLY DEFERRED',
+            'ALTER TABLE {table} ADD FOREIGN KEY ({room}) REFERENCES {rooms_table} ({rooms_pk}) '
+            'DEFERRABLE INITIALLY DEFERRED',
+            "ALTER TABLE {table} ATTACH PARTITION {legacy} FOR VALUES FROM (MINVALUE) TO ('{first_month}')",
+            'ALTER TABLE {legacy} DROP CONSTRAINT {legacy}_bound',
+            'CREATE TABLE {default} PARTITION OF {table} DEFAULT',
+        ]
+        # The rename takes the table lock, held only until the attach commits
+        with transaction.atomic(using=using.alias):
+            for statement in swap:
+                cursor.execute(statement.format(**names))
+
+    create_partitions(add_months(first_month, PARTITIONS_AHEAD), using=using)
+
+
+def unpartition_table(using=connection):
+    names = _columns()
+    names['plain'] = names['table'] + '_plain'
+    with transaction.atomic(using=using.alias), using.cursor() as cursor:
+        cursor.execute("SELECT pg_get_serial_sequence('{table}', '{pk}')".format(**names))
+        names['sequence'] = cursor.fetchone()[0]
+        statements = [
+            'CREATE TABLE {plain} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING INDEXES)',
+            'INSERT INTO {plain} SELECT * FROM {table}',
+            'ALTER SEQUENCE {sequence} OWNED BY {plain}.{pk}',
+            'DROP TABLE {table}',
+            'ALTER TABLE {plain} RENAME TO {table}',
+            'ALTER TABLE {table} DROP CONSTRAINT {plain}_pkey',
+            'ALTER TABLE {table} ADD PRIMARY KEY ({pk})',
+            'ALTER TABLE {table} ADD FOREIGN KEY ({user}) REFERENCES {users_table} ({users_pk}) '
+            'DEFERRABLE INITIALLY DEFERRED',
+            'ALTER TABLE {table} ADD FOREIGN KEY ({room}) REFERENCES {rooms_table} ({rooms_pk}) '
+            'DEFERRABLE INITIALLY DEFERRED',
+        ]
+        for statement in statements:
+            cursor.execute(statement.format(**names))
+
+
+def all_partitions(using=connection):
+    # Names of every partition, including the legacy and default ones
+    with using.cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname FROM pg_inherits '
+            'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+            'WHERE pg_inherits.inhparent = %s::regclass', [ChatMessage._meta.db_table])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def list_partitions(using=connection):
+    # Monthly partitions as (start, name), oldest first
+    names = all_partitions(using=using)
+    return sorted((_partition_start(name), name) for name in names if _partition_start(name))
+
+
+def legacy_partition(using=connection):
+    # The pre-partitioning table as (end, name), None once archived. It covers everything before its upper bound.
+    with using.cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) FROM pg_inherits '
+            'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+            'WHERE pg_inherits.inhparent = %s::regclass AND child.relname = %s',
+            [ChatMessage._meta.db_table, ChatMessage._meta.db_table + LEGACY_PARTITION_SUFFIX])
+        row = cursor.fetchone()
+
+    if row is None:
+        return None
+    match = re.search(r"TO \('([^']+)'\)", row[1])
+    return parse_datetime(match.group(1)), row[0]
+
+
+def create_partitions(until, using=connection):
+    # Creates monthly partitions after the newest existing one up to the month of `until`
+    existing = list_partitions(using=using)
+    if existing:
+        start = add_months(existing[-1][0], 1)
+    else:
+        start = add_months(month_start(timezone.now()), 1)
+
+    created = []
+    with using.cursor() as cursor:
+        while start <= month_start(until):
+            end = add_months(start, 1)
+            cursor.execute("CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM ('{start}') TO ('{end}')".format(
+                name=partition_name(start), table=ChatMessage._meta.db_table, start=start, end=end))
+            created.append(partition_name(start))
+            start = end
+    return created
+
+
+def archive_partition(name, directory, using=connection):
+    # Exports the partition as a gzipped COPY file, then detaches and drops it. History older than the archived
+    # partitions is no longer served by select_room. Only writes to this partition wait for the export, the parent
+    # table is locked just for the detach at the end.
+    path = os.path.join(directory, '%s.copy.gz' % name)
+    os.makedirs(directory, exist_ok=True)
+    with transaction.atomic(using=using.alias):
+        with using.cursor() as cursor:
+            cursor.execute('LOCK TABLE {name} IN SHARE MODE'.format(name=name))
+            with gzip.open(path, 'wb') as archive:
+                cursor.copy_expert('COPY {name} TO STDOUT'.format(name=name), archive)
+            cursor.execute('ALTER TABLE {table} DETACH PARTITION {name}'.format(
+                table=ChatMessage._meta.db_table, name=name))
+            cursor.execute('DROP TABLE {name}'.format(name=name))
+    return path
@@ -0,0 +1,148 @@
+from django.db import connection, transaction
+
+from django_aiohttp_websockets.chat import partitioning
+from django_aiohttp_websockets.chat.models import ChatMessage
+
+
+# Postgres keeps a tsvector column filled by a trigger with a GIN index, SQLite an external content FTS5 table kept
+# in sync by triggers. Both are updated by the insert itself, so there is nothing to reindex.
+SEARCH_CONFIG = 'simple'  # text search configuration of the tsvector column, changing it needs a new migration
+SEARCH_VECTOR_COLUMN = 'search_vector'
+SEARCH_PAGE_SIZE = 20
+SEARCH_BACKFILL_BATCH_SIZE = 10000  # ids per committed backfill update
+
+
+class SearchNotSupported(Exception):
+    pass
+
+
+def fts_table():
+    return '%s_fts' % ChatMessage._meta.db_table
+
+
+def _names():
+    return {
+        'table': ChatMessage._meta.db_table,
+        'pk': ChatMessage._meta.pk.column,
+        'text': ChatMessage._meta.get_field('text').column,
+        'column': SEARCH_VECTOR_COLUMN,
+        'fts': fts_table(),
+        'config': SEARCH_CONFIG,
+    }
+
+
+def forward_sql(vendor):
+    if vendor == 'postgresql':
+        # A nullable column without a default is added without rewriting the partitions. Existing rows are filled
+        # by backfill_search_vector and indexed by create_search_index afterwards. Row triggers on a partitioned
+        # table need PostgreSQL 13+.
+        statements = [
+            'ALTER TABLE {table} ADD COLUMN {column} tsvector',
+            'CREATE FUNCTION {table}_{column}_update() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN '
+            "NEW.{column} := to_tsvector('{config}'::regconfig, NEW.{text}); RETURN NEW; END $$",
+            'CREATE TRIGGER {table}_{column} BEFORE INSERT OR UPDATE OF {text} ON {table} '
+            'FOR EACH ROW EXECUTE PROCEDURE {table}_{column}_update()',
+        ]
+    elif vendor == 'sqlite':
+        statements = [
+            "CREATE VIRTUAL TABLE {fts} USING fts5({text}, content='{table}', content_rowid='{pk}')",
+            'INSERT INTO {fts} (rowid, {text}) SELECT {pk}, {text} FROM {table}',
+            'CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN '
+            'INSERT INTO {fts} (rowid, {text}) VALUES (new.{pk}, new.{text}); END',
+            'CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN '
+            "INSERT INTO {fts} ({fts}, rowid, {text}) VALUES ('delete', old.{pk}, old.{text}); END",
+            'CREATE TRIGGER {fts}_update AFTER UPDATE ON {table} BEGIN '
+            "INSERT INTO {fts} ({fts}, rowid, {text}) VALUES ('delete', old.{pk}, old.{text}); "
+            'INSERT INTO {fts} (rowid, {text}) VALUES (new.{pk}, new.{text}); END',
+        ]
+    else:
+        statements = []
+    return [statement.format(**_names()) for statement in statements]
+
+
+def backward_sql(vendor):
+    if vendor == 'postgresql':
+        statements = [
+            'DROP TRIGGER {table}_{column} ON {table}',
+            'DROP FUNCTION {table}_{column}_update()',
+            'ALTER TABLE {table} DROP COLUMN {column}',
+        ]
+    elif vendor == 'sqlite':
+        statements = [
+            'DROP TRIGGER {fts}_insert', 'DROP TRIGGER {fts}_delete', 'DROP TRIGGER {fts}_update', 'DROP TABLE {fts}',
+        ]
+    else:
+        statements = []
+    return [statement.format(**_names()) for statement in statements]
+
+
+def backfill_search_vector(using=connection, batch_size=SEARCH_BACKFILL_BATCH_SIZE):
+    # Fills the column of rows written before the trigger existed. Every id range is its own transaction, so row
+    # locks are short and concurrent writes only wait for one batch.
+    names = _names()
+    with using.cursor() as cursor:
+        cursor.execute('SELECT min({pk}), max({pk}) FROM {table}'.format(**names))
+        low, high = cursor.fetchone()
+        if low is None:
+            return
+
+        statement = (
+            "UPDATE {table} SET {column} = to_tsvector('{config}'::regconfig, {text}) "
+            'WHERE {pk} >= %s AND {pk} < %s AND {column} IS NULL'
+        ).format(**names)
+        while low <= high:
+            with transaction.atomic(using=using.alias):
+                cursor.execute(statement, [low, low + batch_size])
+            low += batch_size
+
+
+def create_search_index(using=connection):
+    # Needs autocommit. A partitioned table can not be indexed concurrently, so its index is created invalid on the
+    # parent only and becomes valid once the concurrently built index of every partition is attached. Partitions
+    # created later get the index from the parent.
+    names = _names()
+    with using.cursor() as cursor:
+        if not partitioning.is_partitioned(using):
+            cursor.execute('CREATE INDEX CONCURRENTLY {table}_{column} ON {table} USING GIN ({column})'.format(**names))
+            return
+
+        cursor.execute('CREATE INDEX {table}_{column} ON ONLY {table} USING GIN ({column})'.format(**names))
+        for partition in partitioning.all_partitions(using=using):
+            cursor.execute('CREATE INDEX CONCURRENTLY {partition}_{column} ON {partition} USING GIN ({column})'.format(
+                partition=partition, **names))
+            cursor.execute('ALTER INDEX {table}_{column} ATTACH PARTITION {partition}_{column}'.format(
+                partition=partition, **names))
+
+
+def _fts_query(query):
+    # Every word is matched literally, FTS5 operators in user input are not interpreted
+    return ' '.join('"%s"' % word.replace('"', '""') for word in query.split())
+
+
+def search_messages(user_pk, query, room_id=None, cursor=None, limit=SEARCH_PAGE_SIZE):
+    # Newest matches first, from rooms the user belongs to. cursor is the id of the last message of the previous
+    # page, so pages stay stable while new messages arrive.
+    messages = ChatMessage.objects.filter(room__users__pk=user_pk).select_related('user', 'room')
+    if room_id is not None:
+        messages = messages.filter(room_id=room_id)
+    if cursor is not None:
+        messages = messages.filter(pk__lt=cursor)
+
+    table = ChatMessage._meta.db_table
+    if connection.vendor == 'postgresql':
+        messages = messages.extra(
+            where=["%s.%s @@ plainto_tsquery('%s'::regconfig, %%s)" % (table, SEARCH_VECTOR_COLUMN, SEARCH_CONFIG)],
+            params=[query],
+        )
+    elif connection.vendor == 'sqlite':
+        messages = messages.extra(
+            where=['%s.%s IN (SELECT rowid FROM %s WHERE %s MATCH %%s)' % (
+                table, ChatMessage._meta.pk.column, fts_table(), fts_table())],
+            params=[_fts_query(query)],
+        )
+    else:
+        raise SearchNotSupported('Message search is not supported on %s' % connection.vendor)
+
+    page = list(messages.order_by('-pk')[:limit + 1])
+    next_cursor = page[limit - 1].pk if len(page) > limit else None
+    return page[:limit], next_cursor
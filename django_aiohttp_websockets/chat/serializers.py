@@ -1,7 +1,7 @@
 from rest_framework import serializers
 
 from django_aiohttp_websockets.users.serializers import UserSerializer
-from django_aiohttp_websockets.chat.models import ChatMessage
+from django_aiohttp_websockets.chat.models import ChatMessage, ChatRoomUserState
 
 
 class ChatMessageSerializer(serializers.ModelSerializer):
@@ -18,3 +18,27 @@ class ChatMessageSerializer(serializers.ModelSerializer):
 
     def get_room(self, instance):
         return instance.room.pk.hex
+
+
+class ChatRoomStateSerializer(serializers.ModelSerializer):
+    room = serializers.SerializerMethodField()
+    member_count = serializers.IntegerField(source='room.member_count')
+    last_message = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ChatRoomUserState
+        fields = ('room', 'member_count', 'last_message', 'unread_count', 'last_read_message_id', )
+
+    def get_room(self, instance):
+        return instance.room.pk.hex
+
+    def get_last_message(self, instance):
+        room = instance.room
+        if room.last_message_id is None:
+            return None
+
+        return {
+            'id': room.last_message_id,
+            'text': room.last_message_text,
+            'timestamp': room.last_message_date.timestamp(),
+        }
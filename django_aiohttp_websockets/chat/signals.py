@@ -0,0 +1,68 @@
+import logging
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from django_aiohttp_websockets.chat.models import ChatRoom, ChatRoomUserState
+from django_aiohttp_websockets.websockets.core import settings as websockets_settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def _update_member_counts(room_pks):
+    through = ChatRoom.users.through
+    for room_pk in room_pks:
+        ChatRoom.objects.filter(pk=room_pk).update(member_count=through.objects.filter(chatroom_id=room_pk).count())
+
+
+def _notify_removed_members(pairs):
+    # Frontends deliver large room messages to connections which selected the room, removed members are dropped
+    # from those subscriptions. The in-process transport can't be reached from other processes.
+    if websockets_settings.TRANSPORT == 'inprocess':
+        return
+
+    # Imported here: the synchronous redis client is only needed with the redis transport
+    from django_aiohttp_websockets.websockets.push import pusher
+
+    room_users = defaultdict(list)
+    for room_pk, user_pk in pairs:
+        room_users[room_pk].append(user_pk)
+    try:
+        for room_pk, user_pks in room_users.items():
+            pusher.leave_room(user_pks, room_pk.hex)
+    except Exception as e:
+        logger.error('Exception while notifying frontends about removed room members: %s', e)
+
+
+@receiver(m2m_changed, sender=ChatRoom.users.through)
+def update_room_members(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear', 'post_clear'):
+        return
+
+    if action == 'pre_clear':
+        # Members are gone after the clear, remember them for post_clear
+        related = instance.chatroom_set if reverse else instance.users
+        instance._cleared_pks = set(related.values_list('pk', flat=True))
+        return
+
+    if action == 'post_clear':
+        pk_set = getattr(instance, '_cleared_pks', set())
+
+    pairs = [(pk, instance.pk) if reverse else (instance.pk, pk) for pk in pk_set]
+    if action == 'post_add':
+        existing = set(ChatRoomUserState.objects.filter(
+            room_id__in=[room_pk for room_pk, _ in pairs], user_id__in=[user_pk for _, user_pk in pairs],
+        ).values_list('room_id', 'user_id'))
+        ChatRoomUserState.objects.bulk_create([
+            ChatRoomUserState(room_id=room_pk, user_id=user_pk) for room_pk, user_pk in pairs
+            if (room_pk, user_pk) not in existing
+        ])
+    else:
+        for room_pk, user_pk in pairs:
+            ChatRoomUserState.objects.filter(room_id=room_pk, user_id=user_pk).delete()
+        transaction.on_commit(lambda: _notify_removed_members(pairs))
+
+    _update_member_counts({room_pk for room_pk, _ in pairs})
@@ -0,0 +1,20 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from django_aiohttp_websockets.chat.models import ChatMessage, ChatRoom
+
+User = get_user_model()
+
+
+class ChatTestCase(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.bob = User.objects.create_user(username='bob', password='password')
+        self.room = ChatRoom.objects.create()
+        self.room.users.add(self.alice, self.bob)
+
+    def create_messages(self, *texts, **kwargs):
+        user = kwargs.get('user', self.alice)
+        room = kwargs.get('room', self.room)
+        return [ChatMessage.objects.create(user=user, room=room, text=text) for text in texts]
@@ -0,0 +1,45 @@
+from django_aiohttp_websockets.chat.models import ChatRoom, ChatRoomUserState
+from django_aiohttp_websockets.chat.tests.base import ChatTestCase
+
+
+class UnreadCountTest(ChatTestCase):
+
+    def unread_count(self, large_room_members=2, limit=100, user=None):
+        states = ChatRoomUserState.objects.filter(room=self.room, user=user or self.bob)
+        return states.with_unread_counts(large_room_members, limit=limit).get().current_unread_count
+
+    def test_without_read_messages(self):
+        self.create_messages('one', 'two', 'three')
+        self.assertEqual(self.unread_count(), 3)
+
+    def test_after_last_read_message(self):
+        messages = self.create_messages('one', 'two', 'three')
+        ChatRoomUserState.objects.filter(user=self.bob).update(last_read_message_id=messages[0].pk)
+        self.assertEqual(self.unread_count(), 2)
+        ChatRoomUserState.objects.filter(user=self.bob).update(last_read_message_id=messages[-1].pk)
+        self.assertEqual(self.unread_count(), 0)
+
+    def test_limit(self):
+        self.create_messages('one', 'two', 'three')
+        self.assertEqual(self.unread_count(limit=2), 2)
+
+    def test_other_rooms(self):
+        other_room = ChatRoom.objects.create()
+        other_room.users.add(self.bob)
+        self.create_messages('one', room=other_room)
+        self.assertEqual(self.unread_count(), 0)
+
+    def test_one_query_for_all_rooms(self):
+        other_room = ChatRoom.objects.create()
+        other_room.users.add(self.alice, self.bob)
+        self.create_messages('one', 'two')
+        self.create_messages('three', room=other_room)
+        with self.assertNumQueries(1):
+            states = ChatRoomUserState.objects.filter(user=self.bob).with_unread_counts(2)
+            counts = {state.room_id: state.current_unread_count for state in states}
+        self.assertEqual(counts, {self.room.pk: 2, other_room.pk: 1})
+
+    def test_small_rooms_keep_their_counter(self):
+        self.create_messages('one', 'two', 'three')
+        ChatRoomUserState.objects.filter(user=self.bob).update(unread_count=7)
+        self.assertEqual(self.unread_count(large_room_members=3), 7)
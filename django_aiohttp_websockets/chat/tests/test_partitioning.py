@@ -0,0 +1,100 @@
+import gzip
+import shutil
+import tempfile
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+from django_aiohttp_websockets.chat import partitioning
+from django_aiohttp_websockets.chat.models import ChatMessage, ChatRoom
+from django_aiohttp_websockets.chat.search import search_messages
+
+User = get_user_model()
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Message partitioning is specific to PostgreSQL')
+class PartitioningTest(TransactionTestCase):
+    # Migrations and archiving commit their own steps
+    available_apps = [
+        'django.contrib.auth',
+        'django.contrib.contenttypes',
+        'django_aiohttp_websockets.users',
+        'django_aiohttp_websockets.chat',
+    ]
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.room = ChatRoom.objects.create()
+        self.room.users.add(self.alice)
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('chat', target)])
+
+    def partition_of(self, message):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT tableoid::regclass::text FROM {table} WHERE {pk} = %s'.format(
+                table=ChatMessage._meta.db_table, pk=ChatMessage._meta.pk.column), [message.pk])
+            return cursor.fetchone()[0]
+
+    def primary_key_partitions(self):
+        # Indexes of the partitions attached to the primary key index of the partitioned table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT inhrelid::regclass::text FROM pg_inherits JOIN pg_index ON pg_index.indexrelid = inhparent '
+                'WHERE pg_index.indrelid = %s::regclass AND pg_index.indisprimary', [ChatMessage._meta.db_table])
+            return [row[0] for row in cursor.fetchall()]
+
+    def move_to_month(self, message, start):
+        ChatMessage.objects.filter(pk=message.pk).update(date_created=start + timezone.timedelta(days=1))
+
+    def test_partition_table(self):
+        self.migrate('0002_room_summary')
+        self.assertFalse(partitioning.is_partitioned())
+        old = ChatMessage.objects.create(user=self.alice, room=self.room, text='hello before partitioning')
+
+        self.migrate('0004_message_search')
+        self.assertTrue(partitioning.is_partitioned())
+        legacy_end, legacy = partitioning.legacy_partition()
+        self.assertEqual(legacy_end, partitioning.add_months(partitioning.month_start(timezone.now()), 1))
+        self.assertEqual(self.partition_of(old), legacy)
+        # Attach adopted the index built concurrently before the swap
+        self.assertIn(legacy + '_pk_date', self.primary_key_partitions())
+        self.assertEqual(len(partitioning.list_partitions()), partitioning.PARTITIONS_AHEAD + 1)
+
+        # Rows of the old table stay readable and searchable, ids continue
+        self.assertEqual(list(ChatMessage.objects.history(self.room.pk)), [old])
+        self.assertEqual(search_messages(self.alice.pk, 'partitioning')[0], [old])
+        new = ChatMessage.objects.create(user=self.alice, room=self.room, text='hello after partitioning')
+        self.assertGreater(new.pk, old.pk)
+        self.move_to_month(new, legacy_end)
+        self.assertEqual(self.partition_of(new), partitioning.partition_name(legacy_end))
+
+    def test_create_partitions(self):
+        newest = partitioning.list_partitions()[-1][0]
+        until = partitioning.add_months(newest, 2)
+        created = partitioning.create_partitions(until)
+        self.assertEqual(created, [
+            partitioning.partition_name(partitioning.add_months(newest, 1)), partitioning.partition_name(until),
+        ])
+        self.assertEqual(partitioning.list_partitions()[-1], (until, partitioning.partition_name(until)))
+        self.assertEqual(partitioning.create_partitions(until), [])
+
+    def test_archive_partition(self):
+        start = partitioning.add_months(partitioning.list_partitions()[-1][0], 1)
+        name, = partitioning.create_partitions(start)
+        message = ChatMessage.objects.create(user=self.alice, room=self.room, text='archived')
+        self.move_to_month(message, start)
+        self.assertEqual(self.partition_of(message), name)
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = partitioning.archive_partition(name, directory)
+        with gzip.open(path, 'rt') as archive:
+            self.assertIn('archived', archive.read())
+        self.assertNotIn(name, partitioning.all_partitions())
+        self.assertFalse(ChatMessage.objects.filter(pk=message.pk).exists())
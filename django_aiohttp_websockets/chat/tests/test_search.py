@@ -0,0 +1,87 @@
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+
+from django_aiohttp_websockets.chat import search
+from django_aiohttp_websockets.chat.models import ChatMessage, ChatRoom
+from django_aiohttp_websockets.chat.search import search_messages
+from django_aiohttp_websockets.chat.tests.base import ChatTestCase
+
+User = get_user_model()
+
+
+@skipUnless(connection.vendor in ('sqlite', 'postgresql'), 'Message search is not supported by the database')
+class SearchMessagesTest(ChatTestCase):
+
+    def test_pagination(self):
+        messages = self.create_messages('hello one', 'something else', 'hello two', 'hello three', 'hello four')
+        matching = [message.pk for message in reversed(messages) if 'hello' in message.text]
+
+        page, cursor = search_messages(self.bob.pk, 'hello', limit=2)
+        self.assertEqual([message.pk for message in page], matching[:2])
+        self.assertEqual(cursor, matching[1])
+
+        page, cursor = search_messages(self.bob.pk, 'hello', cursor=cursor, limit=2)
+        self.assertEqual([message.pk for message in page], matching[2:])
+        self.assertIsNone(cursor)
+
+    def test_new_messages_keep_pages_stable(self):
+        messages = self.create_messages('hello one', 'hello two', 'hello three')
+        page, cursor = search_messages(self.bob.pk, 'hello', limit=2)
+        self.create_messages('hello four')
+
+        page, cursor = search_messages(self.bob.pk, 'hello', cursor=cursor, limit=2)
+        self.assertEqual([message.pk for message in page], [messages[0].pk])
+        self.assertIsNone(cursor)
+
+    def test_rooms_of_other_users(self):
+        carol = User.objects.create_user(username='carol', password='password')
+        other_room = ChatRoom.objects.create()
+        other_room.users.add(carol)
+        self.create_messages('hello from carol', user=carol, room=other_room)
+        own = self.create_messages('hello from alice')
+
+        page, cursor = search_messages(self.bob.pk, 'hello')
+        self.assertEqual([message.pk for message in page], [own[0].pk])
+        page, cursor = search_messages(self.bob.pk, 'hello', room_id=other_room.pk)
+        self.assertEqual(page, [])
+
+    def test_query_operators_are_literal(self):
+        self.create_messages('hello world')
+        page, cursor = search_messages(self.bob.pk, 'hello OR "nothing*')
+        self.assertEqual(page, [])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Search vector column is specific to PostgreSQL')
+class SearchVectorTest(ChatTestCase):
+
+    def search_vectors(self, messages):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT {pk}, {column}::text FROM {table} WHERE {pk} IN %s ORDER BY {pk}'.format(
+                pk=ChatMessage._meta.pk.column, column=search.SEARCH_VECTOR_COLUMN, table=ChatMessage._meta.db_table,
+            ), [tuple(message.pk for message in messages)])
+            return [vector for pk, vector in cursor.fetchall()]
+
+    def clear_search_vectors(self):
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE {table} SET {column} = NULL'.format(
+                table=ChatMessage._meta.db_table, column=search.SEARCH_VECTOR_COLUMN))
+
+    def test_trigger(self):
+        message, = self.create_messages('Hello world')
+        self.assertEqual(self.search_vectors([message]), ["'hello':1 'world':2"])
+
+        message.text = 'Goodbye'
+        message.save()
+        self.assertEqual(self.search_vectors([message]), ["'goodbye':1"])
+
+    def test_backfill(self):
+        messages = self.create_messages('one', 'two', 'three')
+        self.clear_search_vectors()
+        self.assertEqual(self.search_vectors(messages), [None, None, None])
+
+        search.backfill_search_vector(connection, batch_size=2)
+        self.assertEqual(self.search_vectors(messages), ["'one':1", "'two':1", "'three':1"])
+        page, cursor = search_messages(self.bob.pk, 'two')
+        self.assertEqual(page, messages[1:2])
@@ -0,0 +1,60 @@
+import asyncio
+
+from django_aiohttp_websockets.websockets.core import settings
+from django_aiohttp_websockets.websockets.core.registry import PRIORITY_BULK, registry
+
+
+class AdmissionController(object):
+    # Measures loop lag and bytes waiting in websocket transports. New upgrades are rejected above the hard limits,
+    # bulk and non-critical actions above the lower shedding limits, so connected clients keep chatting.
+
+    def __init__(self, app):
+        self.app = app
+        self.logger = app.logger
+        self.loop = app.loop
+        self.loop_lag = 0
+        self.outbound_buffer = 0
+
+    async def monitor(self):
+        try:
+            while True:
+                started = self.loop.time()
+                await asyncio.sleep(settings.WS_ADMISSION_CHECK_INTERVAL)
+                self.loop_lag = max(0, self.loop.time() - started - settings.WS_ADMISSION_CHECK_INTERVAL)
+                self.outbound_buffer = self._outbound_buffer()
+        except asyncio.CancelledError:
+            self.logger.debug('Admission monitor stopped')
+
+    def _outbound_buffer(self):
+        total = 0
+        for state in self.app.websockets.values():
+            if state.transport is not None and not state.transport.is_closing():
+                total += state.transport.get_write_buffer_size()
+        return total
+
+    def rejection_reason(self):
+        if settings.WS_MAX_CONNECTIONS and len(self.app.websockets) >= settings.WS_MAX_CONNECTIONS:
+            return 'too_many_connections'
+        if self.loop_lag > settings.WS_MAX_LOOP_LAG:
+            return 'loop_lag'
+        if self.outbound_buffer > settings.WS_MAX_OUTBOUND_BUFFER:
+            return 'outbound_buffer'
+        return None
+
+    @property
+    def overloaded(self):
+        return self.loop_lag > settings.WS_SHED_LOOP_LAG or self.outbound_buffer > settings.WS_SHED_OUTBOUND_BUFFER
+
+    def should_shed(self, action):
+        if not self.overloaded:
+            return False
+        if action in settings.WS_SHED_ACTIONS:
+            return True
+        return registry.get(action) is not None and registry.priority(action) >= PRIORITY_BULK
+
+    def get_metrics(self):
+        return {
+            'loop_lag': round(self.loop_lag, 4),
+            'outbound_buffer': self.outbound_buffer,
+            'overloaded': self.overloaded,
+        }
@@ -0,0 +1,252 @@
+import asyncio
+import random
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings as django_settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from django_aiohttp_websockets.chat.models import ChatRoom, ChatMessage, ChatRoomUserState, LAST_MESSAGE_TEXT_LENGTH
+from django_aiohttp_websockets.chat.serializers import ChatMessageSerializer
+from django_aiohttp_websockets.websockets.core import routers, settings
+from django_aiohttp_websockets.websockets.core.worker_message_handlers import MessageProcessHandler, User
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+
+def _build_queries():
+    # Table and column names come from the Django models, which stay the schema source of truth
+    membership = ChatRoom.users.through
+    membership_room_column = ChatRoom.users.field.m2m_column_name()
+    membership_user_column = ChatRoom.users.field.m2m_reverse_name()
+    state = {
+        'table': ChatRoomUserState._meta.db_table,
+        'room': ChatRoomUserState._meta.get_field('room').column,
+        'user': ChatRoomUserState._meta.get_field('user').column,
+        'last_read': ChatRoomUserState._meta.get_field('last_read_message_id').column,
+        'unread': ChatRoomUserState._meta.get_field('unread_count').column,
+    }
+
+    return {
+        'user_by_token': 'SELECT {user} FROM {table} WHERE {key} = $1'.format(
+            table=Token._meta.db_table,
+            user=Token._meta.get_field('user').column,
+            key=Token._meta.get_field('key').column,
+        ),
+        'room_member': 'SELECT 1 FROM {table} WHERE {room} = $1 AND {user} = $2'.format(
+            table=membership._meta.db_table, room=membership_room_column, user=membership_user_column,
+        ),
+        # Returns the members count and, for rooms smaller than $3, all members of the room. No row when the given
+        # user is not a member
+        'room_members': (
+            'SELECT rooms.{member_count}, CASE WHEN rooms.{member_count} < $3 THEN '
+            '(SELECT array_agg({user}) FROM {table} WHERE {room} = $1) END '
+            'FROM {rooms_table} rooms WHERE rooms.{rooms_pk} = $1 '
+            'AND EXISTS (SELECT 1 FROM {table} WHERE {room} = $1 AND {user} = $2)'
+        ).format(
+            table=membership._meta.db_table, room=membership_room_column, user=membership_user_column,
+            rooms_table=ChatRoom._meta.db_table, rooms_pk=ChatRoom._meta.pk.column,
+            member_count=ChatRoom._meta.get_field('member_count').column,
+        ),
+        'insert_message': (
+            'WITH inserted AS ('
+            'INSERT INTO {table} ({user}, {room}, {text}, {date_created}) VALUES ($1, $2, $3, $4) '
+            'RETURNING {pk}, {user}, {date_created}) '
+            'SELECT inserted.{pk}, inserted.{date_created}, users.{username} '
+            'FROM inserted JOIN {users_table} users ON users.{users_pk} = inserted.{user}'
+        ).format(
+            table=ChatMessage._meta.db_table,
+            pk=ChatMessage._meta.pk.column,
+            user=ChatMessage._meta.get_field('user').column,
+            room=ChatMessage._meta.get_field('room').column,
+            text=ChatMessage._meta.get_field('text').column,
+            date_created=ChatMessage._meta.get_field('date_created').column,
+            users_table=User._meta.db_table,
+            users_pk=User._meta.pk.column,
+            username=User._meta.get_field('username').column,
+        ),
+        'update_room_summary': (
+            'UPDATE {table} SET {last_id} = $2, {last_text} = $3, {last_date} = $4 WHERE {pk} = $1'
+        ).format(
+            table=ChatRoom._meta.db_table,
+            pk=ChatRoom._meta.pk.column,
+            last_id=ChatRoom._meta.get_field('last_message_id').column,
+            last_text=ChatRoom._meta.get_field('last_message_text').column,
+            last_date=ChatRoom._meta.get_field('last_message_date').column,
+        ),
+        # Sender has read everything up to the own message, everybody else gets one more unread message
+        'update_unread': (
+            'UPDATE {table} SET '
+            '{unread} = CASE WHEN {user} = $2 THEN 0 ELSE {unread} + 1 END, '
+            '{last_read} = CASE WHEN {user} = $2 THEN $3 ELSE {last_read} END '
+            'WHERE {room} = $1'
+        ).format(**state),
+        # Large rooms only update the sender, list_rooms counts unread messages of the others from the history
+        'update_sender_read': (
+            'UPDATE {table} SET {unread} = 0, {last_read} = $3 WHERE {room} = $1 AND {user} = $2'
+        ).format(**state),
+        'mark_room_read': (
+            'UPDATE {table} SET {unread} = 0, {last_read} = '
+            '(SELECT {room_last_id} FROM {room_table} WHERE {room_pk} = $1) '
+            'WHERE {room} = $1 AND {user} = $2'
+        ).format(
+            room_table=ChatRoom._meta.db_table,
+            room_pk=ChatRoom._meta.pk.column,
+            room_last_id=ChatRoom._meta.get_field('last_message_id').column,
+            **state
+        ),
+    }
+
+
+class AsyncMessageProcessHandler(MessageProcessHandler):
+    is_async = True
+
+    def __init__(self, logger, loop=None):
+        super(AsyncMessageProcessHandler, self).__init__(logger=logger)
+        self.loop = loop or asyncio.get_event_loop()
+        self.pool = None
+        self.replica_pools = {}
+        self.queries = _build_queries()
+        # Actions without an async implementation still use the ORM, out of the loop
+        self.executor = ThreadPoolExecutor(max_workers=settings.ASYNC_HANDLER_ORM_THREADS)
+
+    def _create_pool(self, alias):
+        db = django_settings.DATABASES[alias]
+        # asyncpg keeps a prepared statement cache per connection, so the hot queries are prepared once per connection
+        return asyncpg.create_pool(
+            host=db.get('HOST') or None,
+            port=db.get('PORT') or None,
+            user=db.get('USER') or None,
+            password=db.get('PASSWORD') or None,
+            database=db.get('NAME'),
+            min_size=settings.ASYNC_HANDLER_POOL_MIN_SIZE,
+            max_size=settings.ASYNC_HANDLER_POOL_MAX_SIZE,
+            loop=self.loop,
+        )
+
+    async def connect(self):
+        if asyncpg is None:
+            raise ImproperlyConfigured('asyncpg is required for the async message handler')
+
+        self.pool = await self._create_pool('default')
+        for alias in routers.replica_aliases():
+            self.replica_pools[alias] = await self._create_pool(alias)
+
+    async def close(self):
+        for pool in [self.pool] + list(self.replica_pools.values()):
+            if pool:
+                await pool.close()
+        self.executor.shutdown(wait=True)
+
+    async def _read_pool(self, msg):
+        # Same rules as routers.ReplicaRouter for the reads of read only actions
+        if not self.replica_pools or routers.is_sticky(msg.get('session_data')):
+            return self.pool
+
+        alias = random.choice(list(self.replica_pools))
+        if routers.lag_monitor.needs_check(alias):
+            try:
+                lag = await self.replica_pools[alias].fetchval(routers.REPLICA_LAG_QUERY)
+            except Exception as e:
+                self.logger.error('Exception while checking replication lag of %s: %s', alias, e)
+                lag = None
+            routers.lag_monitor.update(alias, lag)
+
+        return self.replica_pools[alias] if routers.lag_monitor.usable(alias) else self.pool
+
+    async def process_message(self, msg):
+        try:
+            self._validate_message(msg)
+            handler = self.get_action_handler(msg['action'])
+            if asyncio.iscoroutinefunction(getattr(handler, 'func', handler)):
+                response = await handler(msg)
+            else:
+                response = await self.loop.run_in_executor(self.executor, self.call_action_handler, handler, msg)
+        except Exception as e:
+            self.logger.error("Error occurred while processing action: %s", str(e))
+            return self._error_response(msg, e)
+
+        return response
+
+    def _room_id(self, msg):
+        try:
+            return uuid.UUID(str(msg.get('room')))
+        except ValueError:
+            raise Exception(self.error_messages['invalid_room_id'])
+
+    async def _check_room_member(self, pool, room_id, user_pk):
+        if not await pool.fetchval(self.queries['room_member'], room_id, user_pk):
+            raise Exception(self.error_messages['invalid_room_id'])
+
+    def _load_room_messages(self, room_id, session_data):
+        with routers.replica_reads(True, session_data):
+            return ChatMessageSerializer(ChatMessage.objects.history(room_id), many=True).data
+
+    async def process_authenticate(self, msg):
+        pool = await self._read_pool(msg)
+        user_pk = await pool.fetchval(self.queries['user_by_token'], str(msg.get('token')))
+        if user_pk is None:
+            raise Exception(self.error_messages['invalid_token'])
+
+        return self._success_response(msg, session_data={'user_pk': user_pk})
+
+    async def process_select_room(self, msg):
+        room_id = self._room_id(msg)
+        await self._check_room_member(await self._read_pool(msg), room_id, msg['session_data']['user_pk'])
+        room_messages = await self.loop.run_in_executor(
+            self.executor, self._load_room_messages, room_id, msg['session_data'])
+        response = {
+            'room': room_id.hex,
+            'room_messages': room_messages,
+        }
+        await self.pool.execute(self.queries['mark_room_read'], room_id, msg['session_data']['user_pk'])
+        return self._success_response(msg, response=response)
+
+    async def process_resume(self, msg):
+        room_id = self._room_id(msg)
+        await self._check_room_member(await self._read_pool(msg), room_id, msg['session_data']['user_pk'])
+        return self._success_response(msg, response={'room': room_id.hex, 'last_seq': msg.get('last_seq')})
+
+    async def process_new_message(self, msg):
+        room_id = self._room_id(msg)
+        user_pk = msg['session_data']['user_pk']
+        members = await self.pool.fetchrow(self.queries['room_members'], room_id, user_pk, settings.LARGE_ROOM_MEMBERS)
+        if members is None:
+            raise Exception(self.error_messages['invalid_room_id'])
+        # Same split as MessageProcessHandler.process_new_message
+        is_large = members[0] >= settings.LARGE_ROOM_MEMBERS
+        if is_large:
+            send_to, send_to_room = None, room_id.hex
+        else:
+            send_to, send_to_room = list(members[1] or ()), None
+
+        if not msg.get('text', '').strip():
+            raise Exception(self.error_messages['empty_text'])
+
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                row = await connection.fetchrow(
+                    self.queries['insert_message'], user_pk, room_id, msg['text'], timezone.now())
+                summary_text = msg['text'][:LAST_MESSAGE_TEXT_LENGTH]
+                await connection.execute(self.queries['update_room_summary'], room_id, row[0], summary_text, row[1])
+                unread_query = self.queries['update_sender_read' if is_large else 'update_unread']
+                await connection.execute(unread_query, room_id, user_pk, row[0])
+
+        # Same shape as ChatMessageSerializer output
+        response = {
+            'room': room_id.hex,
+            'message': {
+                'id': row[0],
+                'user': {'username': row[2]},
+                'room': room_id.hex,
+                'timestamp': row[1].timestamp(),
+                'text': msg['text'],
+            },
+        }
+        return self._success_response(msg, response=response, send_to=send_to, send_to_room=send_to_room,
+                                      session_data=routers.mark_write(msg['session_data']))
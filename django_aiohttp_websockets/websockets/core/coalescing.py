@@ -0,0 +1,49 @@
+from django_aiohttp_websockets.websockets.core import settings
+
+
+BATCH_ACTION = 'batch'
+
+
+class FrameCoalescer(object):
+    # Room events for one websocket arriving within WS_COALESCE_WINDOW are sent as a single
+    # {"action": "batch", "events": [...]} frame. Events are kept serialized and joined, not encoded again.
+
+    def __init__(self, app):
+        self.app = app
+        self.loop = app.loop
+        self.pending = {}
+        self._flush_handle = None
+
+    def send(self, ws, data):
+        events = self.pending.get(ws)
+        if events is None:
+            events = self.pending[ws] = []
+        events.append(data)
+
+        if len(events) >= settings.WS_COALESCE_MAX_EVENTS:
+            self.flush_ws(ws)
+        elif self._flush_handle is None:
+            self._flush_handle = self.loop.call_later(settings.WS_COALESCE_WINDOW, self.flush)
+
+    def flush_ws(self, ws):
+        # Also called before frames sent to the websocket directly, so the client sees events in order
+        events = self.pending.pop(ws, None)
+        if not events or ws.closed or ws not in self.app.websockets:
+            return
+
+        if len(events) == 1:
+            ws.send_str(events[0])
+        else:
+            ws.send_str('{"action": "%s", "events": [%s]}' % (BATCH_ACTION, ', '.join(events)))
+            self.app.metrics['frames_coalesced'] += len(events) - 1
+
+    def flush(self):
+        self._flush_handle = None
+        for ws in list(self.pending):
+            self.flush_ws(ws)
+
+    def close(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self.flush()
@@ -0,0 +1,52 @@
+class ConnectionState(object):
+    # Per websocket state kept by the frontend. Slots and lazily created containers keep an idle authenticated
+    # connection to a single small object, which matters at 100k+ connections per process.
+    __slots__ = ('user_pk', 'session_extra', 'pending', 'rooms', 'acks', 'last_seen', 'transport')
+
+    def __init__(self, last_seen, transport=None):
+        self.user_pk = None
+        # Session keys other than user_pk set by worker responses, e.g. the last write time used by routers
+        self.session_extra = None
+        # Uuids of messages published to workers and not answered yet
+        self.pending = None
+        self.rooms = ()
+        self.acks = None
+        self.last_seen = last_seen
+        # Network transport of the websocket, its write buffer size is watched by admission control
+        self.transport = transport
+
+    @property
+    def session_data(self):
+        session_data = {'user_pk': self.user_pk}
+        if self.session_extra:
+            session_data.update(self.session_extra)
+        return session_data
+
+    def update_session(self, session_data):
+        session_data = dict(session_data)
+        self.user_pk = session_data.pop('user_pk', None)
+        self.session_extra = session_data or None
+
+    def add_pending(self, msg_uuid):
+        if self.pending is None:
+            self.pending = set()
+        self.pending.add(msg_uuid)
+
+    def remove_pending(self, msg_uuid):
+        if self.pending:
+            self.pending.discard(msg_uuid)
+            if not self.pending:
+                self.pending = None
+
+    def add_room(self, room):
+        if not self.rooms:
+            self.rooms = set()
+        self.rooms.add(room)
+
+    def get_ack(self, room):
+        return self.acks.get(room) if self.acks else None
+
+    def set_ack(self, room, seq):
+        if self.acks is None:
+            self.acks = {}
+        self.acks[room] = seq
@@ -0,0 +1,168 @@
+import json
+
+from django_aiohttp_websockets.websockets.core import settings, utils
+
+
+SEQUENCED_ACTIONS = frozenset(['new_message', ])
+# Responses with a history snapshot of the room in room_messages
+SNAPSHOT_ACTIONS = frozenset(['select_room', ])
+
+# Assigns the next room sequence number and stores the response in the bounded room buffer in one round trip
+APPEND_TO_ROOM_BUFFER_SCRIPT = """
+local seq = redis.call('INCR', KEYS[1])
+redis.call('ZADD', KEYS[2], seq, ARGV[1])
+redis.call('ZREMRANGEBYRANK', KEYS[2], 0, -tonumber(ARGV[2]) - 1)
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return seq
+"""
+
+
+def sequence_key(room):
+    return '%s:{%s}' % (settings.ROOM_SEQUENCE_KEY_PREFIX, room)
+
+
+def buffer_key(room):
+    return '%s:{%s}' % (settings.ROOM_BUFFER_KEY_PREFIX, room)
+
+
+def acks_key(room):
+    return '%s:{%s}' % (settings.ROOM_ACKS_KEY_PREFIX, room)
+
+
+def _parse_seq(value):
+    try:
+        seq = int(value)
+    except (TypeError, ValueError):
+        raise utils.MessageValidationError(utils.ERROR_MESSAGES['invalid_seq'])
+
+    if seq < 0:
+        raise utils.MessageValidationError(utils.ERROR_MESSAGES['invalid_seq'])
+    return seq
+
+
+def _snapshot_seq(room_messages, latest, current_seq):
+    # History may come from a lagging replica and misses messages committed after it was loaded. The seq stays
+    # below the first buffered message the history doesn't have, so a resume from it delivers that message
+    ids = {message['id'] for message in room_messages}
+    seq = current_seq
+    for raw_entry, entry_seq in latest:
+        if json.loads(raw_entry)['response']['message']['id'] not in ids:
+            seq = min(seq, int(entry_seq) - 1)
+    return seq
+
+
+class RoomSequencer(object):
+
+    def __init__(self, redis, logger):
+        self.redis = redis
+        self.logger = logger
+
+    async def stamp_many(self, responses):
+        pipe = self.redis.pipeline()
+        pending = []
+        for response_msg in responses:
+            if response_msg.get('type') != utils.SUCCESS_RESPONSE_TYPE:
+                continue
+
+            response = response_msg['response']
+            room = response.get('room')
+            if not room:
+                continue
+
+            if response.get('action') in SEQUENCED_ACTIONS:
+                entry = json.dumps({
+                    'send_to': response_msg.get('send_to'),
+                    'send_to_room': response_msg.get('send_to_room'),
+                    'response': response,
+                })
+                future = pipe.for_key(room).eval(
+                    APPEND_TO_ROOM_BUFFER_SCRIPT,
+                    keys=[sequence_key(room), buffer_key(room)],
+                    args=[entry, settings.ROOM_BUFFER_SIZE, settings.ROOM_BUFFER_TTL],
+                )
+            else:
+                future = pipe.for_key(room).get(sequence_key(room))
+            latest_future = None
+            if response.get('action') in SNAPSHOT_ACTIONS:
+                latest_future = pipe.for_key(room).zrevrange(
+                    buffer_key(room), 0, settings.SNAPSHOT_SEQ_WINDOW - 1, withscores=True, encoding='utf-8')
+            pending.append((response, future, latest_future))
+
+        if pending:
+            await pipe.execute()
+            for response, future, latest_future in pending:
+                response['seq'] = int(future.result() or 0)
+                if latest_future is not None:
+                    response['seq'] = _snapshot_seq(response['room_messages'], latest_future.result(), response['seq'])
+        return responses
+
+
+class DeliveryTracker(object):
+
+    def __init__(self, app):
+        self.app = app
+        self.logger = app.logger
+
+    def _user_pk(self, ws):
+        return self.app.websockets[ws].user_pk
+
+    async def ack(self, ws, msg):
+        room = msg.get('room')
+        if not room:
+            raise utils.MessageValidationError(utils.ERROR_MESSAGES['invalid_room_id'])
+
+        seq = _parse_seq(msg.get('seq'))
+        state = self.app.websockets[ws]
+        acked_seq = state.get_ack(room) or 0
+        if seq > acked_seq:
+            state.set_ack(room, seq)
+            pipe = self.app.transport.for_key(room).pipeline()
+            pipe.hset(acks_key(room), self._user_pk(ws), seq)
+            pipe.expire(acks_key(room), settings.ROOM_BUFFER_TTL)
+            await pipe.execute()
+
+        return utils.success_response(msg, response={'room': room, 'seq': max(seq, acked_seq)})
+
+    async def _last_seq(self, ws, room, msg):
+        if msg.get('last_seq') is not None:
+            return _parse_seq(msg['last_seq'])
+
+        acked_seq = self.app.websockets[ws].get_ack(room)
+        if acked_seq is not None:
+            return acked_seq
+
+        return int(await self.app.transport.for_key(room).hget(acks_key(room), self._user_pk(ws)) or 0)
+
+    async def resume(self, ws, msg):
+        # msg is the worker response to the resume message, room membership is already checked
+        room = msg['room']
+        last_seq = await self._last_seq(ws, room, msg)
+        pipe = self.app.transport.for_key(room).pipeline()
+        current_seq_future = pipe.get(sequence_key(room))
+        oldest_future = pipe.zrange(buffer_key(room), 0, 0, withscores=True)
+        missed_future = pipe.zrangebyscore(buffer_key(room), min=last_seq + 1, withscores=True, encoding='utf-8')
+        await pipe.execute()
+
+        current_seq = int(current_seq_future.result() or 0)
+        oldest = oldest_future.result()
+        oldest_seq = int(oldest[0][1]) if oldest else current_seq + 1
+
+        user_pk = self._user_pk(ws)
+        messages = []
+        for raw_entry, seq in missed_future.result():
+            entry = json.loads(raw_entry)
+            # Messages sent before the user joined the room. Large room entries have no recipient list and go to
+            # every member
+            if not entry.get('send_to_room') and user_pk not in (entry.get('send_to') or ()):
+                continue
+            entry['response']['seq'] = int(seq)
+            messages.append(entry['response'])
+
+        response = {
+            'room': room,
+            'seq': current_seq,
+            'messages': messages,
+            # Part of the missed messages already left the buffer, client has to reload the history
+            'resync_required': last_seq < current_seq and oldest_seq > last_seq + 1,
+        }
+        return utils.success_response(msg, response=response)
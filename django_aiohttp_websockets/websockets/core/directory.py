@@ -0,0 +1,103 @@
+import asyncio
+import json
+import time
+
+from django_aiohttp_websockets.websockets.core import settings
+
+
+def user_nodes_key(user_pk):
+    return '%s:{%s}' % (settings.USER_NODES_KEY_PREFIX, user_pk)
+
+
+def push_topic(node_id):
+    return '%s:{%s}' % (settings.PUSH_TOPIC_PREFIX, node_id)
+
+
+class UserDirectory(object):
+    # Keeps the frontends holding websockets of every user in redis, so pushes are published only to those frontends
+
+    def __init__(self, app):
+        self.app = app
+        self.logger = app.logger
+        self.loop = app.loop
+        self.pending_adds = set()
+        self.pending_removes = set()
+        self._flush_handle = None
+
+    def _schedule_flush(self):
+        if self._flush_handle is None:
+            self._flush_handle = self.loop.call_soon(self._start_flush)
+
+    def _start_flush(self):
+        self.loop.create_task(self.flush())
+
+    def add(self, user_pk):
+        if self.app.transport.supports_storage:
+            self.pending_removes.discard(user_pk)
+            self.pending_adds.add(user_pk)
+            self._schedule_flush()
+
+    def remove(self, user_pk):
+        if self.app.transport.supports_storage:
+            self.pending_adds.discard(user_pk)
+            self.pending_removes.add(user_pk)
+            self._schedule_flush()
+
+    def _zadd_all(self, pipe, users):
+        expire_at = time.time() + settings.USER_NODES_TTL
+        for user_pk in users:
+            key = user_nodes_key(user_pk)
+            user_pipe = pipe.for_key(key)
+            user_pipe.zadd(key, expire_at, self.app.node_id)
+            user_pipe.expire(key, settings.USER_NODES_TTL)
+
+    async def flush(self):
+        self._flush_handle = None
+        adds, self.pending_adds = self.pending_adds, set()
+        removes, self.pending_removes = self.pending_removes, set()
+        if not adds and not removes:
+            return
+
+        try:
+            pipe = self.app.transport.pipeline()
+            self._zadd_all(pipe, adds)
+            for user_pk in removes:
+                key = user_nodes_key(user_pk)
+                pipe.for_key(key).zrem(key, self.app.node_id)
+            await pipe.execute()
+        except Exception as e:
+            self.logger.error('Exception while updating user directory: %s', e)
+
+    async def heartbeat(self):
+        try:
+            while True:
+                await asyncio.sleep(settings.PRESENCE_HEARTBEAT_INTERVAL)
+                await self.refresh()
+        except asyncio.CancelledError:
+            self.logger.debug('User directory heartbeat stopped')
+
+    async def refresh(self):
+        if not self.app.user_websockets or not self.app.transport.supports_storage:
+            return
+
+        try:
+            pipe = self.app.transport.pipeline()
+            self._zadd_all(pipe, list(self.app.user_websockets))
+            await pipe.execute()
+        except Exception as e:
+            self.logger.error('Exception while refreshing user directory: %s', e)
+
+    def process_push(self, msg):
+        if msg.get('leave_room'):
+            for user_pk in msg.get('users', ()):
+                for ws in list(self.app.user_websockets.get(user_pk, ())):
+                    self.app.presence.leave_room(ws, msg['leave_room'])
+            return
+
+        data = json.dumps(msg['message'])
+        delivered = 0
+        for user_pk in msg.get('users', ()):
+            for ws in self.app.user_websockets.get(user_pk, ()):
+                ws.send_str(data)
+                delivered += 1
+        self.app.metrics['push_delivered'] += delivered
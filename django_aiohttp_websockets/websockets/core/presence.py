@@ -0,0 +1,214 @@
+import asyncio
+import json
+import time
+from collections import Counter, defaultdict
+
+from django_aiohttp_websockets.websockets.core import settings, utils
+
+
+class PresenceManager(object):
+    ONLINE = 'online'
+    OFFLINE = 'offline'
+    TYPING = 'typing'
+
+    def __init__(self, app):
+        self.app = app
+        self.logger = app.logger
+        self.loop = app.loop
+        self.room_websockets = defaultdict(set)
+        # Local connections per (room, user pk), so joins and leaves don't scan the room's connections
+        self.room_user_connections = Counter()
+        self.pending_events = defaultdict(dict)
+        self.pending_joins = set()
+        self.pending_leaves = set()
+        self.typing_published = {}
+        self._flush_handle = None
+
+    def _key(self, room):
+        return '%s:{%s}' % (settings.PRESENCE_KEY_PREFIX, room)
+
+    def _member(self, user_pk):
+        return '%s:%s' % (user_pk, self.app.node_id)
+
+    def _user_pk(self, ws):
+        return self.app.websockets[ws].user_pk
+
+    def _is_present_locally(self, room, user_pk):
+        return self.room_user_connections[(room, user_pk)] > 0
+
+    def _queue_event(self, room, user_pk, status):
+        self.pending_events[room][user_pk] = status
+        if self._flush_handle is None:
+            self._flush_handle = self.loop.call_later(settings.PRESENCE_BROADCAST_INTERVAL, self._schedule_flush)
+
+    def _schedule_flush(self):
+        self.loop.create_task(self.flush())
+
+    def join(self, ws, room):
+        user_pk = self._user_pk(ws)
+        state = self.app.websockets[ws]
+        if room in state.rooms or not user_pk:
+            return
+
+        is_new = not self._is_present_locally(room, user_pk)
+        state.add_room(room)
+        self.room_websockets[room].add(ws)
+        self.room_user_connections[(room, user_pk)] += 1
+        if is_new:
+            self.pending_leaves.discard((room, user_pk))
+            self.pending_joins.add((room, user_pk))
+            self._queue_event(room, user_pk, self.ONLINE)
+
+    def _leave(self, ws, room, user_pk):
+        websockets = self.room_websockets.get(room)
+        if websockets is None or ws not in websockets:
+            return
+
+        websockets.discard(ws)
+        if not websockets:
+            del self.room_websockets[room]
+        if user_pk:
+            self.room_user_connections[(room, user_pk)] -= 1
+            if self.room_user_connections[(room, user_pk)] <= 0:
+                del self.room_user_connections[(room, user_pk)]
+
+        if user_pk and not self._is_present_locally(room, user_pk):
+            self.pending_joins.discard((room, user_pk))
+            self.pending_leaves.add((room, user_pk))
+            self.typing_published.pop((room, user_pk), None)
+            self._queue_event(room, user_pk, self.OFFLINE)
+
+    def leave(self, ws):
+        user_pk = self._user_pk(ws)
+        for room in self.app.websockets[ws].rooms:
+            self._leave(ws, room, user_pk)
+
+        self.app.websockets[ws].rooms = ()
+
+    def leave_room(self, ws, room):
+        state = self.app.websockets.get(ws)
+        if state is None or room not in state.rooms:
+            return
+
+        state.rooms.discard(room)
+        self._leave(ws, room, state.user_pk)
+
+    def typing(self, ws, msg):
+        room = msg.get('room')
+        if room not in self.app.websockets[ws].rooms:
+            raise utils.MessageValidationError(utils.ERROR_MESSAGES['room_not_selected'])
+
+        user_pk = self._user_pk(ws)
+        now = time.monotonic()
+        if now - self.typing_published.get((room, user_pk), 0) >= settings.TYPING_DEBOUNCE:
+            self.typing_published[(room, user_pk)] = now
+            if self.pending_events.get(room, {}).get(user_pk) is None:
+                self._queue_event(room, user_pk, self.TYPING)
+
+        return utils.success_response(msg, response={'room': room})
+
+    async def snapshot(self, ws, msg):
+        room = msg.get('room')
+        if room not in self.app.websockets[ws].rooms:
+            raise utils.MessageValidationError(utils.ERROR_MESSAGES['room_not_selected'])
+
+        if not self.app.transport.supports_storage:
+            # Single node deployment: local connections are the whole presence
+            online = sorted({self._user_pk(ws) for ws in self.room_websockets.get(room, ())})
+            return utils.success_response(msg, response={'room': room, 'online': online})
+
+        members = await self.app.transport.for_key(room).zrangebyscore(
+            self._key(room), min=time.time(), encoding='utf-8')
+        online = sorted({int(member.split(':', 1)[0]) for member in members})
+        return utils.success_response(msg, response={'room': room, 'online': online})
+
+    async def flush(self):
+        self._flush_handle = None
+        joins, self.pending_joins = self.pending_joins, set()
+        leaves, self.pending_leaves = self.pending_leaves, set()
+        events, self.pending_events = self.pending_events, defaultdict(dict)
+
+        # A user going offline on this frontend may still be in the room through another one
+        offline_rooms = [room for room, room_events in events.items() if self.OFFLINE in room_events.values()]
+        try:
+            if (joins or leaves or offline_rooms) and self.app.transport.supports_storage:
+                pipe = self.app.transport.pipeline()
+                now = time.time()
+                for room, user_pk in joins:
+                    pipe.for_key(room).zadd(self._key(room), now + settings.PRESENCE_TTL, self._member(user_pk))
+                for room, user_pk in leaves:
+                    pipe.for_key(room).zrem(self._key(room), self._member(user_pk))
+                live_futures = [
+                    (room, pipe.for_key(room).zrangebyscore(self._key(room), min=now, encoding='utf-8'))
+                    for room in offline_rooms
+                ]
+                await pipe.execute()
+
+                for room, future in live_futures:
+                    live_users = {int(member.split(':', 1)[0]) for member in future.result()}
+                    room_events = events[room]
+                    for user_pk in live_users:
+                        if room_events.get(user_pk) == self.OFFLINE:
+                            del room_events[user_pk]
+                    if not room_events:
+                        del events[room]
+
+            if events:
+                await self.app.transport.publish_json(settings.PRESENCE_TOPIC, {
+                    'rooms': {
+                        room: [{'user_pk': user_pk, 'status': status} for user_pk, status in room_events.items()]
+                        for room, room_events in events.items()
+                    }
+                })
+        except Exception as e:
+            self.logger.error('Exception while flushing presence events: %s', e)
+
+    async def heartbeat(self):
+        try:
+            while True:
+                await asyncio.sleep(settings.PRESENCE_HEARTBEAT_INTERVAL)
+                await self.refresh()
+        except asyncio.CancelledError:
+            self.logger.debug('Presence heartbeat stopped')
+
+    async def refresh(self):
+        if not self.room_websockets or not self.app.transport.supports_storage:
+            return
+
+        now = time.time()
+        room_users = defaultdict(set)
+        for room, user_pk in self.room_user_connections:
+            room_users[room].add(user_pk)
+        try:
+            pipe = self.app.transport.pipeline()
+            expired_futures = []
+            for room, users in room_users.items():
+                key = self._key(room)
+                room_pipe = pipe.for_key(room)
+                for user_pk in users:
+                    room_pipe.zadd(key, now + settings.PRESENCE_TTL, self._member(user_pk))
+                expired_futures.append((room, room_pipe.zrangebyscore(key, max=now, encoding='utf-8')))
+                room_pipe.zremrangebyscore(key, max=now)
+                room_pipe.expire(key, settings.PRESENCE_TTL)
+            await pipe.execute()
+        except Exception as e:
+            self.logger.error('Exception while refreshing presence: %s', e)
+            return
+
+        # Entries left behind by frontends that went away without removing their members. flush drops the event if
+        # the user is still in the room through another frontend
+        for room, future in expired_futures:
+            for member in future.result():
+                user_pk = int(member.split(':', 1)[0])
+                if not self._is_present_locally(room, user_pk):
+                    self._queue_event(room, user_pk, self.OFFLINE)
+
+    def process_presence_events(self, msg):
+        for room, events in msg.get('rooms', {}).items():
+            websockets = self.room_websockets.get(room)
+            if not websockets:
+                continue
+
+            data = json.dumps({'action': 'presence_update', 'room': room, 'events': events})
+            for ws in websockets:
+                ws.send_str(data)
@@ -0,0 +1,102 @@
+import asyncio
+import json
+from collections import deque
+
+from django_aiohttp_websockets.websockets.core import settings
+from django_aiohttp_websockets.websockets.core.subscriber import backoff_delays
+
+
+class BatchingPublisher(object):
+
+    def __init__(self, redis, logger, loop, max_batch_size=None, flush_delay=None):
+        self.redis = redis
+        self.logger = logger
+        self.loop = loop
+        self.max_batch_size = max_batch_size or settings.REDIS_PUBLISH_MAX_BATCH
+        self.flush_delay = settings.REDIS_PUBLISH_FLUSH_DELAY if flush_delay is None else flush_delay
+        self.pending = []
+        # Publishes kept locally while redis is unavailable, the oldest are dropped when the buffer is full
+        self.backlog = deque(maxlen=settings.REDIS_OUTAGE_BUFFER_SIZE)
+        self.dropped = 0
+        self.healthy = True
+        self.flushing = set()
+        self._flush_handle = None
+        self._retry_delays = backoff_delays()
+
+    def publish_json(self, topic, msg):
+        return self.publish(topic, json.dumps(msg))
+
+    def publish(self, topic, data):
+        future = self.loop.create_future()
+        if not self.healthy:
+            # Retry timer is already scheduled, keep the message until redis is back
+            self._buffer([(topic, data, future)])
+            return future
+
+        self.pending.append((topic, data, future))
+
+        if len(self.pending) >= self.max_batch_size:
+            self.flush()
+        elif self._flush_handle is None:
+            if self.flush_delay:
+                self._flush_handle = self.loop.call_later(self.flush_delay, self.flush)
+            else:
+                self._flush_handle = self.loop.call_soon(self.flush)
+        return future
+
+    def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch = [(topic, data, None) for topic, data in self.backlog] + self.pending
+        self.backlog.clear()
+        self.pending = []
+        if batch:
+            task = self.loop.create_task(self._execute(batch))
+            self.flushing.add(task)
+            task.add_done_callback(self.flushing.discard)
+
+    async def _execute(self, batch):
+        try:
+            pipe = self.redis.pipeline()
+            for topic, data, _ in batch:
+                pipe.publish(topic, data)
+            results = await pipe.execute()
+        except Exception as e:
+            self.logger.error('Exception while publishing batch of %s messages: %s', len(batch), e)
+            self.healthy = False
+            self._buffer(batch)
+            self._schedule_retry()
+            return
+
+        if not self.healthy:
+            self.logger.info('Redis publisher recovered')
+        self.healthy = True
+        self._retry_delays = backoff_delays()
+        for (*_, future), receivers in zip(batch, results):
+            if future is not None and not future.done():
+                future.set_result(receivers)
+
+        if self.backlog:
+            self.flush()
+
+    def _buffer(self, batch):
+        overflow = len(self.backlog) + len(batch) - self.backlog.maxlen
+        if overflow > 0:
+            self.dropped += overflow
+            self.logger.error('Redis publish buffer is full, %s oldest messages were dropped', overflow)
+
+        for topic, data, future in batch:
+            self.backlog.append((topic, data))
+            if future is not None and not future.done():
+                future.set_result(None)
+
+    def _schedule_retry(self):
+        if self._flush_handle is None:
+            self._flush_handle = self.loop.call_later(next(self._retry_delays), self.flush)
+
+    async def close(self):
+        self.flush()
+        if self.flushing:
+            await asyncio.wait(list(self.flushing))
@@ -0,0 +1,77 @@
+import gzip
+import json
+import os
+import time
+from itertools import count
+
+
+CONNECT = 'connect'
+FRAME = 'frame'
+DISCONNECT = 'disconnect'
+MESSAGE = 'message'
+TOKEN_ALIAS_PREFIX = 'recorded-user-'
+
+
+def recording_path(path, node_id):
+    # Every frontend process writes its own file, so connection ids and timestamps of a log never mix
+    root, ext = os.path.splitext(path)
+    return '%s.%s%s' % (root, node_id, ext)
+
+
+class TrafficRecorder(object):
+    # Appends inbound websocket frames and messages received from subscribed channels to a gzipped log, one JSON
+    # array [seconds since start, kind, connection id or channel, data] per line. Read back by replay_traffic.
+    # Tokens never reach the log, every distinct token is written as the same alias instead.
+
+    def __init__(self, path, node_id):
+        self.path = recording_path(path, node_id)
+        self.file = gzip.open(self.path, 'wt', encoding='utf-8')
+        self.started = time.monotonic()
+        self.connection_ids = {}
+        self.token_aliases = {}
+        self._ids = count(1)
+
+    def _write(self, kind, target, data=None):
+        self.file.write(json.dumps([round(time.monotonic() - self.started, 4), kind, target, data]))
+        self.file.write('\n')
+
+    def connect(self, ws):
+        self.connection_ids[ws] = next(self._ids)
+        self._write(CONNECT, self.connection_ids[ws])
+
+    def _redact(self, data):
+        if '"token"' not in data:
+            return data
+        try:
+            msg = json.loads(data)
+        except ValueError:
+            return data
+        if not isinstance(msg, dict) or 'token' not in msg:
+            return data
+
+        token = str(msg['token'])
+        if token not in self.token_aliases:
+            self.token_aliases[token] = '%s%s' % (TOKEN_ALIAS_PREFIX, len(self.token_aliases) + 1)
+        msg['token'] = self.token_aliases[token]
+        return json.dumps(msg)
+
+    def frame(self, ws, data):
+        if ws in self.connection_ids:
+            self._write(FRAME, self.connection_ids[ws], self._redact(data))
+
+    def disconnect(self, ws):
+        connection_id = self.connection_ids.pop(ws, None)
+        if connection_id is not None:
+            self._write(DISCONNECT, connection_id)
+
+    def message(self, topic, raw_msg):
+        self._write(MESSAGE, topic, raw_msg.decode('utf-8'))
+
+    def close(self):
+        self.file.close()
+
+
+def read_log(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as log:
+        for line in log:
+            yield json.loads(line)
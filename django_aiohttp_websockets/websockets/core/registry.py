@@ -0,0 +1,79 @@
+from collections import OrderedDict
+from functools import partial
+from importlib import import_module
+
+from django.utils.module_loading import import_string
+
+from django_aiohttp_websockets.websockets.core import settings, utils
+
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_BULK = 2
+
+
+class Action(object):
+
+    def __init__(self, name, handler=None, required_keys=(), concurrency=None, priority=PRIORITY_DEFAULT,
+                 anonymous=False, read_only=False):
+        self.name = name
+        self.handler = handler
+        self.required_keys = tuple(required_keys)
+        self.concurrency = concurrency
+        self.priority = priority
+        self.anonymous = anonymous
+        # Reads of read only actions may be served by database replicas
+        self.read_only = read_only
+
+    def resolve(self, processor):
+        # Without an explicit handler the action is served by the processor's process_<name> method
+        if self.handler is None:
+            return getattr(processor, 'process_%s' % self.name)
+
+        handler = import_string(self.handler) if isinstance(self.handler, str) else self.handler
+        return partial(handler, processor)
+
+
+class ActionRegistry(object):
+
+    def __init__(self):
+        self.actions = OrderedDict()
+        self._autodiscovered = False
+
+    def register(self, name, handler=None, **kwargs):
+        self.actions[name] = Action(name, handler=handler, **kwargs)
+        return self.actions[name]
+
+    def unregister(self, name):
+        self.actions.pop(name, None)
+
+    def get(self, name):
+        return self.actions.get(name)
+
+    def priority(self, name):
+        action = self.actions.get(name)
+        return action.priority if action else PRIORITY_DEFAULT
+
+    def autodiscover(self):
+        if not self._autodiscovered:
+            self._autodiscovered = True
+            for module in settings.ACTION_MODULES:
+                import_module(module)
+
+    def compile_validator(self, extra_actions=(), exclude=()):
+        self.autodiscover()
+        actions = {name: action.required_keys for name, action in self.actions.items() if name not in exclude}
+        actions.update(dict.fromkeys(extra_actions, ()))
+        anonymous_actions = [name for name, action in self.actions.items() if action.anonymous]
+        return utils.compile_message_validator(actions=actions, anonymous_actions=anonymous_actions)
+
+
+registry = ActionRegistry()
+registry.register('authenticate', required_keys=('token', ), priority=PRIORITY_INTERACTIVE, anonymous=True,
+                  read_only=True)
+registry.register('new_message', required_keys=('room', ), priority=PRIORITY_INTERACTIVE)
+registry.register('select_room', required_keys=('room', ), priority=PRIORITY_BULK,
+                  concurrency=settings.SELECT_ROOM_CONCURRENCY, read_only=True)
+registry.register('list_rooms', priority=PRIORITY_BULK, read_only=True)
+registry.register('search_messages', required_keys=('query', ), priority=PRIORITY_BULK, read_only=True)
+registry.register('resume', required_keys=('room', ), priority=PRIORITY_INTERACTIVE, read_only=True)
@@ -0,0 +1,96 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings as django_settings
+from django.db import DatabaseError, connections
+
+from django_aiohttp_websockets.websockets.core import settings
+
+
+# Seconds the replica is behind the primary, 0 when it has replayed everything it received
+REPLICA_LAG_QUERY = (
+    'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END'
+)
+
+_state = threading.local()
+
+
+def replica_aliases():
+    return list(getattr(django_settings, 'DATABASE_REPLICAS', ()))
+
+
+def is_sticky(session_data):
+    # Users who wrote recently read from the primary until replicas had time to catch up
+    last_write = (session_data or {}).get('last_write') or 0
+    return time.time() - last_write < settings.DB_REPLICA_STICKY_TIME
+
+
+def mark_write(session_data):
+    # Returned to the frontend as the new session data, so the next messages of the session carry the write time
+    return dict(session_data or {}, last_write=time.time())
+
+
+@contextmanager
+def replica_reads(enabled, session_data=None):
+    previous = getattr(_state, 'use_replica', False)
+    _state.use_replica = enabled and not is_sticky(session_data)
+    try:
+        yield
+    finally:
+        _state.use_replica = previous
+
+
+class ReplicaLagMonitor(object):
+
+    def __init__(self):
+        self.checks = {}
+
+    def needs_check(self, alias):
+        checked_at, _ = self.checks.get(alias, (None, None))
+        return checked_at is None or time.monotonic() - checked_at > settings.DB_REPLICA_LAG_CHECK_INTERVAL
+
+    def update(self, alias, lag):
+        # lag is None when the replica could not be queried
+        self.checks[alias] = (time.monotonic(), lag)
+
+    def usable(self, alias):
+        _, lag = self.checks.get(alias, (None, None))
+        return lag is not None and lag <= settings.DB_REPLICA_MAX_LAG
+
+    def check(self, alias):
+        if self.needs_check(alias):
+            try:
+                with connections[alias].cursor() as cursor:
+                    cursor.execute(REPLICA_LAG_QUERY)
+                    lag = cursor.fetchone()[0]
+            except DatabaseError:
+                lag = None
+            self.update(alias, lag)
+        return self.usable(alias)
+
+
+lag_monitor = ReplicaLagMonitor()
+
+
+class ReplicaRouter(object):
+    # Reads go to a replica only inside replica_reads(), everything else stays on the primary
+
+    def db_for_read(self, model, **hints):
+        if not getattr(_state, 'use_replica', False):
+            return None
+
+        replicas = [alias for alias in replica_aliases() if lag_monitor.check(alias)]
+        return random.choice(replicas) if replicas else None
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replica_aliases()
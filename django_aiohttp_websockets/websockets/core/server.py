@@ -1,12 +1,22 @@
 import asyncio
 import json
 import logging
+import math
 import random
+import uuid
+from collections import Counter, defaultdict
 
-import aioredis
 from aiohttp import web, WSCloseCode
 
-from django_aiohttp_websockets.websockets.core import views, settings, utils
+from django_aiohttp_websockets.websockets.core import views, settings, topology, transports, utils
+from django_aiohttp_websockets.websockets.core.admission import AdmissionController
+from django_aiohttp_websockets.websockets.core.coalescing import FrameCoalescer
+from django_aiohttp_websockets.websockets.core.connections import ConnectionState
+from django_aiohttp_websockets.websockets.core.delivery import DeliveryTracker
+from django_aiohttp_websockets.websockets.core.directory import UserDirectory, push_topic
+from django_aiohttp_websockets.websockets.core.presence import PresenceManager
+from django_aiohttp_websockets.websockets.core.recorder import TrafficRecorder
+from django_aiohttp_websockets.websockets.core.registry import registry
 
 
 logger = logging.getLogger(__name__)
@@ -20,95 +30,271 @@ logger.addHandler(console)
 
 
 class WSApplication(web.Application):
-    WS_MESSAGE_REQUIRED_KEYS = ['uuid', ]
 
     def __init__(self, **kwargs):
         super(WSApplication, self).__init__(**kwargs)
         self.tasks = []
         self.websockets = {}
+        # Routing indexes: uuid of a message waiting for a worker response -> websocket, user pk -> websockets
+        self.pending_messages = {}
+        self.user_websockets = defaultdict(set)
         self.logger = logger
+        self.node_id = uuid.uuid4().hex
+        self.metrics = Counter()
+        self.draining = False
+        self.recorder = None
+        if settings.TRAFFIC_RECORD_PATH:
+            self.recorder = TrafficRecorder(settings.TRAFFIC_RECORD_PATH, self.node_id)
+        self.transport = transports.create_transport(self.logger, self.loop)
+        self.workers = []
+        self.presence = PresenceManager(self)
+        self.delivery = DeliveryTracker(self)
+        self.directory = UserDirectory(self)
+        self.admission = AdmissionController(self)
+        self.coalescer = FrameCoalescer(self) if settings.WS_COALESCE_ROOM_EVENTS else None
+        self.frontend_action_handlers = {
+            'presence': self.presence.snapshot,
+            'typing': self.presence.typing,
+        }
+        if self.transport.supports_storage:
+            self.frontend_action_handlers['ack'] = self.delivery.ack
+        # resume is authorized by a worker and answered from the room buffer, which needs storage
+        self.validate_message = registry.compile_validator(
+            extra_actions=self.frontend_action_handlers,
+            exclude=() if self.transport.supports_storage else ('resume', ),
+        )
 
         self.on_shutdown.append(self._on_shutdown_handler)
         self.loop.run_until_complete(self._setup())
 
     async def _setup(self):
         self.router.add_get('/ws', views.WebSocketView)
-        self.redis_subscriber = await aioredis.create_redis((settings.REDIS_HOST, settings.REDIS_PORT), loop=self.loop)
-        self.redis_publisher = await aioredis.create_redis((settings.REDIS_HOST, settings.REDIS_PORT), loop=self.loop)
-        self.tasks.append(self.loop.create_task(self.subscribe_to_channel(settings.WORKER_RESPONSE_TOPIC)))
+        self.router.add_get('/metrics', views.MetricsView)
+        self.router.add_get('/health', views.HealthView)
+        await self.transport.connect()
+        for topic in topology.worker_response_topics():
+            self.subscribe_to_channel(topic, self.process_worker_response)
+        self.subscribe_to_channel(settings.PRESENCE_TOPIC, self.process_presence_events)
+        if self.transport.supports_storage:
+            self.subscribe_to_channel(push_topic(self.node_id), self.process_push)
+            self.tasks.append(self.loop.create_task(self.directory.heartbeat()))
+        if self.transport.in_process:
+            await self._start_in_process_workers()
+        self.tasks.extend(self.transport.run_subscribers())
+        self.tasks.append(self.loop.create_task(self.presence.heartbeat()))
+        self.tasks.append(self.loop.create_task(self.reap_idle_connections()))
+        self.tasks.append(self.loop.create_task(self.admission.monitor()))
 
     async def _on_shutdown_handler(self, app):
+        self.draining = True
+        self.logger.info('Draining %s websockets', len(self.websockets))
+        await self._drain_websockets()
+        if self.coalescer:
+            self.coalescer.close()
+
+        for worker in self.workers:
+            await worker.stop()
+
         for task in self.tasks:
             task.cancel()
-            await task
+        # A task cancelled before it could catch the cancellation must not abort the rest of the shutdown
+        await asyncio.gather(*self.tasks, return_exceptions=True)
 
-        for ws in self.websockets:
-            await ws.close(code=WSCloseCode.GOING_AWAY, message='Server shutdown')
+        await self.transport.close()
+        if self.recorder:
+            self.recorder.close()
 
-        for redis_conn in [self.redis_subscriber, self.redis_publisher]:
-            if redis_conn and not redis_conn.closed:
-                redis_conn.close()
-                await redis_conn.wait_closed()
+    async def _start_in_process_workers(self):
+        # Workers use the Django ORM, so they are imported only when they run inside the frontend
+        import django
+        django.setup()
+        from django_aiohttp_websockets.websockets.core.worker import AioredisWorker
 
-    async def subscribe_to_channel(self, topic):
-        self.logger.info('Subscribe to channel: %s', topic)
-        try:
-            channel, *_ = await self.redis_subscriber.subscribe(topic)
+        for topic in settings.WORKER_PROCESS_TOPICS:
+            worker = AioredisWorker(None, None, topic, self.logger, loop=self.loop, transport=self.transport)
+            await worker.start()
+            self.workers.append(worker)
 
-            while await channel.wait_message():
-                try:
-                    raw_msg = await channel.get()
-                    msg = json.loads(raw_msg.decode('utf-8'))
-                    await self.process_worker_response(msg)
+    def subscribe_to_channel(self, topic, handler):
+        async def handle_raw_message(raw_msg):
+            if self.recorder:
+                self.recorder.message(topic, raw_msg)
+            await handler(json.loads(raw_msg.decode('utf-8')))
 
-                except (json.JSONDecodeError, ValueError, Exception) as e:
-                    self.logger.error('Exception while processing redis msg: %s', e)
+        self.logger.info('Subscribe to channel: %s', topic)
+        self.transport.subscribe(topic, handle_raw_message)
 
-        except asyncio.CancelledError:
-            self.logger.error('CancelledError exception received. Unsubscribe from channel: %s', topic)
-            await self.redis_subscriber.unsubscribe(topic)
-
-    def handle_ws_connect(self, ws, view):
-        self.websockets[ws] = {
-            'view': view,
-            'messages_ids': [],
-            'session_data': {
-                'user_pk': None
-            }
-        }
+    @property
+    def healthy(self):
+        return self.transport.healthy
+
+    def handle_ws_connect(self, ws, transport=None):
+        self.websockets[ws] = ConnectionState(self.loop.time(), transport)
+        if self.recorder:
+            self.recorder.connect(ws)
+        self.metrics['connections_opened'] += 1
         self.logger.debug('[%s] Websocket was added to websocket list', id(ws))
 
     def handle_ws_disconnect(self, ws):
-        self.websockets.pop(ws, None)
+        if ws not in self.websockets:
+            return
+
+        self.presence.leave(ws)
+        if self.recorder:
+            self.recorder.disconnect(ws)
+        state = self.websockets.pop(ws)
+        self._unindex_user(ws, state.user_pk)
+        for msg_uuid in state.pending or ():
+            self.pending_messages.pop(msg_uuid, None)
+        self.metrics['connections_closed'] += 1
         self.logger.debug('[%s] Websocket was removed from websockets list', id(ws))
 
+    def handle_ws_frame(self, ws):
+        if ws in self.websockets:
+            self.websockets[ws].last_seen = self.loop.time()
+
+    async def _close_ws(self, ws, code, message):
+        try:
+            await ws.close(code=code, message=message)
+        except Exception as e:
+            self.logger.error('[%s] Exception while closing websocket: %s', id(ws), e)
+
+    async def _wait_for_pending_messages(self, websockets, timeout):
+        deadline = self.loop.time() + timeout
+        while self.loop.time() < deadline:
+            if not any(ws in self.websockets and self.websockets[ws].pending for ws in websockets):
+                return
+            await asyncio.sleep(settings.WS_DRAIN_TICK)
+
+    async def _close_ws_with_reconnect_hint(self, ws):
+        if self.coalescer:
+            self.coalescer.flush_ws(ws)
+        try:
+            ws.send_str(json.dumps({
+                'action': 'reconnect',
+                'delay': round(random.uniform(0, settings.WS_RECONNECT_MAX_DELAY), 3),
+            }))
+        except Exception as e:
+            self.logger.error('[%s] Exception while sending reconnect hint: %s', id(ws), e)
+
+        self.handle_ws_disconnect(ws)
+        await self._close_ws(ws, WSCloseCode.GOING_AWAY, 'Server shutdown')
+
+    async def _drain_websockets(self):
+        # Copy: websockets are removed from self.websockets while the drain awaits
+        websockets = list(self.websockets)
+        if not websockets:
+            return
+
+        random.shuffle(websockets)
+        batches_count = max(1, int(settings.WS_DRAIN_DURATION / settings.WS_DRAIN_TICK))
+        batch_size = int(math.ceil(len(websockets) / batches_count))
+        for i in range(0, len(websockets), batch_size):
+            batch = [ws for ws in websockets[i:i + batch_size] if ws in self.websockets]
+            await self._wait_for_pending_messages(batch, settings.WS_DRAIN_INFLIGHT_TIMEOUT)
+            await asyncio.gather(*[self._close_ws_with_reconnect_hint(ws) for ws in batch])
+            await asyncio.sleep(settings.WS_DRAIN_TICK * random.uniform(0.5, 1.5))
+
+    async def reap_idle_connections(self):
+        try:
+            while True:
+                await asyncio.sleep(settings.WS_HEARTBEAT_INTERVAL)
+                deadline = self.loop.time() - settings.WS_IDLE_TIMEOUT
+                for ws, state in list(self.websockets.items()):
+                    if ws.closed or state.last_seen < deadline:
+                        self.logger.debug('[%s] Reaping idle websocket', id(ws))
+                        self.metrics['connections_reaped'] += 1
+                        self.handle_ws_disconnect(ws)
+                        self.loop.create_task(self._close_ws(ws, WSCloseCode.GOING_AWAY, 'Idle timeout'))
+                        continue
+
+                    try:
+                        ws.ping()
+                        self.metrics['pings_sent'] += 1
+                    except Exception as e:
+                        self.logger.error('[%s] Exception while sending ping: %s', id(ws), e)
+
+        except asyncio.CancelledError:
+            self.logger.debug('Idle connections reaper stopped')
+
+    def get_metrics(self):
+        metrics = dict(self.metrics)
+        metrics.update(self.transport.get_metrics())
+        metrics.update(self.admission.get_metrics())
+        metrics['connections'] = len(self.websockets)
+        return metrics
+
     async def publish_message_to_worker(self, ws, msg):
-        if not all(msg.get(key) for key in self.WS_MESSAGE_REQUIRED_KEYS):
-            raise Exception('Missing required keys')
+        state = self.websockets[ws]
+        session_data = state.session_data
+        try:
+            self.validate_message(msg, session_data)
+        except utils.MessageValidationError as e:
+            self.logger.debug('[%s] Message rejected by frontend validation: %s', id(ws), e)
+            ws.send_str(json.dumps(utils.error_response(msg, e)['response']))
+            return
+
+        if self.admission.should_shed(msg['action']):
+            self.metrics['messages_shed'] += 1
+            ws.send_str(json.dumps(utils.error_response(msg, utils.ERROR_MESSAGES['server_overloaded'])['response']))
+            return
+
+        if msg['action'] in self.frontend_action_handlers:
+            await self.process_frontend_action(ws, msg)
+            return
 
         msg_id = msg['uuid']
         publish_topic = random.choice(settings.WORKER_PROCESS_TOPICS)
 
-        msg['session_data'] = self.websockets[ws]['session_data']
-        self.websockets[ws]['messages_ids'].append(msg_id)
+        msg['session_data'] = session_data
+        state.add_pending(msg_id)
+        self.pending_messages[msg_id] = ws
         self.logger.debug('[%s] Publish message with id \'%s\' to topic \'%s\'', id(ws), msg_id, publish_topic)
-        await self.redis_publisher.publish_json(publish_topic, msg)
+        await self.transport.publish_json(publish_topic, msg)
+
+    async def process_frontend_action(self, ws, msg, handler=None):
+        try:
+            response_msg = (handler or self.frontend_action_handlers[msg['action']])(ws, msg)
+            if asyncio.iscoroutine(response_msg):
+                response_msg = await response_msg
+        except Exception as e:
+            self.logger.error('[%s] Error occurred while processing frontend action: %s', id(ws), e)
+            response_msg = utils.error_response(msg, e)
+
+        ws.send_str(json.dumps(response_msg['response']))
+
+    async def process_presence_events(self, msg):
+        self.presence.process_presence_events(msg)
 
-    def _find_ws_by_message_uuid(self, msg_uuid):
-        for ws, ws_data in self.websockets.items():
-            if msg_uuid in ws_data.get('messages_ids', []):
-                return ws
+    async def process_push(self, msg):
+        self.directory.process_push(msg)
 
     def _find_ws_by_send_to(self, send_to):
         websockets = []
-        for ws, ws_data in self.websockets.items():
-            if ws_data.get('session_data', {}).get('user_pk') in send_to:
-                websockets.append(ws)
+        for user_pk in send_to:
+            websockets.extend(self.user_websockets.get(user_pk, ()))
         return websockets
 
+    def _unindex_user(self, ws, user_pk):
+        websockets = self.user_websockets.get(user_pk)
+        if websockets is not None:
+            websockets.discard(ws)
+            if not websockets:
+                del self.user_websockets[user_pk]
+                self.directory.remove(user_pk)
+
     def _update_session(self, ws, response_msg):
-        if response_msg.get('session_data'):
-            self.websockets[ws]['session_data'] = response_msg['session_data']
+        if ws in self.websockets and response_msg.get('session_data'):
+            state = self.websockets[ws]
+            user_pk = response_msg['session_data'].get('user_pk')
+            if state.user_pk != user_pk:
+                self.presence.leave(ws)
+                self._unindex_user(ws, state.user_pk)
+                if user_pk:
+                    if user_pk not in self.user_websockets:
+                        self.directory.add(user_pk)
+                    self.user_websockets[user_pk].add(ws)
+            state.update_session(response_msg['session_data'])
 
     async def process_worker_response(self, response_msg):
         response = response_msg['response']
@@ -116,17 +302,44 @@ class WSApplication(web.Application):
         send_to = response_msg.get('send_to')
         self.logger.debug('Processing response for msg with id \'%s\'', msg_uuid)
 
-        ws = self._find_ws_by_message_uuid(msg_uuid)
+        ws = self.pending_messages.pop(msg_uuid, None)
+        if ws:
+            self.websockets[ws].remove_pending(msg_uuid)
+            if self.coalescer:
+                self.coalescer.flush_ws(ws)
         if response_msg['type'] == utils.ERROR_RESPONSE_TYPE:
             if ws:
                 ws.send_str(json.dumps(response))
 
         elif response_msg['type'] == utils.SUCCESS_RESPONSE_TYPE:
             self._update_session(ws, response_msg)
-            if not send_to:
+            if response_msg.get('send_to_room'):
+                websockets = list(self.presence.room_websockets.get(response_msg['send_to_room'], ()))
+                # Sender gets the response even without the room selected
+                if ws and ws not in self.presence.room_websockets.get(response_msg['send_to_room'], ()):
+                    websockets.append(ws)
+                await self._send_chunked(websockets, json.dumps(response))
+            elif not send_to:
                 if ws:
+                    if response.get('action') == 'select_room':
+                        self.presence.join(ws, response['room'])
+                    elif response.get('action') == 'resume':
+                        # Worker checked the room membership, missed messages come from the room buffer
+                        await self.process_frontend_action(ws, response, self.delivery.resume)
+                        return
                     ws.send_str(json.dumps(response))
             else:
-                websockets = self._find_ws_by_send_to(send_to)
-                for ws in websockets:
-                    ws.send_str(json.dumps(response))
+                await self._send_chunked(self._find_ws_by_send_to(send_to), json.dumps(response))
+
+    async def _send_chunked(self, websockets, data):
+        if self.coalescer:
+            for ws in websockets:
+                self.coalescer.send(ws, data)
+            return
+
+        # Yields to the loop between chunks, so delivery to a big room does not stall other connections
+        for i, ws in enumerate(websockets, 1):
+            if not ws.closed:
+                ws.send_str(data)
+            if i % settings.FANOUT_CHUNK_SIZE == 0:
+                await asyncio.sleep(0)
@@ -1,4 +1,65 @@
+# 'redis' or 'inprocess'. In-process transport runs workers for WORKER_PROCESS_TOPICS inside the frontend process
+TRANSPORT = 'redis'
 REDIS_HOST = 'localhost'
 REDIS_PORT = 6379
+# Channels and keys are spread across the nodes by hash of their name (or of its {hash tag} part)
+REDIS_NODES = [(REDIS_HOST, REDIS_PORT)]
+# When sentinels are set REDIS_NODES is ignored and every shard is the current master of a sentinel service
+REDIS_SENTINELS = []  # [('sentinel-1', 26379), ...]
+REDIS_SENTINEL_MASTERS = []  # ['chat-shard-1', ...]
 WORKER_RESPONSE_TOPIC = 'worker_response'
 WORKER_PROCESS_TOPICS = ['worker_process_1']  # , 'worker_process_2', 'worker_process_3']
+PRESENCE_TOPIC = 'presence_events'
+PRESENCE_KEY_PREFIX = 'presence'
+PRESENCE_HEARTBEAT_INTERVAL = 10  # seconds between presence refreshes of local connections
+PRESENCE_TTL = 30  # presence entries not refreshed within this time are treated as offline
+PRESENCE_BROADCAST_INTERVAL = 0.25  # presence/typing events are coalesced within this window
+TYPING_DEBOUNCE = 2  # at most one typing event per user and room within this time
+ROOM_SEQUENCE_KEY_PREFIX = 'room_seq'
+ROOM_BUFFER_KEY_PREFIX = 'room_buffer'
+ROOM_ACKS_KEY_PREFIX = 'room_acks'
+ROOM_BUFFER_SIZE = 200  # number of latest room messages kept in redis for resume
+ROOM_BUFFER_TTL = 24 * 60 * 60
+SNAPSHOT_SEQ_WINDOW = 10  # latest buffered messages checked against a select_room history, at most its size
+WS_HEARTBEAT_INTERVAL = 15  # seconds between pings sent to every websocket
+WS_IDLE_TIMEOUT = 45  # websockets without any incoming frame (pongs included) for this long are reaped
+WS_DRAIN_DURATION = 30  # on shutdown websockets are closed gradually over this period
+WS_DRAIN_TICK = 0.1  # interval between batches of websockets closed while draining
+WS_DRAIN_INFLIGHT_TIMEOUT = 5  # how long a websocket waits for worker responses to its pending messages before close
+WS_RECONNECT_MAX_DELAY = 10  # clients are told to reconnect after a random delay up to this value
+REDIS_POOL_MINSIZE = 1
+REDIS_POOL_MAXSIZE = 10
+REDIS_PUBLISH_MAX_BATCH = 500  # pending publishes are flushed right away once this many are queued
+REDIS_PUBLISH_FLUSH_DELAY = 0  # 0 flushes publishes issued within one loop iteration, otherwise wait this many seconds
+WORKER_MAX_BATCH_SIZE = 100  # max number of messages a worker processes and publishes responses for at once
+WORKER_QUEUE_SIZE = 1000  # max number of messages read from redis but not processed yet
+REDIS_RECONNECT_MIN_DELAY = 0.1  # reconnects to redis back off exponentially from this delay
+REDIS_RECONNECT_MAX_DELAY = 10
+REDIS_OUTAGE_BUFFER_SIZE = 10000  # max number of publishes kept locally while redis is unavailable
+WORKER_ASYNC_HANDLER = False  # process messages with asyncpg based AsyncMessageProcessHandler instead of the ORM
+ASYNC_HANDLER_POOL_MIN_SIZE = 5
+ASYNC_HANDLER_POOL_MAX_SIZE = 50  # also the number of messages an async worker processes at once
+ASYNC_HANDLER_ORM_THREADS = 4  # executor threads for actions still served by the ORM
+ACTION_MODULES = []  # modules registering additional websocket actions, imported by the frontend and the workers
+WORKER_CONCURRENCY = 8  # messages processed at once by a worker with the in-process executor
+SELECT_ROOM_CONCURRENCY = 2  # history loads allowed at once per worker, so they can't take every slot
+DB_REPLICA_MAX_LAG = 1  # seconds, replicas further behind the primary are skipped by read actions
+DB_REPLICA_LAG_CHECK_INTERVAL = 5  # seconds between replication lag checks of a replica
+DB_REPLICA_STICKY_TIME = 5  # reads of a session go to the primary for this long after it wrote
+PUSH_TOPIC_PREFIX = 'push'  # every frontend subscribes to its own push topic, see websockets.push
+USER_NODES_KEY_PREFIX = 'user_nodes'
+USER_NODES_TTL = 30  # directory entries of frontends which stopped refreshing them are ignored after this time
+PUSH_BATCH_SIZE = 1000  # users looked up and published to at once by push_to_users
+LARGE_ROOM_MEMBERS = 500  # responses for rooms this big go to connections which selected the room, not to member ids
+FANOUT_CHUNK_SIZE = 500  # websockets written to per loop iteration when delivering to a room
+TRAFFIC_RECORD_PATH = None  # gzipped log of inbound frames and channel messages, node id is added to the file name
+WS_MAX_CONNECTIONS = None  # websocket upgrades over this number of connections per process are rejected, if set
+WS_ADMISSION_CHECK_INTERVAL = 0.5  # seconds between loop lag and outbound buffer measurements
+WS_MAX_LOOP_LAG = 0.5  # seconds, new upgrades are rejected while the loop lags more
+WS_MAX_OUTBOUND_BUFFER = 256 * 1024 * 1024  # bytes buffered for all websockets above which upgrades are rejected
+WS_SHED_LOOP_LAG = 0.2  # above this lag (or WS_SHED_OUTBOUND_BUFFER) bulk and non-critical actions are rejected
+WS_SHED_OUTBOUND_BUFFER = 64 * 1024 * 1024
+WS_SHED_ACTIONS = ('presence', 'typing', )  # frontend actions rejected under overload, with bulk priority actions
+WS_COALESCE_ROOM_EVENTS = False  # room events for one websocket within WS_COALESCE_WINDOW are sent as one frame
+WS_COALESCE_WINDOW = 0.005  # seconds, max delay added to a coalesced room event
+WS_COALESCE_MAX_EVENTS = 50  # a websocket's batch is sent right away once it holds this many events
@@ -0,0 +1,37 @@
+import zlib
+from itertools import count
+
+from django_aiohttp_websockets.websockets.core import settings
+
+
+# Key to shard mapping shared by the aiohttp transport and the synchronous push client, without redis client imports
+
+
+def shards_count():
+    if settings.REDIS_SENTINELS:
+        return len(settings.REDIS_SENTINEL_MASTERS)
+    return len(settings.REDIS_NODES)
+
+
+def hash_key(key):
+    # Only the {hash tag} part of a key is hashed if present, so related keys (room sequence and buffer) share a shard
+    start = key.find('{')
+    if start != -1:
+        end = key.find('}', start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
+
+
+def shard_index(key, count_=None):
+    count_ = count_ or shards_count()
+    if count_ == 1:
+        return 0
+    return zlib.crc32(hash_key(key).encode('utf-8')) % count_
+
+
+def shard_tag(index, count_=None):
+    # Smallest hash tag mapped to the given shard, used to give every shard its own channel
+    for tag in count():
+        if shard_index(str(tag), count_) == index:
+            return str(tag)
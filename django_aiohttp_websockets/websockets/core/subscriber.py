@@ -0,0 +1,89 @@
+import asyncio
+import random
+
+import aioredis
+
+from django_aiohttp_websockets.websockets.core import settings
+
+
+def backoff_delays():
+    delay = settings.REDIS_RECONNECT_MIN_DELAY
+    while True:
+        yield delay * random.uniform(0.5, 1.5)
+        delay = min(delay * 2, settings.REDIS_RECONNECT_MAX_DELAY)
+
+
+class RedisSubscriber(object):
+
+    def __init__(self, resolve_address, logger, loop):
+        self.resolve_address = resolve_address
+        self.address = None
+        self.logger = logger
+        self.loop = loop
+        self.handlers = {}
+        self.connection = None
+        self.healthy = False
+        self.reconnects = 0
+
+    def subscribe(self, topic, handler):
+        self.handlers[topic] = handler
+
+    async def _read_channel(self, channel, handler):
+        while await channel.wait_message():
+            raw_msg = await channel.get()
+            try:
+                await handler(raw_msg)
+            except Exception as e:
+                self.logger.error('Exception while processing redis msg from %s: %s', channel.name, e)
+
+    async def _subscribe_and_read(self):
+        self.address = await self.resolve_address()
+        self.connection = await aioredis.create_redis(self.address, loop=self.loop)
+        channels = await self.connection.subscribe(*self.handlers)
+        self.logger.info('Subscribed to channels: %s', ', '.join(self.handlers))
+        self.healthy = True
+        await asyncio.gather(*[
+            self._read_channel(channel, self.handlers[topic]) for channel, topic in zip(channels, self.handlers)
+        ])
+
+    async def run(self):
+        delays = backoff_delays()
+        while True:
+            try:
+                await self._subscribe_and_read()
+                delays = backoff_delays()
+                self.logger.error('Redis subscriber connection at %s was closed', self.address)
+            except asyncio.CancelledError:
+                self.logger.error('CancelledError exception received. Unsubscribe from channels: %s',
+                                  ', '.join(self.handlers))
+                await self.close()
+                return
+            except Exception as e:
+                self.logger.error('Redis subscriber connection at %s failed: %s', self.address, e)
+
+            self.healthy = False
+            self._close_connection()
+            delay = next(delays)
+            self.logger.info('Reconnecting to redis subscriber in %.2fs', delay)
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self.logger.info('Redis subscriber stopped while reconnecting')
+                await self.close()
+                return
+            self.reconnects += 1
+
+    def _close_connection(self):
+        if self.connection and not self.connection.closed:
+            self.connection.close()
+
+    async def close(self):
+        self.healthy = False
+        if self.connection and not self.connection.closed:
+            if self.handlers:
+                try:
+                    await self.connection.unsubscribe(*self.handlers)
+                except Exception as e:
+                    self.logger.error('Exception while unsubscribing from redis channels: %s', e)
+            self.connection.close()
+            await self.connection.wait_closed()
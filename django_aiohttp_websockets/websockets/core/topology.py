@@ -0,0 +1,116 @@
+import asyncio
+from functools import partial
+
+import aioredis
+
+from django_aiohttp_websockets.websockets.core import settings
+from django_aiohttp_websockets.websockets.core.publisher import BatchingPublisher
+from django_aiohttp_websockets.websockets.core.sharding import shard_index, shard_tag, shards_count
+from django_aiohttp_websockets.websockets.core.subscriber import RedisSubscriber
+
+
+def worker_response_topics():
+    return ['%s:{%s}' % (settings.WORKER_RESPONSE_TOPIC, shard_tag(index)) for index in range(shards_count())]
+
+
+def worker_response_topic(msg_uuid):
+    return worker_response_topics()[shard_index(str(msg_uuid))]
+
+
+class ShardedPipeline(object):
+
+    def __init__(self, shards):
+        self.shards = shards
+        self.pipelines = {}
+
+    def for_key(self, key):
+        index = shard_index(key, len(self.shards.pools))
+        if index not in self.pipelines:
+            self.pipelines[index] = self.shards.pools[index].pipeline()
+        return self.pipelines[index]
+
+    async def execute(self):
+        await asyncio.gather(*[pipe.execute() for pipe in self.pipelines.values()])
+
+
+class RedisShards(object):
+    supports_storage = True
+    in_process = False
+
+    def __init__(self, logger, loop, nodes=None):
+        self.logger = logger
+        self.loop = loop
+        self.nodes = nodes or settings.REDIS_NODES
+        self.sentinel = None
+        self.pools = []
+        self.publishers = []
+        self.subscribers = []
+
+    async def _node_address(self, node):
+        return node
+
+    async def _master_address(self, name):
+        return await self.sentinel.master_address(name)
+
+    async def connect(self):
+        if settings.REDIS_SENTINELS:
+            self.logger.info('Redis sentinels at %s. Masters: %s', settings.REDIS_SENTINELS,
+                             settings.REDIS_SENTINEL_MASTERS)
+            self.sentinel = await aioredis.create_sentinel(settings.REDIS_SENTINELS, loop=self.loop)
+            self.pools = [self.sentinel.master_for(name) for name in settings.REDIS_SENTINEL_MASTERS]
+            resolvers = [partial(self._master_address, name) for name in settings.REDIS_SENTINEL_MASTERS]
+        else:
+            self.logger.info('Redis nodes at %s', self.nodes)
+            self.pools = [
+                await aioredis.create_redis_pool(
+                    node, minsize=settings.REDIS_POOL_MINSIZE, maxsize=settings.REDIS_POOL_MAXSIZE, loop=self.loop)
+                for node in self.nodes
+            ]
+            resolvers = [partial(self._node_address, node) for node in self.nodes]
+
+        self.publishers = [BatchingPublisher(pool, self.logger, self.loop) for pool in self.pools]
+        self.subscribers = [RedisSubscriber(resolver, self.logger, self.loop) for resolver in resolvers]
+
+    def for_key(self, key):
+        return self.pools[shard_index(key, len(self.pools))]
+
+    def pipeline(self):
+        return ShardedPipeline(self)
+
+    def publish_json(self, topic, msg):
+        return self.publishers[shard_index(topic, len(self.pools))].publish_json(topic, msg)
+
+    def subscribe(self, topic, handler):
+        self.subscribers[shard_index(topic, len(self.pools))].subscribe(topic, handler)
+
+    def run_subscribers(self):
+        return [self.loop.create_task(subscriber.run()) for subscriber in self.subscribers if subscriber.handlers]
+
+    @property
+    def healthy(self):
+        return all(publisher.healthy for publisher in self.publishers) and all(
+            subscriber.healthy for subscriber in self.subscribers if subscriber.handlers)
+
+    def get_metrics(self):
+        return {
+            'redis_healthy': self.healthy,
+            'redis_reconnects': sum(subscriber.reconnects for subscriber in self.subscribers),
+            'redis_publish_backlog': sum(len(publisher.backlog) for publisher in self.publishers),
+            'redis_publish_dropped': sum(publisher.dropped for publisher in self.publishers),
+        }
+
+    async def close(self):
+        for publisher in self.publishers:
+            await publisher.close()
+
+        for subscriber in self.subscribers:
+            await subscriber.close()
+
+        for pool in self.pools:
+            if not pool.closed:
+                pool.close()
+                await pool.wait_closed()
+
+        if self.sentinel:
+            self.sentinel.close()
+            await self.sentinel.wait_closed()
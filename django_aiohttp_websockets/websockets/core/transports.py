@@ -0,0 +1,74 @@
+import asyncio
+import json
+from collections import defaultdict
+
+from django_aiohttp_websockets.websockets.core import settings
+from django_aiohttp_websockets.websockets.core.topology import RedisShards
+
+
+class InProcessTransport(object):
+    # Pub/sub between frontend and workers running in one process and loop. There is no key/value storage,
+    # so features depending on it (resume buffer, sequence numbers, shared presence) are limited to local state
+    supports_storage = False
+    in_process = True
+
+    def __init__(self, logger, loop):
+        self.logger = logger
+        self.loop = loop
+        self.subscriptions = defaultdict(list)
+        self.healthy = True
+        self.published = 0
+
+    async def connect(self):
+        self.logger.info('Using in-process transport')
+
+    def publish_json(self, topic, msg):
+        # Serialized like the redis transport, so receivers never share mutable messages with the publisher
+        raw_msg = json.dumps(msg).encode('utf-8')
+        receivers = self.subscriptions.get(topic, ())
+        for queue, _ in receivers:
+            queue.put_nowait(raw_msg)
+        self.published += 1
+
+        future = self.loop.create_future()
+        future.set_result(len(receivers))
+        return future
+
+    def subscribe(self, topic, handler):
+        self.subscriptions[topic].append((asyncio.Queue(), handler))
+
+    async def _dispatch(self, topic, queue, handler):
+        try:
+            while True:
+                raw_msg = await queue.get()
+                try:
+                    await handler(raw_msg)
+                except Exception as e:
+                    self.logger.error('Exception while processing in-process msg from %s: %s', topic, e)
+
+        except asyncio.CancelledError:
+            self.logger.debug('Stop dispatching of in-process channel: %s', topic)
+
+    def run_subscribers(self):
+        return [
+            self.loop.create_task(self._dispatch(topic, queue, handler))
+            for topic, subscriptions in self.subscriptions.items()
+            for queue, handler in subscriptions
+        ]
+
+    def get_metrics(self):
+        return {
+            'transport_published': self.published,
+            'transport_queued': sum(
+                queue.qsize() for subscriptions in self.subscriptions.values() for queue, _ in subscriptions
+            ),
+        }
+
+    async def close(self):
+        pass
+
+
+def create_transport(logger, loop, nodes=None):
+    if settings.TRANSPORT == 'inprocess':
+        return InProcessTransport(logger, loop)
+    return RedisShards(logger, loop, nodes=nodes)
@@ -1,2 +1,79 @@
 ERROR_RESPONSE_TYPE = 'error_response'
 SUCCESS_RESPONSE_TYPE = 'success_response'
+
+REQUIRED_KEYS = ('action', 'uuid', )
+
+ERROR_MESSAGES = {
+    'invalid_message_format': 'Some of required keys are absent or empty. Required keys: %s' % list(REQUIRED_KEYS),
+    'authentication_required': 'Authentication required before sending any other messages',
+    'room_not_selected': 'Room must be selected before using this action',
+    'invalid_room_id': 'Invalid room id',
+    'invalid_seq': 'Sequence number must be a non-negative integer',
+    'server_overloaded': 'Server is overloaded, try again later',
+}
+
+
+class MessageValidationError(Exception):
+    pass
+
+
+def compile_message_validator(actions, anonymous_actions=(), required_keys=REQUIRED_KEYS):
+    # Actions are either names or a dict of names to keys required by the action in addition to required_keys.
+    # Allowed actions come from the registry, see registry.compile_validator.
+    required_keys = tuple(required_keys)
+    if not isinstance(actions, dict):
+        actions = dict.fromkeys(actions, ())
+    actions = {action: tuple(keys) for action, keys in actions.items()}
+    anonymous_actions = frozenset(anonymous_actions)
+    invalid_payload = 'Invalid message action. Next actions are allowed: %s' % sorted(actions)
+
+    def validate(msg, session_data=None):
+        if not isinstance(msg, dict) or not all(msg.get(key) for key in required_keys):
+            raise MessageValidationError(ERROR_MESSAGES['invalid_message_format'])
+
+        action_keys = actions.get(msg['action'])
+        if action_keys is None:
+            raise MessageValidationError(invalid_payload)
+
+        if msg['action'] not in anonymous_actions and not (session_data or {}).get('user_pk'):
+            raise MessageValidationError(ERROR_MESSAGES['authentication_required'])
+
+        if not all(msg.get(key) for key in action_keys):
+            raise MessageValidationError(
+                'Some of required keys are absent or empty. Required keys: %s' % list(required_keys + action_keys))
+
+    return validate
+
+
+def error_response(msg, error_message):
+    if not isinstance(msg, dict):
+        msg = {}
+
+    return {
+        'type': ERROR_RESPONSE_TYPE,
+        'response': {
+            'uuid': msg.get('uuid'),
+            'action': msg.get('action'),
+            'error_message': str(error_message),
+            'status': 'error',
+        }
+    }
+
+
+def success_response(msg, response=None, send_to=None, session_data=None, send_to_room=None):
+    if response is None:
+        response = {}
+
+    response.update({
+        'uuid': msg.get('uuid'),
+        'action': msg.get('action'),
+        'status': 'success',
+    })
+
+    return {
+        'type': SUCCESS_RESPONSE_TYPE,
+        'send_to': send_to,
+        'send_to_room': send_to_room,
+        'session_data': session_data,
+        'response': response
+    }
@@ -2,6 +2,8 @@ import json
 
 from aiohttp import web, WSMsgType, WSCloseCode
 
+from django_aiohttp_websockets.websockets.core import settings
+
 
 class WebSocketView(web.View):
 
@@ -11,15 +13,30 @@ class WebSocketView(web.View):
         self.logger = self.app.logger
 
     async def get(self):
-        ws = web.WebSocketResponse()
+        if self.app.draining:
+            self.logger.debug('Websocket connection rejected: server is draining')
+            return web.Response(status=503, text='Server is shutting down')
+
+        reason = self.app.admission.rejection_reason()
+        if reason:
+            self.logger.debug('Websocket connection rejected: %s', reason)
+            self.app.metrics['connections_rejected'] += 1
+            return web.Response(status=503, text='Server is overloaded: %s' % reason,
+                                headers={'Retry-After': str(settings.WS_RECONNECT_MAX_DELAY)})
+
+        # Pings are sent by the application reaper, pongs only refresh the connection's last seen time
+        ws = web.WebSocketResponse(autoping=False)
         await ws.prepare(self.request)
 
         ws_id = id(ws)
         self.logger.debug('[%s] New websocket connection', ws_id)
-        self.app.handle_ws_connect(ws, self)
+        self.app.handle_ws_connect(ws, self.request.transport)
 
         async for msg_raw in ws:
+            self.app.handle_ws_frame(ws)
             if msg_raw.tp == WSMsgType.TEXT:
+                if self.app.recorder:
+                    self.app.recorder.frame(ws, msg_raw.data)
                 try:
                     msg = json.loads(msg_raw.data)
                     self.logger.debug('[%s] Publish message %s to redis', ws_id, msg)
@@ -29,9 +46,26 @@ class WebSocketView(web.View):
                     await ws.close(code=WSCloseCode.UNSUPPORTED_DATA, message=str(e))
                     break
 
+            elif msg_raw.tp == WSMsgType.PING:
+                ws.pong(msg_raw.data)
+
             elif msg_raw.tp == WSMsgType.ERROR:
                 self.logger.error('[%s] ERROR WS connection closed with exception: %s', ws_id, ws.exception())
 
         self.logger.debug('[%s] Websocket connection closed', ws_id)
         self.app.handle_ws_disconnect(ws)
         return ws
+
+
+class MetricsView(web.View):
+
+    async def get(self):
+        return web.json_response(self.request.app.get_metrics())
+
+
+class HealthView(web.View):
+
+    async def get(self):
+        app = self.request.app
+        status = 'draining' if app.draining else 'ok' if app.healthy else 'redis_unavailable'
+        return web.json_response({'status': status}, status=200 if status == 'ok' else 503)
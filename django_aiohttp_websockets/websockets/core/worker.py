@@ -1,37 +1,79 @@
 import asyncio
 import json
 import signal
+import threading
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
 
-import aioredis
+from django.db import connections
 
-from django_aiohttp_websockets.websockets.core import settings
+from django_aiohttp_websockets.websockets.core import settings, topology, transports
+from django_aiohttp_websockets.websockets.core.delivery import RoomSequencer
+from django_aiohttp_websockets.websockets.core.registry import registry
 from django_aiohttp_websockets.websockets.core.worker_message_handlers import MessageProcessHandler
 
 
 class AioredisWorker(object):
-    def __init__(self, host, port, subscribe_topic, logger, loop=None, **kwargs):
+    def __init__(self, host, port, subscribe_topic, logger, loop=None, transport=None, **kwargs):
         self.logger = logger
         self.loop = loop or asyncio.get_event_loop()
         self.host = host
         self.port = port
         self.subscribe_topic = subscribe_topic
-        self.redis_subscriber = None
-        self.redis_publisher = None
+        self.transport = transport
+        self.sequencer = None
+        self.executor = None
         self.tasks = []
-        self.message_process_handler = MessageProcessHandler(logger=self.logger)
+        self.queue = asyncio.PriorityQueue(maxsize=settings.WORKER_QUEUE_SIZE)
+        self._queue_counter = count()
+        # Concurrent dispatch: global slots, running messages of limited actions and messages waiting for their
+        # action to get below its limit without holding a slot
+        self.slots = None
+        self.running_actions = Counter()
+        self.deferred = defaultdict(deque)
+        self.deferred_drained = asyncio.Event()
+        self.running_tasks = set()
+        if settings.WORKER_ASYNC_HANDLER:
+            from django_aiohttp_websockets.websockets.core.async_message_handlers import AsyncMessageProcessHandler
+            self.message_process_handler = AsyncMessageProcessHandler(logger=self.logger, loop=self.loop)
+        else:
+            self.message_process_handler = MessageProcessHandler(logger=self.logger)
 
-        self.loop.add_signal_handler(signal.SIGTERM, self.shutdown)
-        self.loop.add_signal_handler(signal.SIGINT, self.shutdown)
+        # Worker with a shared transport is embedded into another process which owns the loop and signals
+        self.standalone = transport is None
+        if self.standalone:
+            self.loop.add_signal_handler(signal.SIGTERM, self.shutdown)
+            self.loop.add_signal_handler(signal.SIGINT, self.shutdown)
 
     async def _shutdown(self):
         for task in self.tasks:
             task.cancel()
-            await task
+        # A task cancelled before it could catch the cancellation must not abort the rest of the shutdown
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.running_tasks:
+            await asyncio.wait(list(self.running_tasks))
 
-        for redis_conn in [self.redis_subscriber, self.redis_publisher]:
-            if redis_conn and not redis_conn.closed:
-                redis_conn.close()
-                await redis_conn.wait_closed()
+        if self.executor:
+            await self._close_executor_connections()
+            self.executor.shutdown(wait=True)
+        if self.message_process_handler.is_async:
+            await self.message_process_handler.close()
+        if self.transport and self.standalone:
+            await self.transport.close()
+
+    async def _close_executor_connections(self):
+        # Django connections are per thread, so every executor thread closes its own. The barrier holds each thread
+        # until all of them got a close call, so none of them takes two
+        barrier = threading.Barrier(settings.WORKER_CONCURRENCY)
+
+        def close():
+            barrier.wait()
+            connections.close_all()
+
+        await asyncio.gather(*[
+            self.loop.run_in_executor(self.executor, close) for _ in range(settings.WORKER_CONCURRENCY)
+        ])
 
     def shutdown(self):
         self.logger.info('Shutdown initiated. Unsubscribing from all channels')
@@ -39,28 +81,157 @@ class AioredisWorker(object):
         self.loop.stop()
         self.loop.close()
 
-    async def subscribe_to_channel(self, ch):
+    async def enqueue(self, raw_msg):
         try:
-            channel, *_ = await self.redis_subscriber.subscribe(ch)
-            while (await channel.wait_message()):
-                try:
-                    raw_msg = await channel.get()
-                    msg = json.loads(raw_msg.decode('utf-8'))
-                    self.logger.debug('Processing message %s', msg)
-                    response = self.message_process_handler.process_message(msg)
-                    await self.redis_publisher.publish_json(settings.WORKER_RESPONSE_TOPIC, response)
-                except Exception as e:
-                    self.logger.error('Exception while processing redis msg: %s', e)
+            msg = json.loads(raw_msg.decode('utf-8'))
+        except Exception as e:
+            self.logger.error('Exception while decoding redis msg: %s', e)
+            return
+
+        action = msg.get('action') if isinstance(msg, dict) else None
+        await self.queue.put((registry.priority(action), next(self._queue_counter), msg))
+
+    async def process_message(self, msg):
+        self.logger.debug('Processing message %s', msg)
+        if self.message_process_handler.is_async:
+            return await self.message_process_handler.process_message(msg)
+        if self.executor:
+            return await self.loop.run_in_executor(self.executor, self.message_process_handler.process_message, msg)
+        return self.message_process_handler.process_message(msg)
+
+    async def process_batch(self, messages):
+        responses = []
+        for msg in messages:
+            try:
+                responses.append(await self.process_message(msg))
+            except Exception as e:
+                self.logger.error('Exception while processing redis msg: %s', e)
+
+        if self.sequencer:
+            try:
+                await self.sequencer.stamp_many(responses)
+            except Exception as e:
+                self.logger.error('Exception while assigning sequence numbers to %s responses: %s', len(responses), e)
+
+        try:
+            await asyncio.gather(*[
+                self.transport.publish_json(topology.worker_response_topic(response['response']['uuid']), response)
+                for response in responses
+            ])
+        except Exception as e:
+            self.logger.error('Exception while publishing %s responses: %s', len(responses), e)
+
+    async def consume(self, batch_size):
+        try:
+            while True:
+                batch = [(await self.queue.get())[-1]]
+                while len(batch) < batch_size and not self.queue.empty():
+                    batch.append(self.queue.get_nowait()[-1])
+                await self.process_batch(batch)
 
         except asyncio.CancelledError:
-            self.logger.error('CancelledError exception received. Unsubscribe from channel %s', ch)
-            await self.redis_subscriber.unsubscribe(ch)
+            self.logger.error('CancelledError exception received. Stop processing, %s messages queued',
+                              self.queue.qsize())
+
+    def _limited_action(self, msg):
+        action = registry.get(msg.get('action')) if isinstance(msg, dict) else None
+        return action if action is not None and action.concurrency else None
+
+    def _start(self, msg, action):
+        # Global slot is already taken by the caller
+        if action is not None:
+            self.running_actions[action.name] += 1
+        task = self.loop.create_task(self._process_dispatched(msg, action))
+        self.running_tasks.add(task)
+        task.add_done_callback(self.running_tasks.discard)
+
+    async def _process_dispatched(self, msg, action):
+        try:
+            await self.process_batch([msg])
+        finally:
+            self._finish(action)
+
+    def _finish(self, action):
+        if action is not None:
+            self.running_actions[action.name] -= 1
+            deferred = self.deferred.get(action.name)
+            if deferred:
+                # Next message of the action inherits the slot
+                self._start(deferred.popleft(), action)
+                self.deferred_drained.set()
+                return
+        self.slots.release()
+
+    async def _next_runnable(self):
+        while True:
+            msg = (await self.queue.get())[-1]
+            action = self._limited_action(msg)
+            if action is None or self.running_actions[action.name] < action.concurrency:
+                return msg, action
+
+            # Waiting messages of one action are bounded like the queue, which keeps redis reads backpressured
+            while len(self.deferred[action.name]) >= settings.WORKER_QUEUE_SIZE:
+                self.deferred_drained.clear()
+                await self.deferred_drained.wait()
+            self.deferred[action.name].append(msg)
+
+    async def dispatch(self):
+        # Every message runs as its own task once a global slot is free. Messages of an action at its concurrency
+        # limit are set aside instead of holding a slot, so cheap actions overtake a spike of expensive ones
+        try:
+            while True:
+                await self.slots.acquire()
+                msg, action = await self._next_runnable()
+                self._start(msg, action)
+
+        except asyncio.CancelledError:
+            self.logger.error('CancelledError exception received. Stop dispatching, %s messages queued',
+                              self.queue.qsize() + sum(len(deferred) for deferred in self.deferred.values()))
+
+    def subscribe_to_channel(self, ch):
+        self.transport.subscribe(ch, self.enqueue)
+
+    def start_consumers(self):
+        # Messages are taken from the queue by priority. Inline ORM processing handles whole batches in one consumer,
+        # async and executor processing overlap as many messages as the database pool or the threads can serve
+        if self.message_process_handler.is_async:
+            self.slots = asyncio.Semaphore(settings.ASYNC_HANDLER_POOL_MAX_SIZE)
+        elif self.executor is not None:
+            self.slots = asyncio.Semaphore(settings.WORKER_CONCURRENCY)
+        else:
+            self.tasks.append(self.loop.create_task(self.consume(settings.WORKER_MAX_BATCH_SIZE)))
+            return
+        self.tasks.append(self.loop.create_task(self.dispatch()))
+
+    @property
+    def healthy(self):
+        return self.transport.healthy
 
     async def _run(self):
-        self.logger.info('Redis connection at %s:%s. Subscribed to: %s.', self.host, self.port, self.subscribe_topic)
-        self.redis_subscriber = await aioredis.create_redis((self.host, self.port), loop=self.loop)
-        self.redis_publisher = await aioredis.create_redis((self.host, self.port), loop=self.loop)
-        self.tasks.append(self.loop.create_task(self.subscribe_to_channel(self.subscribe_topic)))
+        self.logger.info('Subscribed to: %s.', self.subscribe_topic)
+        if self.standalone:
+            nodes = [(self.host, self.port)] if self.host else None
+            self.transport = transports.create_transport(self.logger, self.loop, nodes=nodes)
+            await self.transport.connect()
+
+        if self.message_process_handler.is_async:
+            await self.message_process_handler.connect()
+        if self.transport.supports_storage:
+            self.sequencer = RoomSequencer(self.transport, self.logger)
+        if self.transport.in_process:
+            # ORM calls must not block the loop shared with the frontend
+            self.executor = ThreadPoolExecutor(max_workers=settings.WORKER_CONCURRENCY)
+
+        self.subscribe_to_channel(self.subscribe_topic)
+        self.start_consumers()
+        if self.standalone:
+            self.tasks.extend(self.transport.run_subscribers())
+
+    async def start(self):
+        await self._run()
+
+    async def stop(self):
+        await self._shutdown()
 
     def run(self):
         self.loop.run_until_complete(self._run())
@@ -1,60 +1,40 @@
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
 
-from django_aiohttp_websockets.chat.models import ChatRoom, ChatMessage
-from django_aiohttp_websockets.chat.serializers import ChatMessageSerializer
-from django_aiohttp_websockets.websockets.core import utils
+from django_aiohttp_websockets.chat.models import ChatRoom, ChatMessage, ChatRoomUserState, LAST_MESSAGE_TEXT_LENGTH
+from django_aiohttp_websockets.chat.search import SEARCH_PAGE_SIZE, search_messages
+from django_aiohttp_websockets.chat.serializers import ChatMessageSerializer, ChatRoomStateSerializer
+from django_aiohttp_websockets.websockets.core import routers, settings, utils
+from django_aiohttp_websockets.websockets.core.registry import registry
 
 User = get_user_model()
 
 
 class MessageProcessHandler(object):
-    REQUIRED_KEYS = ['action', 'uuid', ]
-    ACTIONS = ['authenticate', 'select_room', 'new_message', ]
-    error_messages = {
-        'invalid_message_format': 'Some of required keys are absent or empty. Required keys: %s' % REQUIRED_KEYS,
-        'invalid_payload': 'Invalid message action. Next actions are allowed: %s' % ACTIONS,
+    is_async = False
+    error_messages = dict(utils.ERROR_MESSAGES, **{
         'invalid_token': 'Invalid authentication token',
-        'authentication_required': 'Authentication required before sending any other messages',
-        'invalid_room_id': 'Invalid room id',
         'empty_text': 'Message text can\'t be empty',
-    }
+        'invalid_cursor': 'Invalid search cursor',
+    })
 
     def __init__(self, logger):
         self.logger = logger
+        self.validate = registry.compile_validator()
 
     def _error_response(self, msg, error_message):
-        return {
-            'type': utils.ERROR_RESPONSE_TYPE,
-            'response': {
-                'uuid': msg.get('uuid'),
-                'action': msg.get('action'),
-                'error_message': str(error_message),
-                'status': 'error',
-            }
-        }
+        return utils.error_response(msg, error_message)
 
-    def _success_response(self, msg, response=None, send_to=None, session_data=None):
-        if response is None:
-            response = {}
-
-        response.update({
-            'uuid': msg.get('uuid'),
-            'action': msg.get('action'),
-            'status': 'success',
-        })
-
-        resp = {
-            'type': utils.SUCCESS_RESPONSE_TYPE,
-            'send_to': send_to,
-            'session_data': session_data,
-            'response': response
-        }
-        return resp
+    def _success_response(self, msg, response=None, send_to=None, session_data=None, send_to_room=None):
+        return utils.success_response(
+            msg, response=response, send_to=send_to, session_data=session_data, send_to_room=send_to_room)
 
     def process_message(self, msg):
         try:
             self._validate_message(msg)
-            response = getattr(self, 'process_%s' % msg['action'])(msg)
+            response = self.call_action_handler(self.get_action_handler(msg['action']), msg)
         except Exception as e:
             self.logger.error("Error occurred while processing action: %s", str(e))
             return self._error_response(msg, e)
@@ -62,14 +42,14 @@ class MessageProcessHandler(object):
         return response
 
     def _validate_message(self, msg):
-        if not all(msg.get(key) for key in self.REQUIRED_KEYS):
-            raise Exception(self.error_messages['invalid_message_format'])
+        self.validate(msg, msg.get('session_data'))
 
-        if msg['action'] not in self.ACTIONS:
-            raise Exception(self.error_messages['invalid_payload'])
+    def get_action_handler(self, action):
+        return registry.get(action).resolve(self)
 
-        if msg['action'] != 'authenticate' and not msg.get('session_data', {}).get('user_pk'):
-            raise Exception(self.error_messages['authentication_required'])
+    def call_action_handler(self, handler, msg):
+        with routers.replica_reads(registry.get(msg['action']).read_only, msg.get('session_data')):
+            return handler(msg)
 
     def _get_room(self, msg):
         try:
@@ -87,28 +67,81 @@ class MessageProcessHandler(object):
 
     def process_select_room(self, msg):
         room = self._get_room(msg)
-        messages = reversed(room.messages.all().order_by('-date_created')[:20])
         response = {
             'room': room.pk.hex,
-            'room_messages': ChatMessageSerializer(messages, many=True).data,
+            'room_messages': ChatMessageSerializer(ChatMessage.objects.history(room.pk), many=True).data,
         }
+        self._mark_room_read(room, msg['session_data']['user_pk'])
         return self._success_response(msg, response=response)
 
+    def process_resume(self, msg):
+        # Authorizes the resume, missed messages are read from the room buffer by the frontend
+        room = self._get_room(msg)
+        return self._success_response(msg, response={'room': room.pk.hex, 'last_seq': msg.get('last_seq')})
+
+    def _mark_room_read(self, room, user_pk):
+        ChatRoomUserState.objects.filter(room=room, user_id=user_pk).update(
+            last_read_message_id=room.last_message_id, unread_count=0)
+
+    def process_list_rooms(self, msg):
+        # Rooms without messages are ordered by their creation date
+        states = list(ChatRoomUserState.objects.filter(
+            user_id=msg['session_data']['user_pk'],
+        ).with_unread_counts(settings.LARGE_ROOM_MEMBERS).annotate(
+            activity=Coalesce('room__last_message_date', 'room__date_created'),
+        ).order_by('-activity'))
+        for state in states:
+            state.unread_count = state.current_unread_count
+        return self._success_response(msg, response={'rooms': ChatRoomStateSerializer(states, many=True).data})
+
     def process_new_message(self, msg):
         room = self._get_room(msg)
-        send_to = list(room.users.all().values_list('id', flat=True))
+        # Large rooms are delivered by frontends to connections which selected the room, so the response size
+        # does not depend on the number of members. Their unread counters are derived by list_rooms instead of
+        # being updated for every member on every message.
+        is_large = room.member_count >= settings.LARGE_ROOM_MEMBERS
+        if is_large:
+            send_to, send_to_room = None, room.pk.hex
+        else:
+            send_to, send_to_room = list(room.users.all().values_list('id', flat=True)), None
 
         if not msg.get('text', '').strip():
             raise Exception(self.error_messages['empty_text'])
 
-        chat_message = ChatMessage.objects.create(
-            user_id=msg['session_data']['user_pk'],
-            text=msg['text'],
-            room=room,
-        )
+        user_pk = msg['session_data']['user_pk']
+        with transaction.atomic():
+            chat_message = ChatMessage.objects.create(user_id=user_pk, text=msg['text'], room=room)
+            ChatRoom.objects.filter(pk=room.pk).update(
+                last_message_id=chat_message.pk,
+                last_message_text=chat_message.text[:LAST_MESSAGE_TEXT_LENGTH],
+                last_message_date=chat_message.date_created,
+            )
+            if not is_large:
+                room.user_states.exclude(user_id=user_pk).update(unread_count=F('unread_count') + 1)
+            room.user_states.filter(user_id=user_pk).update(last_read_message_id=chat_message.pk, unread_count=0)
 
         response = {
             'room': room.pk.hex,
             'message': ChatMessageSerializer(chat_message).data,
         }
-        return self._success_response(msg, response=response, send_to=send_to)
+        return self._success_response(msg, response=response, send_to=send_to, send_to_room=send_to_room,
+                                      session_data=routers.mark_write(msg['session_data']))
+
+    def process_search_messages(self, msg):
+        user_pk = msg['session_data']['user_pk']
+        room_id = self._get_room(msg).pk if msg.get('room') else None
+        cursor = msg.get('cursor')
+        if cursor is not None:
+            try:
+                cursor = int(cursor)
+            except (TypeError, ValueError):
+                raise Exception(self.error_messages['invalid_cursor'])
+
+        messages, next_cursor = search_messages(user_pk, msg['query'], room_id=room_id, cursor=cursor,
+                                                limit=SEARCH_PAGE_SIZE)
+        response = {
+            'query': msg['query'],
+            'messages': ChatMessageSerializer(messages, many=True).data,
+            'cursor': next_cursor,
+        }
+        return self._success_response(msg, response=response)
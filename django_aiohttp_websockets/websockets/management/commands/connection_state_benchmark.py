@@ -0,0 +1,58 @@
+import gc
+import time
+import tracemalloc
+import uuid
+
+from django.core.management import BaseCommand
+
+from django_aiohttp_websockets.websockets.core.connections import ConnectionState
+
+
+def legacy_state(user_pk, room):
+    # Layout of the per websocket dict used before ConnectionState, without the view it also kept alive
+    return {
+        'view': None,
+        'messages_ids': [],
+        'rooms': {room},
+        'acks': {},
+        'last_seen': time.monotonic(),
+        'session_data': {
+            'user_pk': user_pk
+        }
+    }
+
+
+def slotted_state(user_pk, room):
+    state = ConnectionState(time.monotonic())
+    state.update_session({'user_pk': user_pk})
+    state.add_room(room)
+    return state
+
+
+def measure(factory, connections, rooms):
+    gc.collect()
+    tracemalloc.start()
+    states = [factory(i, rooms[i % len(rooms)]) for i in range(connections)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # The list holding the states is the same for both layouts
+    size -= states.__sizeof__()
+    return size / connections
+
+
+class Command(BaseCommand):
+    help = 'Measures memory used per connection state: legacy dict layout vs ConnectionState'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=100000)
+        parser.add_argument('--rooms', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rooms = [uuid.uuid4().hex for _ in range(options['rooms'])]
+        legacy = measure(legacy_state, options['connections'], rooms)
+        slotted = measure(slotted_state, options['connections'], rooms)
+
+        self.stdout.write('Connections: %s, authenticated, one selected room each' % options['connections'])
+        self.stdout.write('dict layout:      %8.1f bytes per connection' % legacy)
+        self.stdout.write('ConnectionState:  %8.1f bytes per connection' % slotted)
+        self.stdout.write('Reduction:        %8.1f%%' % (100 - slotted * 100 / legacy))
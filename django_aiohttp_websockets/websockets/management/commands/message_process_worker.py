@@ -19,7 +19,8 @@ logger.addHandler(console)
 class Command(BaseCommand):
 
     def add_arguments(self, parser):
-        parser.add_argument('--host', type=str, default=settings.REDIS_HOST)
+        # Single redis node for the worker, settings.REDIS_NODES / REDIS_SENTINELS are used when host is omitted
+        parser.add_argument('--host', type=str, default=None)
         parser.add_argument('--port', type=int, default=settings.REDIS_PORT)
         parser.add_argument('--subscribe_topic', type=str, required=True)
 
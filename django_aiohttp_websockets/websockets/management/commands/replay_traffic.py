@@ -0,0 +1,197 @@
+import asyncio
+import json
+import resource
+import uuid
+from collections import Counter, defaultdict
+
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand
+from rest_framework.authtoken.models import Token
+
+from django_aiohttp_websockets.chat.models import ChatRoom
+from django_aiohttp_websockets.websockets.core import settings, utils
+from django_aiohttp_websockets.websockets.core.recorder import (
+    CONNECT, DISCONNECT, FRAME, MESSAGE, TOKEN_ALIAS_PREFIX, read_log)
+
+
+def rss_kb():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() // 1024
+    except OSError:
+        # Peak instead of current size where /proc is not available
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class ReplayStats(object):
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.started = loop.time()
+        self.sent = 0
+        self.received = 0
+        self.in_flight = {}
+        self.latencies = []
+        self.responses = Counter()
+        self.recorded_responses = Counter()
+
+
+class ReplayWebSocket(object):
+    # Stands in for WebSocketResponse, responses to replayed messages are only measured
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.closed = False
+
+    def send_str(self, data):
+        self.stats.received += 1
+        msg = json.loads(data)
+        sent_at = self.stats.in_flight.pop(msg.get('uuid'), None)
+        if sent_at is not None:
+            self.stats.latencies.append(self.stats.loop.time() - sent_at)
+            self.stats.responses[(msg.get('action'), msg.get('status'))] += 1
+
+    def ping(self):
+        pass
+
+    async def close(self, code=None, message=None):
+        self.closed = True
+
+
+class Command(BaseCommand):
+    help = ('Replays a log written with TRAFFIC_RECORD_PATH against a local frontend and its workers, reporting '
+            'throughput, latency and memory. Every recorded user is replayed as a local test user, which is added '
+            'to the rooms of the log that exist locally.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('log', type=str)
+        parser.add_argument('--speed', type=float, default=1, help='Replay speed multiplier')
+        parser.add_argument('--duration', type=float, default=0, help='Seconds to run, the log is replayed in loop')
+        parser.add_argument('--report-interval', type=float, default=60)
+        parser.add_argument('--transport', type=str, default='inprocess', choices=['inprocess', 'redis'])
+
+    def handle(self, *args, **options):
+        settings.TRANSPORT = options['transport']
+        settings.TRAFFIC_RECORD_PATH = None
+        self.user_tokens = self.map_recorded_users(options['log'])
+        from django_aiohttp_websockets.websockets.core.server import WSApplication
+
+        app = WSApplication()
+        stats = ReplayStats(app.loop)
+        reporter = app.loop.create_task(self.report(app, stats, options['report_interval']))
+        try:
+            app.loop.run_until_complete(self.replay(app, stats, options))
+            # Let the workers answer the last messages
+            app.loop.run_until_complete(asyncio.sleep(settings.WS_DRAIN_INFLIGHT_TIMEOUT))
+        finally:
+            reporter.cancel()
+            for ws in list(app.websockets):
+                app.handle_ws_disconnect(ws)
+            app.loop.run_until_complete(app.shutdown())
+
+        self.write_report(app, stats, app.loop.time() - stats.started, stats.sent, stats.received)
+        self.stdout.write('Responses (action, status), replayed / recorded:')
+        for key in sorted(set(stats.responses) | set(stats.recorded_responses), key=str):
+            self.stdout.write('  %s: %s / %s' % (key, stats.responses[key], stats.recorded_responses[key]))
+
+    def map_recorded_users(self, path):
+        # Token aliases of the log to tokens of test users, created on the first replay of the log
+        aliases = {}
+        rooms = defaultdict(set)
+        for elapsed, kind, target, data in read_log(path):
+            try:
+                msg = json.loads(data) if kind == FRAME else None
+            except ValueError:
+                continue
+            if not isinstance(msg, dict):
+                continue
+            if str(msg.get('token', '')).startswith(TOKEN_ALIAS_PREFIX):
+                aliases[target] = msg['token']
+            elif target in aliases and msg.get('room'):
+                rooms[aliases[target]].add(msg['room'])
+
+        user_tokens = {}
+        for alias in set(aliases.values()):
+            user, _ = get_user_model().objects.get_or_create(username='replay-%s' % alias)
+            user_tokens[alias] = Token.objects.get_or_create(user=user)[0].key
+            for room in ChatRoom.objects.filter(pk__in=[room for room in rooms[alias] if self.is_room_id(room)]):
+                room.users.add(user)
+        return user_tokens
+
+    def is_room_id(self, value):
+        try:
+            uuid.UUID(str(value))
+        except ValueError:
+            return False
+        return True
+
+    async def replay(self, app, stats, options):
+        loop = app.loop
+        stats.started = loop.time()
+        iteration = 0
+        while True:
+            iteration_started = loop.time()
+            websockets = {}
+            for elapsed, kind, target, data in read_log(options['log']):
+                delay = iteration_started + elapsed / options['speed'] - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if options['duration'] and loop.time() - stats.started >= options['duration']:
+                    break
+
+                if kind == CONNECT:
+                    websockets[target] = ReplayWebSocket(stats)
+                    app.handle_ws_connect(websockets[target])
+                elif kind == FRAME and target in websockets:
+                    await self.replay_frame(app, stats, websockets[target], data, iteration)
+                elif kind == DISCONNECT and target in websockets:
+                    app.handle_ws_disconnect(websockets.pop(target))
+                elif kind == MESSAGE and iteration == 0:
+                    self.count_recorded_response(stats, data)
+
+            for ws in websockets.values():
+                app.handle_ws_disconnect(ws)
+            iteration += 1
+            if not options['duration'] or loop.time() - stats.started >= options['duration']:
+                return
+
+    async def replay_frame(self, app, stats, ws, data, iteration):
+        try:
+            msg = json.loads(data)
+        except ValueError:
+            return
+
+        if isinstance(msg, dict) and 'token' in msg:
+            msg['token'] = self.user_tokens.get(msg['token'], msg['token'])
+        # Every pass over the log needs its own message uuids
+        if isinstance(msg, dict) and msg.get('uuid'):
+            msg['uuid'] = '%s-%s' % (msg['uuid'], iteration)
+            stats.in_flight[msg['uuid']] = app.loop.time()
+        stats.sent += 1
+        app.handle_ws_frame(ws)
+        await app.publish_message_to_worker(ws, msg)
+
+    def count_recorded_response(self, stats, data):
+        msg = json.loads(data)
+        if msg.get('type') in (utils.SUCCESS_RESPONSE_TYPE, utils.ERROR_RESPONSE_TYPE) and 'response' in msg:
+            response = msg['response']
+            stats.recorded_responses[(response.get('action'), response.get('status'))] += 1
+
+    async def report(self, app, stats, interval):
+        try:
+            while True:
+                sent, received = stats.sent, stats.received
+                await asyncio.sleep(interval)
+                self.write_report(app, stats, interval, stats.sent - sent, stats.received - received)
+        except asyncio.CancelledError:
+            pass
+
+    def write_report(self, app, stats, period, sent, received):
+        latencies, stats.latencies = sorted(stats.latencies), []
+        p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0
+        p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0
+        self.stdout.write(
+            'sent %.1f/s, received %.1f/s, latency p50 %.1f ms p99 %.1f ms, rss %s KB, connections %s, '
+            'pending messages %s, unanswered %s' % (
+                sent / period, received / period, p50, p99, rss_kb(), len(app.websockets),
+                len(app.pending_messages), len(stats.in_flight)))
@@ -0,0 +1,106 @@
+import json
+import time
+from collections import defaultdict
+
+import redis
+from django.core.exceptions import ImproperlyConfigured
+
+from django_aiohttp_websockets.chat.models import ChatRoom
+from django_aiohttp_websockets.websockets.core import settings
+from django_aiohttp_websockets.websockets.core.directory import push_topic, user_nodes_key
+from django_aiohttp_websockets.websockets.core.sharding import shard_index
+
+
+# Server push for ordinary (synchronous) Django code: views, signals, background jobs. Users are looked up in the
+# directory kept by the frontends and every frontend holding some of them gets one message per batch.
+# Code running on the aiohttp loop must not call it, the redis client blocks.
+
+
+class Pusher(object):
+
+    def __init__(self):
+        self._clients = None
+
+    @property
+    def clients(self):
+        if self._clients is None:
+            if settings.TRANSPORT == 'inprocess':
+                raise ImproperlyConfigured('Server push needs the redis transport')
+
+            if settings.REDIS_SENTINELS:
+                from redis.sentinel import Sentinel
+                sentinel = Sentinel(settings.REDIS_SENTINELS)
+                self._clients = [sentinel.master_for(name) for name in settings.REDIS_SENTINEL_MASTERS]
+            else:
+                self._clients = [redis.StrictRedis(host=host, port=port) for host, port in settings.REDIS_NODES]
+        return self._clients
+
+    def _pipelines(self, keys):
+        pipelines = {}
+        for key in keys:
+            index = shard_index(key, len(self.clients))
+            if index not in pipelines:
+                pipelines[index] = self.clients[index].pipeline(transaction=False)
+        return pipelines
+
+    def _user_nodes(self, user_pks):
+        keys = [user_nodes_key(user_pk) for user_pk in user_pks]
+        pipelines = self._pipelines(keys)
+        results = defaultdict(list)
+        now = time.time()
+        for user_pk, key in zip(user_pks, keys):
+            pipelines[shard_index(key, len(self.clients))].zrangebyscore(key, now, '+inf')
+            results[shard_index(key, len(self.clients))].append(user_pk)
+
+        node_users = defaultdict(list)
+        for index, pipe in pipelines.items():
+            for user_pk, nodes in zip(results[index], pipe.execute()):
+                for node_id in nodes:
+                    node_users[node_id.decode('utf-8')].append(user_pk)
+        return node_users
+
+    def _publish(self, node_users, **fields):
+        topics = {node_id: push_topic(node_id) for node_id in node_users}
+        pipelines = self._pipelines(topics.values())
+        for node_id, users in node_users.items():
+            pipelines[shard_index(topics[node_id], len(self.clients))].publish(
+                topics[node_id], json.dumps(dict(fields, users=users)))
+
+        for pipe in pipelines.values():
+            pipe.execute()
+
+    def push_to_users(self, user_pks, payload, room=None):
+        # Returns the number of users connected to some frontend at the moment of the push
+        message = {'action': 'push', 'payload': payload}
+        if room is not None:
+            message['room'] = room
+
+        user_pks = list(set(user_pks))
+        connected = 0
+        for i in range(0, len(user_pks), settings.PUSH_BATCH_SIZE):
+            node_users = self._user_nodes(user_pks[i:i + settings.PUSH_BATCH_SIZE])
+            self._publish(node_users, message=message)
+            connected += len({user_pk for users in node_users.values() for user_pk in users})
+        return connected
+
+    def push_to_room(self, room, payload):
+        if not isinstance(room, ChatRoom):
+            room = ChatRoom.objects.get(pk=room)
+        return self.push_to_users(room.users.values_list('pk', flat=True), payload, room=room.pk.hex)
+
+    def leave_room(self, user_pks, room):
+        # Frontends stop delivering room messages to connections of users removed from the room
+        user_pks = list(set(user_pks))
+        for i in range(0, len(user_pks), settings.PUSH_BATCH_SIZE):
+            self._publish(self._user_nodes(user_pks[i:i + settings.PUSH_BATCH_SIZE]), leave_room=room)
+
+
+pusher = Pusher()
+
+
+def push_to_users(user_pks, payload):
+    return pusher.push_to_users(user_pks, payload)
+
+
+def push_to_room(room, payload):
+    return pusher.push_to_room(room, payload)
@@ -0,0 +1,192 @@
+import asyncio
+import json
+import logging
+import uuid
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.test import TransactionTestCase
+from rest_framework.authtoken.models import Token
+
+from django_aiohttp_websockets.chat.models import ChatRoom
+from django_aiohttp_websockets.websockets.core import settings
+from django_aiohttp_websockets.websockets.core.delivery import APPEND_TO_ROOM_BUFFER_SCRIPT
+
+User = get_user_model()
+logger = logging.getLogger(__name__)
+
+RESPONSE_TIMEOUT = 5
+
+
+class FakeWebSocket(object):
+    # Stands in for WebSocketResponse, keeps every frame sent to the client
+
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    def send_str(self, data):
+        self.sent.append(json.loads(data))
+
+    def ping(self):
+        pass
+
+    async def close(self, code=None, message=None):
+        self.closed = True
+
+    def responses(self, action):
+        return [msg for msg in self.sent if msg.get('action') == action]
+
+
+class FakeStorage(object):
+    # Just enough of the redis shards API for the room sequencer, resume and presence. Commands run right away and
+    # return completed futures, pipelines only group them.
+    supports_storage = True
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.values = {}
+        self.sorted_sets = defaultdict(dict)
+        self.published = []
+
+    def _done(self, value):
+        future = self.loop.create_future()
+        future.set_result(value)
+        return future
+
+    def _sorted(self, key):
+        return sorted(self.sorted_sets[key].items(), key=lambda item: item[1])
+
+    def pipeline(self):
+        return self
+
+    def for_key(self, key):
+        return self
+
+    async def execute(self):
+        pass
+
+    def get(self, key):
+        return self._done(self.values.get(key))
+
+    def hget(self, key, field):
+        return self._done(None)
+
+    def eval(self, script, keys, args):
+        assert script == APPEND_TO_ROOM_BUFFER_SCRIPT
+        sequence, buffer = keys
+        entry, size, _ = args
+        self.values[sequence] = int(self.values.get(sequence) or 0) + 1
+        self.sorted_sets[buffer][entry] = self.values[sequence]
+        self.sorted_sets[buffer] = dict(self._sorted(buffer)[-size:])
+        return self._done(self.values[sequence])
+
+    def zrange(self, key, start, stop, withscores=False):
+        return self._done(self._sorted(key)[start:stop + 1 or None])
+
+    def zrevrange(self, key, start, stop, withscores=False, encoding=None):
+        return self._done(list(reversed(self._sorted(key)))[start:stop + 1 or None])
+
+    def zrangebyscore(self, key, min=float('-inf'), max=float('inf'), withscores=False, encoding=None):
+        items = [(member, score) for member, score in self._sorted(key) if min <= score <= max]
+        return self._done(items if withscores else [member for member, _ in items])
+
+    def zadd(self, key, score, member):
+        self.sorted_sets[key][member] = score
+        return self._done(1)
+
+    def zrem(self, key, member):
+        return self._done(int(self.sorted_sets[key].pop(member, None) is not None))
+
+    def zremrangebyscore(self, key, max=float('inf')):
+        expired = [member for member, score in self.sorted_sets[key].items() if score <= max]
+        for member in expired:
+            del self.sorted_sets[key][member]
+        return self._done(len(expired))
+
+    def expire(self, key, timeout):
+        return self._done(1)
+
+    async def publish_json(self, topic, msg):
+        self.published.append((topic, msg))
+
+
+class PipelineTestCase(TransactionTestCase):
+    # Frontend and workers in one loop over the in-process transport. Workers run the ORM in executor threads, so
+    # test data has to be committed.
+    # Set, so the flush between tests truncates with cascade and reaches the message partitions
+    available_apps = [
+        'django.contrib.auth',
+        'django.contrib.contenttypes',
+        'rest_framework.authtoken',
+        'django_aiohttp_websockets.users',
+        'django_aiohttp_websockets.chat',
+        'django_aiohttp_websockets.websockets',
+    ]
+    patched_settings = ('TRANSPORT', )
+
+    def setUp(self):
+        self._settings = {name: getattr(settings, name) for name in self.patched_settings}
+        settings.TRANSPORT = 'inprocess'
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        from django_aiohttp_websockets.websockets.core.server import WSApplication
+        self.app = WSApplication(loop=self.loop)
+
+    def tearDown(self):
+        for ws in list(self.app.websockets):
+            self.app.handle_ws_disconnect(ws)
+        self.loop.run_until_complete(self.app.shutdown())
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        for name, value in self._settings.items():
+            setattr(settings, name, value)
+
+    def create_user(self, username):
+        user = User.objects.create_user(username=username, password='password')
+        Token.objects.create(user=user)
+        return user
+
+    def create_room(self, *users):
+        room = ChatRoom.objects.create()
+        room.users.add(*users)
+        return room
+
+    def connect(self):
+        ws = FakeWebSocket()
+        self.app.handle_ws_connect(ws)
+        return ws
+
+    async def _wait_for(self, ws, msg_uuid):
+        deadline = self.loop.time() + RESPONSE_TIMEOUT
+        while self.loop.time() < deadline:
+            for msg in ws.sent:
+                if msg.get('uuid') == msg_uuid:
+                    return msg
+            await asyncio.sleep(0.01)
+        self.fail('No response to message %s' % msg_uuid)
+
+    def send(self, ws, action, **fields):
+        msg = dict(fields, action=action, uuid=uuid.uuid4().hex)
+        self.loop.run_until_complete(self.app.publish_message_to_worker(ws, msg))
+        return self.loop.run_until_complete(self._wait_for(ws, msg['uuid']))
+
+    def authenticate(self, user):
+        ws = self.connect()
+        response = self.send(ws, 'authenticate', token=user.auth_token.key)
+        self.assertEqual(response['status'], 'success')
+        return ws
+
+    def settle(self, seconds=0.1):
+        self.loop.run_until_complete(asyncio.sleep(seconds))
+
+
+class ChatPipelineTestCase(PipelineTestCase):
+
+    def setUp(self):
+        super(ChatPipelineTestCase, self).setUp()
+        self.alice = self.create_user('alice')
+        self.bob = self.create_user('bob')
+        self.carol = self.create_user('carol')
+        self.room = self.create_room(self.alice, self.bob)
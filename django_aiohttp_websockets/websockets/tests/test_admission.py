@@ -0,0 +1,94 @@
+import asyncio
+import logging
+from types import SimpleNamespace
+
+from django.test import SimpleTestCase
+
+from django_aiohttp_websockets.websockets.core import settings
+from django_aiohttp_websockets.websockets.core.admission import AdmissionController
+from django_aiohttp_websockets.websockets.core.connections import ConnectionState
+
+logger = logging.getLogger(__name__)
+
+
+class FakeTransport(object):
+
+    def __init__(self, buffered, closing=False):
+        self.buffered = buffered
+        self.closing = closing
+
+    def get_write_buffer_size(self):
+        return self.buffered
+
+    def is_closing(self):
+        return self.closing
+
+
+class AdmissionControllerTest(SimpleTestCase):
+    patched_settings = ('WS_MAX_CONNECTIONS', 'WS_MAX_LOOP_LAG', 'WS_MAX_OUTBOUND_BUFFER', 'WS_SHED_LOOP_LAG',
+                        'WS_SHED_OUTBOUND_BUFFER')
+
+    def setUp(self):
+        self._settings = {name: getattr(settings, name) for name in self.patched_settings}
+        settings.WS_MAX_CONNECTIONS = 3
+        settings.WS_MAX_LOOP_LAG = 0.5
+        settings.WS_MAX_OUTBOUND_BUFFER = 1000
+        settings.WS_SHED_LOOP_LAG = 0.2
+        settings.WS_SHED_OUTBOUND_BUFFER = 100
+        self.loop = asyncio.new_event_loop()
+        self.app = SimpleNamespace(logger=logger, loop=self.loop, websockets={})
+        self.admission = AdmissionController(self.app)
+
+    def tearDown(self):
+        self.loop.close()
+        for name, value in self._settings.items():
+            setattr(settings, name, value)
+
+    def connect(self, transport=None):
+        self.app.websockets[object()] = ConnectionState(0, transport=transport)
+
+    def test_rejection_reason(self):
+        self.assertIsNone(self.admission.rejection_reason())
+
+        self.admission.outbound_buffer = 1001
+        self.assertEqual(self.admission.rejection_reason(), 'outbound_buffer')
+        self.admission.loop_lag = 0.6
+        self.assertEqual(self.admission.rejection_reason(), 'loop_lag')
+        for _ in range(3):
+            self.connect()
+        self.assertEqual(self.admission.rejection_reason(), 'too_many_connections')
+
+    def test_rejection_thresholds_are_exclusive(self):
+        self.admission.loop_lag = 0.5
+        self.admission.outbound_buffer = 1000
+        for _ in range(2):
+            self.connect()
+        self.assertIsNone(self.admission.rejection_reason())
+
+    def test_without_connection_limit(self):
+        settings.WS_MAX_CONNECTIONS = None
+        for _ in range(5):
+            self.connect()
+        self.assertIsNone(self.admission.rejection_reason())
+
+    def test_should_shed(self):
+        self.assertFalse(self.admission.should_shed('list_rooms'))
+
+        self.admission.loop_lag = 0.3
+        self.assertTrue(self.admission.should_shed('list_rooms'))
+        self.assertTrue(self.admission.should_shed('typing'))
+        self.assertFalse(self.admission.should_shed('new_message'))
+        self.assertFalse(self.admission.should_shed('ack'))
+
+        self.admission.loop_lag = 0
+        self.admission.outbound_buffer = 101
+        self.assertTrue(self.admission.should_shed('search_messages'))
+        self.admission.outbound_buffer = 100
+        self.assertFalse(self.admission.should_shed('search_messages'))
+
+    def test_outbound_buffer(self):
+        self.connect(FakeTransport(10))
+        self.connect(FakeTransport(20))
+        self.connect(FakeTransport(1000, closing=True))
+        self.connect()
+        self.assertEqual(self.admission._outbound_buffer(), 30)
@@ -0,0 +1,104 @@
+import asyncio
+import json
+import uuid
+from collections import Counter
+from types import SimpleNamespace
+
+from django.test import SimpleTestCase
+
+from django_aiohttp_websockets.websockets.core import settings
+from django_aiohttp_websockets.websockets.core.coalescing import BATCH_ACTION, FrameCoalescer
+from django_aiohttp_websockets.websockets.tests.base import ChatPipelineTestCase, FakeWebSocket
+
+
+def event(n):
+    return json.dumps({'action': 'new_message', 'n': n})
+
+
+class FrameCoalescerTest(SimpleTestCase):
+    patched_settings = ('WS_COALESCE_WINDOW', 'WS_COALESCE_MAX_EVENTS')
+
+    def setUp(self):
+        self._settings = {name: getattr(settings, name) for name in self.patched_settings}
+        settings.WS_COALESCE_WINDOW = 0.01
+        settings.WS_COALESCE_MAX_EVENTS = 3
+        self.loop = asyncio.new_event_loop()
+        self.ws = FakeWebSocket()
+        self.app = SimpleNamespace(loop=self.loop, websockets={self.ws: None}, metrics=Counter())
+        self.coalescer = FrameCoalescer(self.app)
+
+    def tearDown(self):
+        self.coalescer.close()
+        self.loop.close()
+        for name, value in self._settings.items():
+            setattr(settings, name, value)
+
+    def run_loop(self):
+        self.loop.run_until_complete(asyncio.sleep(0.02))
+
+    def test_single_event_is_sent_unwrapped(self):
+        self.coalescer.send(self.ws, event(1))
+        self.assertEqual(self.ws.sent, [])
+        self.run_loop()
+        self.assertEqual(self.ws.sent, [{'action': 'new_message', 'n': 1}])
+        self.assertEqual(self.app.metrics['frames_coalesced'], 0)
+
+    def test_events_within_window_are_batched(self):
+        self.coalescer.send(self.ws, event(1))
+        self.coalescer.send(self.ws, event(2))
+        self.run_loop()
+        self.assertEqual(self.ws.sent, [{'action': BATCH_ACTION, 'events': [
+            {'action': 'new_message', 'n': 1}, {'action': 'new_message', 'n': 2},
+        ]}])
+        self.assertEqual(self.app.metrics['frames_coalesced'], 1)
+
+    def test_batch_is_sent_at_max_events(self):
+        for n in range(4):
+            self.coalescer.send(self.ws, event(n))
+        # Sent without waiting for the window, the next event starts a new batch
+        self.assertEqual([len(frame['events']) for frame in self.ws.sent], [3])
+        self.run_loop()
+        self.assertEqual(self.ws.sent[1], {'action': 'new_message', 'n': 3})
+
+    def test_pending_batch_is_sent_before_direct_frame(self):
+        other_ws = FakeWebSocket()
+        self.app.websockets[other_ws] = None
+        self.coalescer.send(self.ws, event(1))
+        self.coalescer.send(other_ws, event(2))
+
+        self.coalescer.flush_ws(self.ws)
+        self.ws.send_str(json.dumps({'action': 'list_rooms'}))
+        self.assertEqual([frame['action'] for frame in self.ws.sent], ['new_message', 'list_rooms'])
+        # Other websockets keep their batch until the window ends
+        self.assertEqual(other_ws.sent, [])
+        self.run_loop()
+        self.assertEqual(other_ws.sent, [{'action': 'new_message', 'n': 2}])
+
+    def test_disconnected_websocket(self):
+        self.coalescer.send(self.ws, event(1))
+        del self.app.websockets[self.ws]
+        self.run_loop()
+        self.assertEqual(self.ws.sent, [])
+
+
+class CoalescedDeliveryTest(ChatPipelineTestCase):
+    patched_settings = ChatPipelineTestCase.patched_settings + ('WS_COALESCE_WINDOW', )
+
+    def setUp(self):
+        super(CoalescedDeliveryTest, self).setUp()
+        # Long enough that only a direct response sends the pending events
+        settings.WS_COALESCE_WINDOW = 60
+        self.app.coalescer = FrameCoalescer(self.app)
+
+    def test_room_event_before_direct_response(self):
+        alice_ws = self.authenticate(self.alice)
+        bob_ws = self.authenticate(self.bob)
+        # Response to the sender is a room event too, it waits in the batch like the others
+        msg = {'action': 'new_message', 'uuid': uuid.uuid4().hex, 'room': self.room.pk.hex, 'text': 'Hello'}
+        self.loop.run_until_complete(self.app.publish_message_to_worker(alice_ws, msg))
+        self.settle()
+        self.assertEqual(bob_ws.responses('new_message'), [])
+        self.assertEqual(alice_ws.responses('new_message'), [])
+
+        self.send(bob_ws, 'list_rooms')
+        self.assertEqual([msg['action'] for msg in bob_ws.sent[-2:]], ['new_message', 'list_rooms'])
@@ -0,0 +1,52 @@
+from django_aiohttp_websockets.chat.models import ChatRoomUserState
+from django_aiohttp_websockets.websockets.core import settings
+from django_aiohttp_websockets.websockets.tests.base import ChatPipelineTestCase
+
+
+class ListRoomsTest(ChatPipelineTestCase):
+    patched_settings = ChatPipelineTestCase.patched_settings + ('LARGE_ROOM_MEMBERS', )
+
+    def test_list_rooms_counters(self):
+        alice_ws = self.authenticate(self.alice)
+        bob_ws = self.authenticate(self.bob)
+        self.send(alice_ws, 'new_message', room=self.room.pk.hex, text='First')
+        self.send(alice_ws, 'new_message', room=self.room.pk.hex, text='Second')
+
+        rooms = self.send(bob_ws, 'list_rooms')['rooms']
+        self.assertEqual(len(rooms), 1)
+        self.assertEqual(rooms[0]['room'], self.room.pk.hex)
+        self.assertEqual(rooms[0]['member_count'], 2)
+        self.assertEqual(rooms[0]['unread_count'], 2)
+        self.assertEqual(rooms[0]['last_message']['text'], 'Second')
+        self.assertEqual(self.send(alice_ws, 'list_rooms')['rooms'][0]['unread_count'], 0)
+
+        self.send(bob_ws, 'select_room', room=self.room.pk.hex)
+        self.assertEqual(self.send(bob_ws, 'list_rooms')['rooms'][0]['unread_count'], 0)
+
+    def test_list_rooms_counters_of_large_room(self):
+        settings.LARGE_ROOM_MEMBERS = 2
+        alice_ws = self.authenticate(self.alice)
+        bob_ws = self.authenticate(self.bob)
+        self.send(alice_ws, 'new_message', room=self.room.pk.hex, text='First')
+        self.send(alice_ws, 'new_message', room=self.room.pk.hex, text='Second')
+
+        # Counter of other members is not updated per message, it is counted from the history
+        self.assertEqual(ChatRoomUserState.objects.get(room=self.room, user=self.bob).unread_count, 0)
+        self.assertEqual(self.send(bob_ws, 'list_rooms')['rooms'][0]['unread_count'], 2)
+        self.assertEqual(self.send(alice_ws, 'list_rooms')['rooms'][0]['unread_count'], 0)
+
+        self.send(bob_ws, 'select_room', room=self.room.pk.hex)
+        self.assertEqual(self.send(bob_ws, 'list_rooms')['rooms'][0]['unread_count'], 0)
+
+    def test_list_rooms_of_mixed_sizes(self):
+        settings.LARGE_ROOM_MEMBERS = 3
+        large_room = self.create_room(self.alice, self.bob, self.carol)
+        alice_ws = self.authenticate(self.alice)
+        bob_ws = self.authenticate(self.bob)
+        self.send(alice_ws, 'new_message', room=self.room.pk.hex, text='Small')
+        for text in ('One', 'Two', 'Three'):
+            self.send(alice_ws, 'new_message', room=large_room.pk.hex, text=text)
+
+        rooms = {room['room']: room for room in self.send(bob_ws, 'list_rooms')['rooms']}
+        self.assertEqual(rooms[self.room.pk.hex]['unread_count'], 1)
+        self.assertEqual(rooms[large_room.pk.hex]['unread_count'], 3)
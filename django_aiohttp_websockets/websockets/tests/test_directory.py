@@ -0,0 +1,76 @@
+import asyncio
+import logging
+from collections import Counter
+from types import SimpleNamespace
+
+from django.test import SimpleTestCase
+
+from django_aiohttp_websockets.websockets.core.directory import UserDirectory, user_nodes_key
+from django_aiohttp_websockets.websockets.tests.base import FakeStorage, FakeWebSocket
+
+logger = logging.getLogger(__name__)
+
+
+class UserDirectoryTest(SimpleTestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.storage = FakeStorage(self.loop)
+        self.app = SimpleNamespace(logger=logger, loop=self.loop, transport=self.storage, node_id='node-a',
+                                   user_websockets={}, metrics=Counter())
+        self.directory = UserDirectory(self.app)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_loop(self):
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+
+    def nodes(self, user_pk):
+        return self.storage.sorted_sets[user_nodes_key(user_pk)]
+
+    def test_add_and_remove(self):
+        self.directory.add(1)
+        self.directory.add(2)
+        self.run_loop()
+        self.assertEqual(list(self.nodes(1)), ['node-a'])
+        self.assertEqual(list(self.nodes(2)), ['node-a'])
+
+        self.directory.remove(1)
+        self.run_loop()
+        self.assertEqual(self.nodes(1), {})
+        self.assertEqual(list(self.nodes(2)), ['node-a'])
+
+    def test_last_change_within_one_flush_wins(self):
+        self.directory.add(1)
+        self.directory.remove(1)
+        self.directory.remove(2)
+        self.directory.add(2)
+        self.run_loop()
+        self.assertEqual(self.nodes(1), {})
+        self.assertEqual(list(self.nodes(2)), ['node-a'])
+
+    def test_refresh(self):
+        self.app.user_websockets = {1: {FakeWebSocket()}}
+        self.directory.add(1)
+        self.run_loop()
+        expire_at = self.nodes(1)['node-a']
+
+        self.loop.run_until_complete(self.directory.refresh())
+        self.assertGreater(self.nodes(1)['node-a'], expire_at)
+
+    def test_without_storage(self):
+        self.storage.supports_storage = False
+        self.directory.add(1)
+        self.run_loop()
+        self.assertEqual(self.storage.sorted_sets, {})
+
+    def test_process_push(self):
+        first_ws, second_ws, other_ws = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        self.app.user_websockets = {1: {first_ws, second_ws}, 2: {other_ws}}
+        self.directory.process_push({'users': [1, 3], 'message': {'action': 'push', 'payload': {'n': 1}}})
+
+        self.assertEqual(first_ws.sent, [{'action': 'push', 'payload': {'n': 1}}])
+        self.assertEqual(second_ws.sent, [{'action': 'push', 'payload': {'n': 1}}])
+        self.assertEqual(other_ws.sent, [])
+        self.assertEqual(self.app.metrics['push_delivered'], 2)
@@ -0,0 +1,33 @@
+from django_aiohttp_websockets.websockets.core import settings
+from django_aiohttp_websockets.websockets.tests.base import ChatPipelineTestCase
+
+
+class LargeRoomTest(ChatPipelineTestCase):
+    patched_settings = ChatPipelineTestCase.patched_settings + ('LARGE_ROOM_MEMBERS', )
+
+    def setUp(self):
+        super(LargeRoomTest, self).setUp()
+        settings.LARGE_ROOM_MEMBERS = 2
+
+    def test_new_message_fan_out(self):
+        alice_ws = self.authenticate(self.alice)
+        bob_ws = self.authenticate(self.bob)
+        other_bob_ws = self.authenticate(self.bob)
+        self.send(bob_ws, 'select_room', room=self.room.pk.hex)
+
+        self.send(alice_ws, 'new_message', room=self.room.pk.hex, text='Hello')
+        self.settle()
+        # Delivered to connections which selected the room and the sender only
+        self.assertEqual(len(bob_ws.responses('new_message')), 1)
+        self.assertEqual(other_bob_ws.responses('new_message'), [])
+
+    def test_removed_member(self):
+        alice_ws = self.authenticate(self.alice)
+        bob_ws = self.authenticate(self.bob)
+        self.send(bob_ws, 'select_room', room=self.room.pk.hex)
+
+        self.app.directory.process_push({'leave_room': self.room.pk.hex, 'users': [self.bob.pk]})
+        self.assertNotIn(bob_ws, self.app.presence.room_websockets.get(self.room.pk.hex, ()))
+        self.send(alice_ws, 'new_message', room=self.room.pk.hex, text='Hello')
+        self.settle()
+        self.assertEqual(bob_ws.responses('new_message'), [])
@@ -0,0 +1,44 @@
+from django_aiohttp_websockets.websockets.tests.base import ChatPipelineTestCase
+
+
+class ChatPipelineTest(ChatPipelineTestCase):
+
+    def test_authenticate(self):
+        ws = self.authenticate(self.alice)
+        self.assertEqual(self.app.websockets[ws].user_pk, self.alice.pk)
+        self.assertEqual(self.app.user_websockets[self.alice.pk], {ws})
+
+    def test_authenticate_invalid_token(self):
+        ws = self.connect()
+        response = self.send(ws, 'authenticate', token='invalid')
+        self.assertEqual(response['status'], 'error')
+        self.assertIsNone(self.app.websockets[ws].user_pk)
+
+    def test_select_room(self):
+        ws = self.authenticate(self.alice)
+        response = self.send(ws, 'select_room', room=self.room.pk.hex)
+        self.assertEqual(response['status'], 'success')
+        self.assertEqual(response['room_messages'], [])
+        self.assertIn(ws, self.app.presence.room_websockets[self.room.pk.hex])
+
+    def test_select_room_of_other_users(self):
+        ws = self.authenticate(self.carol)
+        response = self.send(ws, 'select_room', room=self.room.pk.hex)
+        self.assertEqual(response['status'], 'error')
+        self.assertNotIn(self.room.pk.hex, self.app.presence.room_websockets)
+
+    def test_new_message_fan_out(self):
+        alice_ws = self.authenticate(self.alice)
+        bob_ws = self.authenticate(self.bob)
+        carol_ws = self.authenticate(self.carol)
+
+        response = self.send(alice_ws, 'new_message', room=self.room.pk.hex, text='Hello')
+        self.assertEqual(response['status'], 'success')
+        self.assertEqual(response['message']['text'], 'Hello')
+        self.settle()
+        self.assertEqual([msg['message']['text'] for msg in bob_ws.responses('new_message')], ['Hello'])
+        self.assertEqual(carol_ws.responses('new_message'), [])
+
+        # History of the room includes the message
+        response = self.send(bob_ws, 'select_room', room=self.room.pk.hex)
+        self.assertEqual([msg['text'] for msg in response['room_messages']], ['Hello'])
@@ -0,0 +1,84 @@
+import asyncio
+import logging
+import time
+import uuid
+from types import SimpleNamespace
+
+from django.test import SimpleTestCase
+
+from django_aiohttp_websockets.websockets.core import settings
+from django_aiohttp_websockets.websockets.core.connections import ConnectionState
+from django_aiohttp_websockets.websockets.core.presence import PresenceManager
+from django_aiohttp_websockets.websockets.tests.base import FakeStorage, FakeWebSocket
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceTest(SimpleTestCase):
+    # Two frontends sharing the presence storage
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.storage = FakeStorage(self.loop)
+        self.room = uuid.uuid4().hex
+        self.node_a = self.create_frontend('node-a')
+        self.node_b = self.create_frontend('node-b')
+
+    def tearDown(self):
+        self.loop.close()
+
+    def create_frontend(self, node_id):
+        app = SimpleNamespace(logger=logger, loop=self.loop, transport=self.storage, websockets={}, node_id=node_id)
+        return PresenceManager(app)
+
+    def join(self, presence, user_pk):
+        ws = FakeWebSocket()
+        presence.app.websockets[ws] = ConnectionState(0)
+        presence.app.websockets[ws].update_session({'user_pk': user_pk})
+        presence.join(ws, self.room)
+        return ws
+
+    def flush(self, presence):
+        self.storage.published = []
+        self.loop.run_until_complete(presence.flush())
+        return [
+            (event['user_pk'], event['status'])
+            for _, msg in self.storage.published for event in msg['rooms'].get(self.room, ())
+        ]
+
+    def test_join_and_leave(self):
+        ws = self.join(self.node_a, 1)
+        self.assertEqual(self.flush(self.node_a), [(1, PresenceManager.ONLINE)])
+        self.assertEqual(list(self.storage.sorted_sets[self.node_a._key(self.room)]), ['1:node-a'])
+
+        self.node_a.leave(ws)
+        self.assertEqual(self.flush(self.node_a), [(1, PresenceManager.OFFLINE)])
+        self.assertEqual(self.storage.sorted_sets[self.node_a._key(self.room)], {})
+
+    def test_leave_while_connected_through_other_frontend(self):
+        ws_a = self.join(self.node_a, 1)
+        ws_b = self.join(self.node_b, 1)
+        self.flush(self.node_a)
+        self.flush(self.node_b)
+
+        self.node_a.leave(ws_a)
+        self.assertEqual(self.flush(self.node_a), [])
+
+        self.node_b.leave(ws_b)
+        self.assertEqual(self.flush(self.node_b), [(1, PresenceManager.OFFLINE)])
+
+    def test_expired_member_while_connected_through_other_frontend(self):
+        self.join(self.node_a, 2)
+        self.flush(self.node_a)
+        key = self.node_a._key(self.room)
+        # Left behind by a frontend that went away
+        self.storage.sorted_sets[key]['1:node-c'] = time.time() - 1
+        self.storage.sorted_sets[key]['1:node-b'] = time.time() + settings.PRESENCE_TTL
+
+        self.loop.run_until_complete(self.node_a.refresh())
+        self.assertEqual(self.flush(self.node_a), [])
+
+        self.storage.sorted_sets[key]['1:node-c'] = time.time() - 1
+        del self.storage.sorted_sets[key]['1:node-b']
+        self.loop.run_until_complete(self.node_a.refresh())
+        self.assertEqual(self.flush(self.node_a), [(1, PresenceManager.OFFLINE)])
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from django_aiohttp_websockets.websockets.core import settings
+from django_aiohttp_websockets.websockets.core.publisher import BatchingPublisher
+
+logger = logging.getLogger(__name__)
+
+
+class FakePipeline(object):
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.commands = []
+
+    def publish(self, topic, data):
+        self.commands.append((topic, data))
+
+    async def execute(self):
+        self.pool.attempts += 1
+        if self.pool.down:
+            raise ConnectionRefusedError('Connection refused')
+        self.pool.batches.append(self.commands)
+        return [self.pool.receivers] * len(self.commands)
+
+
+class FakePool(object):
+    # Redis pool whose pipelines record published batches, or fail while the pool is down
+
+    def __init__(self):
+        self.batches = []
+        self.attempts = 0
+        self.down = False
+        self.receivers = 1
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class BatchingPublisherTest(SimpleTestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.pool = FakePool()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def create_publisher(self, **kwargs):
+        return BatchingPublisher(self.pool, logger, self.loop, **kwargs)
+
+    def run_loop(self, seconds=0):
+        self.loop.run_until_complete(asyncio.sleep(seconds))
+
+    def test_publishes_of_one_iteration_are_batched(self):
+        publisher = self.create_publisher(flush_delay=0)
+        futures = [publisher.publish_json('topic', {'n': n}) for n in range(3)]
+        self.assertEqual(self.pool.batches, [])
+
+        self.run_loop(0.01)
+        self.assertEqual(self.pool.batches, [[('topic', '{"n": %s}' % n) for n in range(3)]])
+        self.assertEqual([future.result() for future in futures], [1, 1, 1])
+
+    def test_full_batch_is_flushed_right_away(self):
+        publisher = self.create_publisher(max_batch_size=2, flush_delay=1)
+        publisher.publish('topic', 'a')
+        publisher.publish('topic', 'b')
+        publisher.publish('topic', 'c')
+
+        self.run_loop()
+        self.assertEqual(self.pool.batches, [[('topic', 'a'), ('topic', 'b')]])
+        self.assertEqual(len(publisher.pending), 1)
+
+    def test_flush_delay(self):
+        publisher = self.create_publisher(flush_delay=0.05)
+        publisher.publish('topic', 'a')
+        self.run_loop(0.01)
+        publisher.publish('topic', 'b')
+        self.assertEqual(self.pool.batches, [])
+
+        self.run_loop(0.06)
+        self.assertEqual(self.pool.batches, [[('topic', 'a'), ('topic', 'b')]])
+
+    def test_close_flushes_pending_publishes(self):
+        publisher = self.create_publisher(flush_delay=1)
+        future = publisher.publish('topic', 'a')
+        self.loop.run_until_complete(publisher.close())
+        self.assertEqual(self.pool.batches, [[('topic', 'a')]])
+        self.assertEqual(future.result(), 1)
+
+
+class PublisherOutageTest(SimpleTestCase):
+    patched_settings = ('REDIS_OUTAGE_BUFFER_SIZE', 'REDIS_RECONNECT_MIN_DELAY', 'REDIS_RECONNECT_MAX_DELAY')
+
+    def setUp(self):
+        self._settings = {name: getattr(settings, name) for name in self.patched_settings}
+        settings.REDIS_OUTAGE_BUFFER_SIZE = 3
+        settings.REDIS_RECONNECT_MIN_DELAY = 0.01
+        settings.REDIS_RECONNECT_MAX_DELAY = 0.04
+        self.loop = asyncio.new_event_loop()
+        self.pool = FakePool()
+        self.pool.down = True
+        self.publisher = BatchingPublisher(self.pool, logger, self.loop, flush_delay=0)
+
+    def tearDown(self):
+        self.loop.close()
+        for name, value in self._settings.items():
+            setattr(settings, name, value)
+
+    def run_loop(self, seconds=0.01):
+        self.loop.run_until_complete(asyncio.sleep(seconds))
+
+    def test_outage_buffering(self):
+        future = self.publisher.publish('topic', 'a')
+        self.run_loop()
+        # Callers are not kept waiting for redis to come back
+        self.assertIsNone(future.result())
+        self.assertFalse(self.publisher.healthy)
+        self.assertEqual(list(self.publisher.backlog), [('topic', 'a')])
+
+        for data in ('b', 'c', 'd'):
+            self.assertIsNone(self.publisher.publish('topic', data).result())
+        self.assertEqual(list(self.publisher.backlog), [('topic', 'b'), ('topic', 'c'), ('topic', 'd')])
+        self.assertEqual(self.publisher.dropped, 1)
+
+        self.pool.down = False
+        self.run_loop(0.1)
+        self.assertTrue(self.publisher.healthy)
+        self.assertEqual(self.pool.batches, [[('topic', 'b'), ('topic', 'c'), ('topic', 'd')]])
+        self.assertEqual(len(self.publisher.backlog), 0)
+
+    def test_retry_backoff(self):
+        delays = []
+        call_later = self.loop.call_later
+
+        def record_call_later(delay, callback, *args):
+            if callback == self.publisher.flush:
+                delays.append(delay)
+            return call_later(delay, callback, *args)
+
+        with mock.patch('random.uniform', return_value=1), \
+                mock.patch.object(self.loop, 'call_later', side_effect=record_call_later):
+            self.publisher.publish('topic', 'a')
+            self.run_loop(0.2)
+            self.assertEqual(delays[:4], [0.01, 0.02, 0.04, 0.04])
+
+            # Delays start over after redis is back
+            self.pool.down = False
+            self.run_loop(0.05)
+            self.pool.down = True
+            del delays[:]
+            self.publisher.publish('topic', 'b')
+            self.run_loop(0.005)
+            self.assertEqual(delays, [0.01])
@@ -0,0 +1,102 @@
+import json
+import time
+from collections import defaultdict
+
+from django.test import SimpleTestCase
+
+from django_aiohttp_websockets.websockets.core import settings
+from django_aiohttp_websockets.websockets.core.directory import push_topic, user_nodes_key
+from django_aiohttp_websockets.websockets.core.sharding import shard_index
+from django_aiohttp_websockets.websockets.push import Pusher
+
+
+class FakeRedisPipeline(object):
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def zrangebyscore(self, key, min, max):
+        self.commands.append(lambda: [
+            member for member, score in self.client.sorted_sets[key].items() if float(min) <= score <= float(max)])
+
+    def publish(self, topic, data):
+        def publish():
+            self.client.published.append((topic, json.loads(data)))
+            return 1
+        self.commands.append(publish)
+
+    def execute(self):
+        return [command() for command in self.commands]
+
+
+class FakeRedis(object):
+    # Synchronous redis client of one shard
+
+    def __init__(self):
+        self.sorted_sets = defaultdict(dict)
+        self.published = []
+
+    def pipeline(self, transaction=True):
+        return FakeRedisPipeline(self)
+
+
+class PusherTest(SimpleTestCase):
+
+    def setUp(self):
+        self.batch_size = settings.PUSH_BATCH_SIZE
+        self.clients = [FakeRedis(), FakeRedis()]
+        self.pusher = Pusher()
+        self.pusher._clients = self.clients
+        now = time.time()
+        self.connect(1, 'node-a', now + 10)
+        self.connect(2, 'node-a', now + 10)
+        self.connect(2, 'node-b', now + 10)
+        self.connect(3, 'node-b', now + 10)
+        # Left behind by a frontend that went away
+        self.connect(4, 'node-c', now - 10)
+
+    def tearDown(self):
+        settings.PUSH_BATCH_SIZE = self.batch_size
+
+    def connect(self, user_pk, node_id, expire_at):
+        key = user_nodes_key(user_pk)
+        self.clients[shard_index(key, len(self.clients))].sorted_sets[key][node_id.encode('utf-8')] = expire_at
+
+    def published(self):
+        # Node topics and their messages, every topic is published on its own shard
+        published = defaultdict(list)
+        for index, client in enumerate(self.clients):
+            for topic, msg in client.published:
+                self.assertEqual(shard_index(topic, len(self.clients)), index)
+                published[topic].append(msg)
+        return published
+
+    def test_push_to_users(self):
+        connected = self.pusher.push_to_users([1, 2, 3, 4, 5], {'n': 1})
+        self.assertEqual(connected, 3)
+
+        published = self.published()
+        self.assertEqual(set(published), {push_topic('node-a'), push_topic('node-b')})
+        message = {'action': 'push', 'payload': {'n': 1}}
+        self.assertEqual([(sorted(msg['users']), msg['message']) for msg in published[push_topic('node-a')]],
+                         [([1, 2], message)])
+        self.assertEqual([(sorted(msg['users']), msg['message']) for msg in published[push_topic('node-b')]],
+                         [([2, 3], message)])
+
+    def test_push_in_batches(self):
+        settings.PUSH_BATCH_SIZE = 2
+        self.assertEqual(self.pusher.push_to_users([1, 2, 3], {'n': 1}), 3)
+
+        # One message per node and batch
+        published = self.published()
+        users = {topic: sorted(user_pk for msg in messages for user_pk in msg['users'])
+                 for topic, messages in published.items()}
+        self.assertEqual(users, {push_topic('node-a'): [1, 2], push_topic('node-b'): [2, 3]})
+        self.assertEqual(sum(len(messages) for messages in published.values()), 3)
+
+    def test_leave_room(self):
+        self.pusher.leave_room([1, 3], 'room')
+        published = self.published()
+        self.assertEqual(published[push_topic('node-a')], [{'leave_room': 'room', 'users': [1]}])
+        self.assertEqual(published[push_topic('node-b')], [{'leave_room': 'room', 'users': [3]}])
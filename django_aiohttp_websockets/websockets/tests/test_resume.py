@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import uuid
+from itertools import count
+from types import SimpleNamespace
+
+from django.test import SimpleTestCase
+
+from django_aiohttp_websockets.websockets.core import settings, utils
+from django_aiohttp_websockets.websockets.core.connections import ConnectionState
+from django_aiohttp_websockets.websockets.core.delivery import DeliveryTracker, RoomSequencer
+from django_aiohttp_websockets.websockets.tests.base import FakeStorage, FakeWebSocket
+
+logger = logging.getLogger(__name__)
+
+
+class ResumeTest(SimpleTestCase):
+    # Worker side sequencing and frontend side resume over the same room buffer
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.storage = FakeStorage(self.loop)
+        self.sequencer = RoomSequencer(self.storage, logger)
+        self.app = SimpleNamespace(logger=logger, transport=self.storage, websockets={})
+        self.delivery = DeliveryTracker(self.app)
+        self.room = uuid.uuid4().hex
+        self.message_ids = count(1)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def connect(self, user_pk):
+        ws = FakeWebSocket()
+        self.app.websockets[ws] = ConnectionState(0)
+        self.app.websockets[ws].update_session({'user_pk': user_pk})
+        return ws
+
+    def stamp(self, text, send_to=None, send_to_room=None):
+        message = {'id': next(self.message_ids), 'text': text}
+        response_msg = utils.success_response(
+            {'action': 'new_message', 'uuid': uuid.uuid4().hex},
+            response={'room': self.room, 'message': message}, send_to=send_to, send_to_room=send_to_room,
+        )
+        self.loop.run_until_complete(self.sequencer.stamp_many([response_msg]))
+        return response_msg['response']['seq']
+
+    def resume(self, ws, last_seq):
+        response_msg = utils.success_response({'action': 'resume', 'uuid': uuid.uuid4().hex},
+                                              response={'room': self.room, 'last_seq': last_seq})
+        return self.loop.run_until_complete(self.delivery.resume(ws, response_msg['response']))['response']
+
+    def select_room(self, *message_ids):
+        response_msg = utils.success_response(
+            {'action': 'select_room', 'uuid': uuid.uuid4().hex},
+            response={'room': self.room, 'room_messages': [{'id': message_id} for message_id in message_ids]},
+        )
+        self.loop.run_until_complete(self.sequencer.stamp_many([response_msg]))
+        return response_msg['response']['seq']
+
+    def test_resume_after_gap(self):
+        self.assertEqual([self.stamp(text, send_to=[1, 2]) for text in ('a', 'b', 'c')], [1, 2, 3])
+        response = self.resume(self.connect(1), last_seq=1)
+        self.assertEqual([(msg['seq'], msg['message']['text']) for msg in response['messages']], [(2, 'b'), (3, 'c')])
+        self.assertEqual(response['seq'], 3)
+        self.assertFalse(response['resync_required'])
+
+    def test_resume_skips_messages_of_other_users(self):
+        self.stamp('before join', send_to=[1])
+        self.stamp('after join', send_to=[1, 2])
+        self.stamp('large room', send_to_room=self.room)
+        response = self.resume(self.connect(2), last_seq=0)
+        self.assertEqual([msg['message']['text'] for msg in response['messages']], ['after join', 'large room'])
+
+    def test_resume_after_buffer_overflow(self):
+        buffer_size = settings.ROOM_BUFFER_SIZE
+        settings.ROOM_BUFFER_SIZE = 2
+        try:
+            for text in ('a', 'b', 'c', 'd'):
+                self.stamp(text, send_to=[1])
+        finally:
+            settings.ROOM_BUFFER_SIZE = buffer_size
+
+        response = self.resume(self.connect(1), last_seq=1)
+        self.assertEqual([msg['seq'] for msg in response['messages']], [3, 4])
+        self.assertTrue(response['resync_required'])
+
+    def test_select_room_seq(self):
+        for text in ('a', 'b', 'c'):
+            self.stamp(text, send_to=[1])
+        self.assertEqual(self.select_room(1, 2, 3), 3)
+
+    def test_select_room_seq_of_stale_history(self):
+        for text in ('a', 'b', 'c', 'd'):
+            self.stamp(text, send_to=[1])
+        # Replica history without the latest messages, or a message committed before the other one
+        self.assertEqual(self.select_room(1, 2), 2)
+        self.assertEqual(self.select_room(1, 2, 4), 2)
+        self.assertEqual(self.select_room(), 0)
+
+        # Resume from the snapshot seq delivers the messages missing from the history
+        response = self.resume(self.connect(1), last_seq=self.select_room(1, 2))
+        self.assertEqual([msg['message']['text'] for msg in response['messages']], ['c', 'd'])
+
+    def test_select_room_seq_of_messages_out_of_the_window(self):
+        window = settings.SNAPSHOT_SEQ_WINDOW
+        settings.SNAPSHOT_SEQ_WINDOW = 2
+        try:
+            for text in ('a', 'b', 'c', 'd'):
+                self.stamp(text, send_to=[1])
+            # Only the latest buffered messages are checked, older ones are assumed to be in the history
+            self.assertEqual(self.select_room(3, 4), 4)
+        finally:
+            settings.SNAPSHOT_SEQ_WINDOW = window
@@ -0,0 +1,93 @@
+import time
+from unittest import mock
+
+from django.db import DatabaseError
+from django.test import SimpleTestCase, override_settings
+
+from django_aiohttp_websockets.websockets.core import routers, settings
+
+
+class StubLagMonitor(object):
+
+    def __init__(self, **lags):
+        self.lags = lags
+
+    def check(self, alias):
+        return self.lags.get(alias, 0) <= settings.DB_REPLICA_MAX_LAG
+
+
+class FailingConnection(object):
+
+    def cursor(self):
+        raise DatabaseError('Connection refused')
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1', 'replica_2'])
+class ReplicaRouterTest(SimpleTestCase):
+
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+
+    def db_for_read(self, enabled=True, session_data=None, **lags):
+        with mock.patch.object(routers, 'lag_monitor', StubLagMonitor(**lags)):
+            with routers.replica_reads(enabled, session_data):
+                return self.router.db_for_read(None)
+
+    def test_reads_outside_of_replica_reads(self):
+        self.assertIsNone(self.router.db_for_read(None))
+        self.assertIsNone(self.db_for_read(enabled=False))
+
+    def test_replica_reads(self):
+        self.assertIn(self.db_for_read(), ['replica_1', 'replica_2'])
+        self.assertIsNone(self.router.db_for_write(None))
+
+    def test_sticky_after_write(self):
+        self.assertIsNone(self.db_for_read(session_data=routers.mark_write({'user_pk': 1})))
+        last_write = time.time() - settings.DB_REPLICA_STICKY_TIME - 1
+        self.assertIsNotNone(self.db_for_read(session_data={'user_pk': 1, 'last_write': last_write}))
+
+    def test_lagging_replicas_are_skipped(self):
+        lag = settings.DB_REPLICA_MAX_LAG + 1
+        self.assertEqual(self.db_for_read(replica_1=lag), 'replica_2')
+        # Primary when every replica lags
+        self.assertIsNone(self.db_for_read(replica_1=lag, replica_2=lag))
+
+    def test_nested_replica_reads(self):
+        with mock.patch.object(routers, 'lag_monitor', StubLagMonitor()):
+            with routers.replica_reads(True):
+                with routers.replica_reads(False):
+                    self.assertIsNone(self.router.db_for_read(None))
+                self.assertIsNotNone(self.router.db_for_read(None))
+
+    def test_no_migrations_on_replicas(self):
+        self.assertTrue(self.router.allow_migrate('default', 'chat'))
+        self.assertFalse(self.router.allow_migrate('replica_1', 'chat'))
+
+
+class ReplicaLagMonitorTest(SimpleTestCase):
+
+    def setUp(self):
+        self.monitor = routers.ReplicaLagMonitor()
+
+    def test_usable(self):
+        self.assertFalse(self.monitor.usable('replica'))
+        self.monitor.update('replica', settings.DB_REPLICA_MAX_LAG)
+        self.assertTrue(self.monitor.usable('replica'))
+        self.monitor.update('replica', settings.DB_REPLICA_MAX_LAG + 1)
+        self.assertFalse(self.monitor.usable('replica'))
+        self.monitor.update('replica', None)
+        self.assertFalse(self.monitor.usable('replica'))
+
+    def test_check_interval(self):
+        self.assertTrue(self.monitor.needs_check('replica'))
+        self.monitor.update('replica', 0)
+        self.assertFalse(self.monitor.needs_check('replica'))
+
+        checked_at = time.monotonic() - settings.DB_REPLICA_LAG_CHECK_INTERVAL - 1
+        self.monitor.checks['replica'] = (checked_at, 0)
+        self.assertTrue(self.monitor.needs_check('replica'))
+
+    def test_unreachable_replica(self):
+        with mock.patch.object(routers, 'connections', {'replica': FailingConnection()}):
+            self.assertFalse(self.monitor.check('replica'))
+        self.assertIsNone(self.monitor.checks['replica'][1])
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from django_aiohttp_websockets.websockets.core import settings
+from django_aiohttp_websockets.websockets.core.subscriber import RedisSubscriber
+
+logger = logging.getLogger(__name__)
+
+
+class FakeChannel(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.messages = asyncio.Queue()
+
+    async def wait_message(self):
+        message = await self.messages.get()
+        if message is None:
+            return False
+        self.messages.put_nowait(message)
+        return True
+
+    async def get(self):
+        return self.messages.get_nowait()
+
+
+class FakeConnection(object):
+    # Subscriber connection, closing it ends its channels like a connection dropped by redis
+
+    def __init__(self):
+        self.channels = {}
+        self.unsubscribed = []
+        self.closed = False
+
+    async def subscribe(self, *topics):
+        self.channels = {topic: FakeChannel(topic) for topic in topics}
+        return list(self.channels.values())
+
+    async def unsubscribe(self, *topics):
+        self.unsubscribed.extend(topics)
+
+    def close(self):
+        self.closed = True
+        for channel in self.channels.values():
+            channel.messages.put_nowait(None)
+
+    async def wait_closed(self):
+        pass
+
+
+class RedisSubscriberTest(SimpleTestCase):
+    patched_settings = ('REDIS_RECONNECT_MIN_DELAY', 'REDIS_RECONNECT_MAX_DELAY')
+
+    def setUp(self):
+        self._settings = {name: getattr(settings, name) for name in self.patched_settings}
+        settings.REDIS_RECONNECT_MIN_DELAY = 0.01
+        settings.REDIS_RECONNECT_MAX_DELAY = 0.01
+        self.loop = asyncio.new_event_loop()
+        self.connections = []
+        self.failures = 0
+        self.received = []
+
+        patcher = mock.patch('aioredis.create_redis', side_effect=self.create_redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.subscriber = RedisSubscriber(self.resolve_address, logger, self.loop)
+        self.subscriber.subscribe('topic', self.handler)
+
+    def tearDown(self):
+        self.loop.close()
+        for name, value in self._settings.items():
+            setattr(settings, name, value)
+
+    async def resolve_address(self):
+        return ('localhost', 6379)
+
+    async def create_redis(self, address, loop=None):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionRefusedError('Connection refused')
+        self.connections.append(FakeConnection())
+        return self.connections[-1]
+
+    async def handler(self, raw_msg):
+        if raw_msg == b'fail':
+            raise ValueError(raw_msg)
+        self.received.append(raw_msg)
+
+    def run_loop(self, seconds=0.05):
+        self.loop.run_until_complete(asyncio.sleep(seconds))
+
+    def start(self):
+        task = self.loop.create_task(self.subscriber.run())
+        self.run_loop()
+        return task
+
+    def stop(self, task):
+        task.cancel()
+        self.loop.run_until_complete(task)
+
+    def test_messages_reach_handlers(self):
+        task = self.start()
+        self.assertTrue(self.subscriber.healthy)
+        channel = self.connections[-1].channels['topic']
+        for raw_msg in (b'a', b'fail', b'b'):
+            channel.messages.put_nowait(raw_msg)
+        self.run_loop()
+        # A failing handler does not stop the channel
+        self.assertEqual(self.received, [b'a', b'b'])
+
+        self.stop(task)
+        self.assertEqual(self.connections[-1].unsubscribed, ['topic'])
+        self.assertTrue(self.connections[-1].closed)
+        self.assertFalse(self.subscriber.healthy)
+
+    def test_resubscribe_after_connection_is_closed(self):
+        task = self.start()
+        self.connections[-1].close()
+        self.run_loop()
+
+        self.assertEqual(len(self.connections), 2)
+        self.assertEqual(self.subscriber.reconnects, 1)
+        self.assertTrue(self.subscriber.healthy)
+        self.connections[-1].channels['topic'].messages.put_nowait(b'a')
+        self.run_loop()
+        self.assertEqual(self.received, [b'a'])
+        self.stop(task)
+
+    def test_reconnect_after_failed_connect(self):
+        self.failures = 2
+        task = self.start()
+        self.assertEqual(len(self.connections), 1)
+        self.assertEqual(self.subscriber.reconnects, 2)
+        self.assertTrue(self.subscriber.healthy)
+        self.stop(task)
+
+    def test_stop_while_reconnecting(self):
+        self.failures = 1
+        settings.REDIS_RECONNECT_MIN_DELAY = settings.REDIS_RECONNECT_MAX_DELAY = 10
+        task = self.loop.create_task(self.subscriber.run())
+        self.run_loop()
+        self.assertFalse(self.subscriber.healthy)
+
+        self.stop(task)
+        self.assertIsNone(task.result())
+        self.assertEqual(self.connections, [])
@@ -0,0 +1,39 @@
+import uuid
+
+from django_aiohttp_websockets.websockets.core import utils
+from django_aiohttp_websockets.websockets.tests.base import PipelineTestCase
+
+
+class FrontendValidationTest(PipelineTestCase):
+    # Rejected messages are answered by the frontend and never reach a worker
+
+    def publish(self, ws, msg):
+        published = self.app.transport.published
+        self.loop.run_until_complete(self.app.publish_message_to_worker(ws, msg))
+        self.assertEqual(self.app.transport.published, published)
+        self.assertEqual(ws.sent[-1]['status'], 'error')
+        return ws.sent[-1]['error_message']
+
+    def test_missing_required_keys(self):
+        ws = self.connect()
+        self.assertEqual(self.publish(ws, {'action': 'authenticate'}), utils.ERROR_MESSAGES['invalid_message_format'])
+        self.assertEqual(self.publish(ws, 'not a dict'), utils.ERROR_MESSAGES['invalid_message_format'])
+
+    def test_unknown_action(self):
+        ws = self.connect()
+        self.assertIn('Invalid message action', self.publish(ws, {'action': 'drop_tables', 'uuid': '1'}))
+
+    def test_action_required_keys(self):
+        ws = self.connect()
+        self.assertIn('token', self.publish(ws, {'action': 'authenticate', 'uuid': '1'}))
+
+    def test_authentication_required(self):
+        ws = self.connect()
+        error_message = self.publish(ws, {'action': 'select_room', 'uuid': '1', 'room': uuid.uuid4().hex})
+        self.assertEqual(error_message, utils.ERROR_MESSAGES['authentication_required'])
+
+    def test_resume_needs_storage(self):
+        ws = self.connect()
+        self.app.websockets[ws].update_session({'user_pk': 1})
+        error_message = self.publish(ws, {'action': 'resume', 'uuid': '1', 'room': uuid.uuid4().hex})
+        self.assertIn('Invalid message action', error_message)
@@ -0,0 +1,70 @@
+import asyncio
+import json
+import logging
+import uuid
+
+from django.test import SimpleTestCase
+
+from django_aiohttp_websockets.websockets.core.registry import registry
+from django_aiohttp_websockets.websockets.core.transports import InProcessTransport
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerSchedulingTest(SimpleTestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        from django_aiohttp_websockets.websockets.core.worker import AioredisWorker
+        self.worker = AioredisWorker(None, None, 'worker_process_test', logger, loop=self.loop,
+                                     transport=InProcessTransport(logger, self.loop))
+        self.processed = []
+        self.running = []
+        self.release = asyncio.Event()
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.worker.stop())
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def enqueue(self, action):
+        msg = {'action': action, 'uuid': uuid.uuid4().hex}
+        self.loop.run_until_complete(self.worker.enqueue(json.dumps(msg).encode('utf-8')))
+        return msg
+
+    async def process_batch(self, messages):
+        for msg in messages:
+            self.running.append(msg['action'])
+            await self.release.wait()
+            self.running.remove(msg['action'])
+            self.processed.append(msg['action'])
+
+    def test_priority(self):
+        self.enqueue('search_messages')
+        self.enqueue('list_rooms')
+        self.enqueue('new_message')
+        self.enqueue('authenticate')
+        order = [self.worker.queue.get_nowait()[-1]['action'] for _ in range(4)]
+        # Interactive actions first, same priority in arrival order
+        self.assertEqual(order, ['new_message', 'authenticate', 'search_messages', 'list_rooms'])
+
+    def test_action_concurrency(self):
+        limit = registry.get('select_room').concurrency
+        self.worker.process_batch = self.process_batch
+        self.worker.slots = asyncio.Semaphore(limit + 2)
+        self.worker.tasks.append(self.loop.create_task(self.worker.dispatch()))
+        for _ in range(limit + 3):
+            self.enqueue('select_room')
+        self.enqueue('new_message')
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+
+        # Waiting history loads don't hold slots, so the message behind them is already running
+        self.assertEqual(self.running.count('select_room'), limit)
+        self.assertIn('new_message', self.running)
+        self.assertEqual(len(self.worker.deferred['select_room']), 3)
+
+        self.release.set()
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+        self.assertEqual(sorted(self.processed), sorted(['select_room'] * (limit + 3) + ['new_message']))
+        self.assertEqual(self.worker.running_actions['select_room'], 0)